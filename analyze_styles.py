@@ -1,12 +1,17 @@
 import argparse
 import base64
+import hashlib
 import json
+import mmap
 import os
+import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 from typing import Optional, Tuple
 
-import requests
+from catalog import Catalog
+from llm_client import PACKED_PROMPT, BackgroundLLMClient, effective_pack
+from ocr_cache import DEFAULT_OCR_CACHE, OcrCache, prompt_key
 
 try:
     from PIL import Image  # type: ignore
@@ -22,6 +27,24 @@ BASE_URL = os.environ.get("OPENAI_BASE_URL", "http://14.103.60.158:3001/")
 API_KEY = os.environ.get("OPENAI_API_KEY")
 MODEL = os.environ.get("MODEL", "gemini-2.5-flash")
 
+SYSTEM_PROMPT = "You are a text extraction assistant."
+PROMPT_TEXT = (
+    "Extract every piece of visible text (Chinese or English) from the provided screenshot. "
+    "List them in the order they appear."
+)
+
+# set by main() (or spider_pipeline); None disables the OCR result cache
+OCR_CACHE: Optional[OcrCache] = None
+
+# LLM client settings, read when the shared client is first used
+LLM_CONCURRENCY = int(os.environ.get("WORKERS", "3"))
+IMAGES_PER_REQUEST = int(os.environ.get("IMAGES_PER_REQUEST", "1"))
+TOKEN_BUDGET = int(os.environ.get("LLM_TOKEN_BUDGET", "4000"))
+LLM_RPM = int(os.environ.get("LLM_RPM", "0"))
+
+_llm: Optional[BackgroundLLMClient] = None
+_llm_lock = threading.Lock()
+
 
 def _detect_mime(raw: bytes) -> str:
     if raw.startswith(b"\x89PNG\r\n\x1a\n"):
@@ -33,55 +56,91 @@ def _detect_mime(raw: bytes) -> str:
     return "application/octet-stream"
 
 
+def _shrink_pil(img) -> Tuple[str, str]:
+    img = img.convert("RGB")
+    img.thumbnail((800, 800))
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=60)
+    return base64.b64encode(buf.getvalue()).decode("utf-8"), "image/jpeg"
+
+
 def shrink_image_b64(image_b64: str) -> Tuple[str, str]:
     raw = base64.b64decode(image_b64)
     if not _PIL_OK:
         return image_b64, _detect_mime(raw)
 
     with Image.open(io.BytesIO(raw)) as img:
-        img = img.convert("RGB")
-        img.thumbnail((800, 800))
-        buf = io.BytesIO()
-        img.save(buf, format="JPEG", quality=60)
-    return base64.b64encode(buf.getvalue()).decode("utf-8"), "image/jpeg"
+        return _shrink_pil(img)
+
+
+def shrink_image_file(path: str) -> Tuple[str, str]:
+    """Same as shrink_image_b64 for a note['image_files'] entry: the file is mmap'ed, not read into memory."""
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if not _PIL_OK:
+            return base64.b64encode(mm).decode("utf-8"), _detect_mime(mm[:12])
+        with Image.open(mm) as img:
+            return _shrink_pil(img)
+
+
+def resolve_image_ref(ref, catalog=None) -> Optional[str]:
+    """Local path of an image_files entry: its own path, else the file the catalog holds under its sha256."""
+    if not isinstance(ref, dict):
+        return None
+    path = ref.get("path")
+    if path and os.path.isfile(path):
+        return path
+    sha256 = ref.get("sha256")
+    if sha256 and catalog is not None:
+        found = catalog.media_by_sha256(sha256)
+        if found and os.path.isfile(found):
+            return found
+    return None
+
+
+def image_ref_index(ref, default: int) -> int:
+    """1-based image_list position of an image_files entry (older refs without "index" are positional)."""
+    if isinstance(ref, dict) and isinstance(ref.get("index"), int):
+        return ref["index"]
+    return default
+
+
+def _llm_client() -> BackgroundLLMClient:
+    global _llm
+    with _llm_lock:
+        if _llm is None:
+            _llm = BackgroundLLMClient(
+                BASE_URL,
+                API_KEY,
+                MODEL,
+                system_prompt=SYSTEM_PROMPT,
+                prompt=PROMPT_TEXT,
+                concurrency=LLM_CONCURRENCY,
+                images_per_request=IMAGES_PER_REQUEST,
+                token_budget=TOKEN_BUDGET,
+                requests_per_minute=LLM_RPM,
+            )
+        return _llm
+
+
+def ocr_thread_count(concurrency: int) -> int:
+    """
+    Caller threads needed to keep `concurrency` requests busy: each thread waits on one image, so
+    packing N images per request only fills its batches with N times as many threads.
+    """
+    return max(1, int(concurrency)) * effective_pack(IMAGES_PER_REQUEST, TOKEN_BUDGET)
+
+
+def close_llm_client() -> None:
+    global _llm
+    with _llm_lock:
+        if _llm is not None:
+            _llm.close()
+            _llm = None
 
 
 def call_llm_for_image(image_b64: str, mime: str, idx: int) -> str:
-    api_url = f"{BASE_URL.rstrip('/')}/v1/chat/completions"
-    headers = {
-        "Authorization": f"Bearer {API_KEY}",
-        "Content-Type": "application/json",
-    }
-    prompt_text = (
-        "Extract every piece of visible text (Chinese or English) from the provided screenshot. "
-        "List them in the order they appear."
-    )
-    message_content = [
-        {"type": "text", "text": prompt_text},
-        {
-            "type": "image_url",
-            "image_url": {
-                "url": f"data:{mime};base64,{image_b64}",
-                "description": f"Image {idx}",
-            },
-        },
-    ]
-    payload = {
-        "model": MODEL,
-        "messages": [
-            {"role": "system", "content": "You are a text extraction assistant."},
-            {"role": "user", "content": message_content},
-        ],
-        "temperature": 0.2,
-        "max_tokens": 1024,
-    }
-    resp = requests.post(api_url, headers=headers, json=payload, timeout=90)
-    resp.raise_for_status()
-    body = resp.json()
-    choices = body.get("choices") or []
-    if not choices:
-        return ""
-    return (choices[0].get("message", {}) or {}).get("content", "").strip()
+    """Blocking call for the worker threads; the request itself goes through the shared pooled async client."""
+    return _llm_client().extract_text(image_b64, mime, idx)
 
 
 def write_results(path: Path, records: list[dict]):
@@ -132,27 +191,98 @@ def _default_merged_path(input_path: Path) -> Path:
     return input_path.with_name(f"{input_path.stem}_no_images{input_path.suffix}")
 
 
-def _upsert_extracted(existing: list[dict], record: dict) -> list[dict]:
-    note_id = _normalize_note_id(record.get("note_id"))
-    if not note_id:
-        return existing
-    out: list[dict] = []
-    replaced = False
-    for r in existing:
-        if isinstance(r, dict) and _normalize_note_id(r.get("note_id")) == note_id:
-            if not replaced:
-                out.append({"note_id": note_id, "images": record.get("images") or []})
-                replaced = True
-            continue
-        out.append(r)
-    if not replaced:
-        out.append({"note_id": note_id, "images": record.get("images") or []})
-    return out
+def _journal_path(result_path: Path) -> Path:
+    return result_path.with_name(f"{result_path.stem}.journal.jsonl")
+
+
+def load_results(result_path: Path) -> dict[str, list[dict]]:
+    """
+    note_id -> extracted images, from the compacted results JSON plus any journal a previous run left behind
+    (later entries win, first position kept).
+    """
+    results: dict[str, list[dict]] = {}
+    if result_path.exists():
+        with result_path.open(encoding="utf-8") as f:
+            try:
+                loaded = json.load(f)
+            except json.JSONDecodeError:
+                loaded = []
+        for r in loaded if isinstance(loaded, list) else []:
+            if not isinstance(r, dict):
+                continue
+            note_id = _normalize_note_id(r.get("note_id"))
+            if note_id:
+                results[note_id] = r.get("images") or []
+    journal = _journal_path(result_path)
+    if journal.exists():
+        with journal.open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    r = json.loads(line)
+                except json.JSONDecodeError:
+                    continue     # torn last line of an interrupted run
+                note_id = _normalize_note_id(r.get("note_id")) if isinstance(r, dict) else None
+                if note_id:
+                    results[note_id] = r.get("images") or []
+    return results
+
+
+class ResultsJournal:
+    """
+    Append-only JSONL journal of per-note results with an in-memory index. Each note costs one appended
+    line; the results JSON is rewritten once, by compact(), instead of after every note.
+    """
+
+    def __init__(self, result_path: Path) -> None:
+        self.result_path = result_path
+        self.path = _journal_path(result_path)
+        self.results = load_results(result_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._f = self.path.open("a", encoding="utf-8")
+
+    def add(self, note_id: str, images: list[dict]) -> None:
+        self.results[note_id] = images
+        self._f.write(json.dumps({"note_id": note_id, "images": images}, ensure_ascii=False) + "\n")
+        self._f.flush()
+
+    def compact(self) -> None:
+        self._f.close()
+        write_results(self.result_path, [{"note_id": k, "images": v} for k, v in self.results.items()])
+        self.path.unlink(missing_ok=True)
+
+
+def _ocr_prompt_key() -> str:
+    # packed requests use a different prompt (and parse a JSON array), so their answers are cached apart
+    if effective_pack(IMAGES_PER_REQUEST, TOKEN_BUDGET) > 1:
+        return prompt_key(SYSTEM_PROMPT, PROMPT_TEXT, PACKED_PROMPT)
+    return prompt_key(SYSTEM_PROMPT, PROMPT_TEXT)
+
+
+def _ocr(idx: int, image_sha256: str, shrink) -> str:
+    """LLM text for one image; answers are cached by the sha256 of the original bytes + model + prompt."""
+    def _call() -> str:
+        shrunk, mime = shrink()
+        return call_llm_for_image(shrunk, mime, idx)
+
+    if OCR_CACHE is None:
+        return _call()
+    return OCR_CACHE.get_or_compute(image_sha256, MODEL, _ocr_prompt_key(), _call)
+
+
+def _file_sha256(path: str) -> str:
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return hashlib.sha256(mm).hexdigest()
 
 
 def process_image_task(idx: int, raw_b64: str) -> str:
-    shrunk, mime = shrink_image_b64(raw_b64)
-    return call_llm_for_image(shrunk, mime, idx)
+    digest = hashlib.sha256(base64.b64decode(raw_b64)).hexdigest()
+    return _ocr(idx, digest, lambda: shrink_image_b64(raw_b64))
+
+
+def process_image_file_task(idx: int, path: Optional[str]) -> str:
+    if not path:
+        raise FileNotFoundError("image file not found (path missing and no catalog match)")
+    return _ocr(idx, _file_sha256(path), lambda: shrink_image_file(path))
 
 
 def parse_args():
@@ -177,12 +307,31 @@ def parse_args():
     parser.add_argument(
         "--keep-image-base64",
         action="store_true",
-        help="Keep image_base64 when writing merged notes output (default: removed, i.e. *_no_images.json style)",
+        help="Keep image_base64 / image_files when writing merged notes output (default: removed, i.e. *_no_images.json style)",
+    )
+    parser.add_argument(
+        "--catalog",
+        help="Catalog (.catalog.sqlite3) used to find note['image_files'] entries by sha256 when their path has moved",
+    )
+    parser.add_argument(
+        "--ocr-cache",
+        default=DEFAULT_OCR_CACHE,
+        help=f"SQLite cache of OCR results keyed by image sha256 + model + prompt (default: {DEFAULT_OCR_CACHE})",
+    )
+    parser.add_argument("--no-ocr-cache", action="store_true", help="Always call the LLM, even for images seen before")
+    parser.add_argument(
+        "--images-per-request",
+        type=int,
+        default=IMAGES_PER_REQUEST,
+        help="Pack up to this many images into one LLM request (bounded by --token-budget; default: 1)",
     )
+    parser.add_argument("--token-budget", type=int, default=TOKEN_BUDGET, help="Prompt-token budget of a packed request")
+    parser.add_argument("--rpm", type=int, default=LLM_RPM, help="Max LLM requests per minute (default: unlimited)")
     return parser.parse_args()
 
 
 def main():
+    global OCR_CACHE, LLM_CONCURRENCY, IMAGES_PER_REQUEST, TOKEN_BUDGET, LLM_RPM
     args = parse_args()
     if not args.skip_images and API_KEY is None:
         raise SystemExit("set OPENAI_API_KEY before running")
@@ -197,81 +346,111 @@ def main():
         raise SystemExit(f"{json_path} must contain a JSON list of notes")
 
     result_path = Path(args.extract_file) if args.extract_file else (Path(args.output_dir) / f"{args.output_name}.json")
-    existing: list[dict] = []
-    if result_path.exists():
-        with result_path.open(encoding="utf-8") as f:
-            try:
-                loaded = json.load(f)
-                existing = loaded if isinstance(loaded, list) else []
-            except json.JSONDecodeError:
-                existing = []
+    catalog = None
+    if args.catalog:
+        catalog = Catalog(args.catalog)
+
+    if not args.skip_images and not args.no_ocr_cache:
+        OCR_CACHE = OcrCache(args.ocr_cache)
 
     worker_count = int(os.environ.get("WORKERS", "3"))
     selected = set(args.note_ids) if args.note_ids else None
+    LLM_CONCURRENCY = worker_count
+    IMAGES_PER_REQUEST = args.images_per_request
+    TOKEN_BUDGET = args.token_budget
+    LLM_RPM = args.rpm
 
-    extracted_by_id: dict[str, list[dict]] = {}
-    for r in existing:
-        if not isinstance(r, dict):
-            continue
-        note_id = _normalize_note_id(r.get("note_id"))
-        if not note_id:
-            continue
-        extracted_by_id[note_id] = r.get("images") or []
-
-    for note in notes:
-        if not isinstance(note, dict):
-            continue
-        note_id = _normalize_note_id(note.get("note_id"))
-        if not note_id:
-            continue
-        if selected and note_id not in selected:
-            continue
-
-        extracted = extracted_by_id.get(note_id, [])
-        if not args.skip_images:
-            extracted = []
-            images = list(enumerate(note.get("image_base64", []) or [], 1))
-            if images:
-                print(f"[{note_id}] processing {len(images)} image(s) with {worker_count} worker(s)")
-                with ThreadPoolExecutor(max_workers=worker_count) as executor:
-                    future_to_idx = {executor.submit(process_image_task, idx, raw_b64): idx for idx, raw_b64 in images}
-                    for future in as_completed(future_to_idx):
-                        idx = future_to_idx[future]
-                        try:
-                            text = future.result()
-                            extracted.append({"index": idx, "text": text})
-                            print(f"[{note_id}] image {idx} done")
-                        except Exception as exc:
-                            print(f"[{note_id}] image {idx} failed: {exc}")
-                            extracted.append({"index": idx, "text": ""})
+    journal = None if args.skip_images else ResultsJournal(result_path)
+    extracted_by_id = journal.results if journal is not None else load_results(result_path)
+    touched = 0
 
+    def _finish(note: dict, note_id: str, extracted: list[dict]) -> None:
+        nonlocal touched
         extracted.sort(key=lambda x: x["index"])
-        if not args.skip_images:
-            record = {"note_id": note_id, "images": extracted}
-            existing = _upsert_extracted(existing, record)
-            extracted_by_id[note_id] = extracted
-            write_results(result_path, existing)
-            print(f"[{note_id}] saved {len(extracted)} image texts to {result_path}")
-
+        if journal is not None:
+            journal.add(note_id, extracted)
+            print(f"[{note_id}] saved {len(extracted)} image texts")
         if args.update_input_file:
             note["images"] = _build_images(_normalize_image_list(note.get("image_list")), extracted)
-            write_results(json_path, notes)
-
-        if args.merge_notes or args.merge_output_file:
-            merged_path = Path(args.merge_output_file) if args.merge_output_file else _default_merged_path(json_path)
-            merged_notes: list[dict] = []
-            for n in notes:
-                if not isinstance(n, dict):
-                    continue
-                nid = _normalize_note_id(n.get("note_id")) or ""
-                merged = dict(n)
-                merged["images"] = _build_images(_normalize_image_list(n.get("image_list")), extracted_by_id.get(nid, []))
-                if not args.keep_image_base64 and "image_base64" in merged:
-                    merged.pop("image_base64", None)
-                merged_notes.append(merged)
-            write_results(merged_path, merged_notes)
-            print(f"[{note_id}] updated merged notes JSON at {merged_path}")
-
+        touched += 1
+
+    # One queue of (note, image index) tasks for the whole input, served by a single pool: small notes
+    # no longer leave workers idle, and a note is saved as soon as its last image comes back.
+    thread_count = ocr_thread_count(worker_count)
+    with ThreadPoolExecutor(max_workers=thread_count) as executor:
+        future_to_task = {}
+        pending: dict[int, list] = {}     # position in notes -> [note, note_id, images left, extracted]
+        for pos, note in enumerate(notes):
+            if not isinstance(note, dict):
+                continue
+            note_id = _normalize_note_id(note.get("note_id"))
+            if not note_id:
+                continue
+            if selected and note_id not in selected:
+                continue
+
+            if args.skip_images:
+                _finish(note, note_id, list(extracted_by_id.get(note_id, [])))
+                continue
+            images = list(enumerate(note.get("image_base64", []) or [], 1))
+            task = process_image_task
+            if not images and note.get("image_files"):
+                # reference mode: only paths travel through the JSON, bytes are mapped when a worker needs them
+                images = [(image_ref_index(ref, idx), resolve_image_ref(ref, catalog)) for idx, ref in enumerate(note["image_files"], 1)]
+                task = process_image_file_task
+            if not images:
+                _finish(note, note_id, [])
+                continue
+            pending[pos] = [note, note_id, len(images), []]
+            for idx, payload in images:
+                future_to_task[executor.submit(task, idx, payload)] = (pos, idx)
+
+        if future_to_task:
+            print(f"processing {len(future_to_task)} image(s) from {len(pending)} note(s) with {worker_count} worker(s) ({thread_count} thread(s))")
+        for future in as_completed(future_to_task):
+            pos, idx = future_to_task.pop(future)
+            entry = pending[pos]
+            note_id = entry[1]
+            try:
+                text = future.result()
+                entry[3].append({"index": idx, "text": text})
+                print(f"[{note_id}] image {idx} done")
+            except Exception as exc:
+                print(f"[{note_id}] image {idx} failed: {exc}")
+                entry[3].append({"index": idx, "text": ""})
+            entry[2] -= 1
+            if entry[2] == 0:
+                del pending[pos]
+                _finish(entry[0], note_id, entry[3])
+
+    close_llm_client()
+    if OCR_CACHE is not None:
+        print(f"OCR cache: {OCR_CACHE.hits} hit(s), {OCR_CACHE.misses} LLM call(s)")
+        OCR_CACHE.close()
+        OCR_CACHE = None
+
+    # Interrupted runs keep their journal and pick it up next time; the JSON files below are written once.
+    if journal is not None:
+        journal.compact()
+        print(f"saved image texts for {len(extracted_by_id)} note(s) to {result_path}")
+    if args.update_input_file and touched:
+        write_results(json_path, notes)
+        print(f"updated {json_path}")
+    if (args.merge_notes or args.merge_output_file) and touched:
+        merged_path = Path(args.merge_output_file) if args.merge_output_file else _default_merged_path(json_path)
+        merged_notes: list[dict] = []
+        for n in notes:
+            if not isinstance(n, dict):
+                continue
+            nid = _normalize_note_id(n.get("note_id")) or ""
+            merged = dict(n)
+            merged["images"] = _build_images(_normalize_image_list(n.get("image_list")), extracted_by_id.get(nid, []))
+            if not args.keep_image_base64:
+                merged.pop("image_base64", None)
+                merged.pop("image_files", None)
+            merged_notes.append(merged)
+        write_results(merged_path, merged_notes)
+        print(f"wrote merged notes JSON to {merged_path}")
     print("All notes processed.")
 
 
@@ -0,0 +1,377 @@
+import json
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple, Union
+
+
+CATALOG_FILENAME = ".catalog.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id        INTEGER PRIMARY KEY AUTOINCREMENT,
+    screen_name   TEXT NOT NULL,
+    mode          TEXT,
+    run_key       TEXT,
+    started_at    INTEGER NOT NULL,
+    finished_at   INTEGER,
+    status        TEXT,
+    tweets        INTEGER NOT NULL DEFAULT 0,
+    media         INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS tweets (
+    tweet_id      TEXT PRIMARY KEY,
+    owner         TEXT,
+    author        TEXT,
+    created_at_ms INTEGER,
+    lang          TEXT,
+    text          TEXT,
+    tweet_url     TEXT,
+    timeline      TEXT,
+    run_id        INTEGER,
+    record        TEXT
+);
+CREATE TABLE IF NOT EXISTS tweet_owners (
+    owner         TEXT NOT NULL,
+    timeline      TEXT NOT NULL DEFAULT '',
+    tweet_id      TEXT NOT NULL,
+    created_at_ms INTEGER,
+    run_id        INTEGER,
+    PRIMARY KEY (owner, timeline, tweet_id)
+);
+"""
+
+# one row per downloaded copy: the same media saved into several users' folders keeps every copy
+_MEDIA_TABLE = """
+CREATE TABLE IF NOT EXISTS media (
+    media_url     TEXT NOT NULL,
+    tweet_id      TEXT,
+    owner         TEXT,
+    media_type    TEXT,
+    media_id_str  TEXT,
+    local_path    TEXT NOT NULL DEFAULT '',
+    size          INTEGER,
+    sha256        TEXT,
+    downloaded_at INTEGER,
+    run_id        INTEGER,
+    phash         TEXT,
+    duplicate_of  TEXT,
+    PRIMARY KEY (media_url, local_path)
+);
+"""
+
+# created after the migrations below, so upgraded catalogs get every index as well
+_INDEXES = """
+CREATE INDEX IF NOT EXISTS tweets_owner_created ON tweets (owner, created_at_ms);
+CREATE INDEX IF NOT EXISTS tweets_author_created ON tweets (author, created_at_ms);
+CREATE INDEX IF NOT EXISTS tweets_created ON tweets (created_at_ms);
+CREATE INDEX IF NOT EXISTS tweet_owners_newest ON tweet_owners (owner, created_at_ms);
+CREATE INDEX IF NOT EXISTS tweet_owners_timeline_newest ON tweet_owners (owner, timeline, created_at_ms);
+CREATE INDEX IF NOT EXISTS tweet_owners_tweet ON tweet_owners (tweet_id);
+CREATE INDEX IF NOT EXISTS tweet_owners_run ON tweet_owners (run_id);
+CREATE INDEX IF NOT EXISTS media_tweet ON media (tweet_id);
+CREATE INDEX IF NOT EXISTS media_owner ON media (owner);
+CREATE INDEX IF NOT EXISTS media_sha256 ON media (sha256);
+CREATE INDEX IF NOT EXISTS media_duplicate_of ON media (duplicate_of);
+CREATE INDEX IF NOT EXISTS media_local_path ON media (local_path);
+"""
+
+# columns added after the first release; created via ALTER TABLE so older catalogs are upgraded in place
+_MEDIA_MIGRATIONS = (
+    ("phash", "TEXT"),
+    ("duplicate_of", "TEXT"),
+)
+
+
+# exportable tweet fields -> SQL expression (record-only fields are read with json_extract)
+TWEET_COLUMNS = {
+    "tweet_id": "tweet_id",
+    "owner": "owner",
+    "author": "author",
+    "created_at_ms": "created_at_ms",
+    "lang": "lang",
+    "text": "text",
+    "tweet_url": "tweet_url",
+    "timeline": "timeline",
+    "conversation_id_str": "json_extract(record, '$.conversation_id_str')",
+    "in_reply_to_status_id_str": "json_extract(record, '$.in_reply_to_status_id_str')",
+    "record": "record",
+}
+
+
+def _norm_user(screen_name: Optional[str]) -> Optional[str]:
+    if not screen_name:
+        return None
+    return str(screen_name).strip().lstrip("@").lower()
+
+
+class Catalog:
+    """
+    SQLite catalog of everything crawled under one save root: crawl runs, tweets (with the full
+    rich record as JSON, linked to every owner/timeline they were seen in) and downloaded media
+    (one row per local copy: path, size, sha256).
+
+    Writes are buffered in one open transaction and committed every `batch_size` rows
+    (and on flush/close), so a crawl pays for one fsync per batch rather than per row.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike], *, batch_size: int = 200) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.batch_size = max(1, int(batch_size))
+        self._pending = 0
+        self.conn = sqlite3.connect(str(self.path))
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        tables = {row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        self.conn.executescript(_SCHEMA + _MEDIA_TABLE)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(media)")}
+        for name, decl in _MEDIA_MIGRATIONS:
+            if name not in columns:
+                self.conn.execute(f"ALTER TABLE media ADD COLUMN {name} {decl}")
+        self.conn.commit()
+        self._rekey_media()
+        if "tweets" in tables and "tweet_owners" not in tables:
+            # catalogs from before the owner links: every tweet belongs to the owner it was stored under
+            self.conn.execute(
+                "INSERT OR IGNORE INTO tweet_owners (owner, timeline, tweet_id, created_at_ms, run_id)"
+                " SELECT owner, COALESCE(timeline, ''), tweet_id, created_at_ms, run_id FROM tweets WHERE owner IS NOT NULL"
+            )
+        self.conn.executescript(_INDEXES)
+        self.conn.commit()
+
+    def _rekey_media(self) -> None:
+        """Rebuild a media table keyed on media_url alone (one copy per URL) into the per-copy layout, in one transaction."""
+        info = list(self.conn.execute("PRAGMA table_info(media)"))
+        if [row[1] for row in sorted(info, key=lambda r: r[5]) if row[5]] != ["media_url"]:
+            return
+        columns = [row[1] for row in info]
+        indexes = [row[0] for row in self.conn.execute("SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'media' AND sql IS NOT NULL")]
+        select = ", ".join("COALESCE(local_path, '')" if c == "local_path" else c for c in columns)
+        self.conn.executescript(
+            "BEGIN;"
+            "ALTER TABLE media RENAME TO media_v1;"
+            + "".join(f"DROP INDEX {name};" for name in indexes)
+            + _MEDIA_TABLE
+            + f"INSERT INTO media ({', '.join(columns)}) SELECT {select} FROM media_v1;"
+            "DROP TABLE media_v1;"
+            "COMMIT;"
+        )
+
+    @classmethod
+    def open_root(cls, save_root: Union[str, os.PathLike], **kwargs: Any) -> "Catalog":
+        return cls(Path(save_root) / CATALOG_FILENAME, **kwargs)
+
+    def _wrote(self, n: int = 1) -> None:
+        self._pending += n
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        if self._pending:
+            self.conn.commit()
+            self._pending = 0
+
+    def close(self) -> None:
+        self.flush()
+        self.conn.close()
+
+    # ---- runs ----
+
+    def start_run(self, screen_name: str, *, mode: Optional[str] = None, run_key: Optional[str] = None) -> int:
+        cur = self.conn.execute(
+            "INSERT INTO runs (screen_name, mode, run_key, started_at) VALUES (?, ?, ?, ?)",
+            (_norm_user(screen_name), mode, run_key, int(time.time())),
+        )
+        self.conn.commit()
+        return int(cur.lastrowid)
+
+    def finish_run(self, run_id: int, status: Any) -> None:
+        self.conn.execute(
+            "UPDATE runs SET finished_at = ?, status = ?,"
+            " tweets = (SELECT COUNT(DISTINCT tweet_id) FROM tweet_owners WHERE run_id = ?),"
+            " media = (SELECT COUNT(*) FROM media WHERE run_id = ?)"
+            " WHERE run_id = ?",
+            (int(time.time()), str(status), run_id, run_id, run_id),
+        )
+        self.flush()
+        self.conn.commit()
+
+    # ---- writes ----
+
+    def add_tweet(self, record: Dict[str, Any], *, owner: Optional[str] = None, run_id: Optional[int] = None) -> None:
+        tweet_id = record.get("tweet_id")
+        if not tweet_id:
+            return
+        author = (record.get("author") or {}).get("screen_name")
+        timeline = (record.get("context") or {}).get("timeline")
+        owner = _norm_user(owner or author)
+        # the tweet row keeps the owner it was first stored under; every owner/timeline that saw it gets a link
+        self.conn.execute(
+            "INSERT INTO tweets (tweet_id, owner, author, created_at_ms, lang, text, tweet_url, timeline, run_id, record)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (tweet_id) DO UPDATE SET"
+            " author = excluded.author, created_at_ms = excluded.created_at_ms, lang = excluded.lang,"
+            " text = excluded.text, tweet_url = excluded.tweet_url, record = excluded.record",
+            (
+                str(tweet_id),
+                owner,
+                _norm_user(author),
+                record.get("created_at_ms"),
+                record.get("lang"),
+                record.get("text"),
+                record.get("tweet_url"),
+                timeline,
+                run_id,
+                json.dumps(record, ensure_ascii=False, separators=(",", ":")),
+            ),
+        )
+        if owner:
+            self.conn.execute(
+                "INSERT INTO tweet_owners (owner, timeline, tweet_id, created_at_ms, run_id) VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (owner, timeline, tweet_id) DO UPDATE SET created_at_ms = excluded.created_at_ms, run_id = excluded.run_id",
+                (owner, timeline or "", str(tweet_id), record.get("created_at_ms"), run_id),
+            )
+        self._wrote()
+
+    def add_media(
+        self,
+        media_url: str,
+        *,
+        tweet_id: Optional[str] = None,
+        owner: Optional[str] = None,
+        media_type: Optional[str] = None,
+        media_id_str: Optional[str] = None,
+        local_path: Optional[str] = None,
+        size: Optional[int] = None,
+        sha256: Optional[str] = None,
+        run_id: Optional[int] = None,
+    ) -> None:
+        # upsert rather than replace: a re-download of the same bytes keeps its phash / duplicate_of
+        self.conn.execute(
+            "INSERT INTO media (media_url, tweet_id, owner, media_type, media_id_str, local_path, size, sha256, downloaded_at, run_id)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT (media_url, local_path) DO UPDATE SET"
+            " tweet_id = excluded.tweet_id, owner = excluded.owner, media_type = excluded.media_type,"
+            " media_id_str = excluded.media_id_str, size = excluded.size,"
+            " downloaded_at = excluded.downloaded_at, run_id = excluded.run_id,"
+            " phash = CASE WHEN excluded.sha256 IS NOT NULL AND excluded.sha256 IS NOT media.sha256 THEN NULL ELSE media.phash END,"
+            " duplicate_of = CASE WHEN excluded.sha256 IS NOT NULL AND excluded.sha256 IS NOT media.sha256 THEN NULL ELSE media.duplicate_of END,"
+            " sha256 = COALESCE(excluded.sha256, media.sha256)",
+            (media_url, tweet_id, _norm_user(owner), media_type, media_id_str, local_path or "", size, sha256, int(time.time()), run_id),
+        )
+        self._wrote()
+
+    def set_file_info(self, local_path: str, *, size: Optional[int], sha256: Optional[str]) -> None:
+        """Refresh size/sha256 of a file that was replaced on disk (e.g. by a hardlink to its duplicate)."""
+        self.conn.execute("UPDATE media SET size = ?, sha256 = ? WHERE local_path = ?", (size, sha256, local_path))
+        self._wrote()
+
+    def set_phash(self, local_path: str, phash: str, *, duplicate_of: Optional[str] = None) -> None:
+        self.conn.execute("UPDATE media SET phash = ?, duplicate_of = ? WHERE local_path = ?", (phash, duplicate_of, local_path))
+        self._wrote()
+
+    # ---- lookups ----
+
+    def has_media(self, media_url: str, owner: Optional[str] = None) -> bool:
+        """Whether media_url has been downloaded (into `owner`'s folder, if given); served by the primary key."""
+        sql = "SELECT 1 FROM media WHERE media_url = ? AND local_path != ''"
+        args: tuple = (media_url,)
+        if owner:
+            sql += " AND owner = ?"
+            args += (_norm_user(owner),)
+        return self.conn.execute(sql + " LIMIT 1", args).fetchone() is not None
+
+    def media_by_sha256(self, sha256: str) -> Optional[str]:
+        row = self.conn.execute("SELECT local_path FROM media WHERE sha256 = ? LIMIT 1", (sha256,)).fetchone()
+        return row[0] if row else None
+
+    def media_without_phash(self, owner: Optional[str] = None) -> List[str]:
+        sql = "SELECT local_path FROM media WHERE phash IS NULL AND local_path != '' AND media_type = 'Image'"
+        args: tuple = ()
+        if owner:
+            sql += " AND owner = ?"
+            args = (_norm_user(owner),)
+        return [row[0] for row in self.conn.execute(sql + " ORDER BY downloaded_at", args)]
+
+    def iter_phashes(self) -> Iterator[Tuple[str, str]]:
+        """(local_path, phash) of every hashed original (duplicates are not indexed again)."""
+        yield from self.conn.execute("SELECT local_path, phash FROM media WHERE phash IS NOT NULL AND phash != '' AND duplicate_of IS NULL")
+
+    def is_duplicate(self, local_path: str) -> Optional[str]:
+        row = self.conn.execute("SELECT duplicate_of FROM media WHERE local_path = ?", (local_path,)).fetchone()
+        return row[0] if row else None
+
+    def newest_tweet(self, screen_name: str, timeline: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Newest tweet stored for an owner (optionally one timeline), read off the owner/created_at index."""
+        sql = (
+            "SELECT o.tweet_id, o.created_at_ms, t.tweet_url FROM tweet_owners o"
+            " JOIN tweets t ON t.tweet_id = o.tweet_id WHERE o.owner = ?"
+        )
+        args: tuple = (_norm_user(screen_name),)
+        if timeline:
+            sql += " AND o.timeline = ?"
+            args += (timeline,)
+        row = self.conn.execute(sql + " ORDER BY o.created_at_ms DESC LIMIT 1", args).fetchone()
+        if not row:
+            return None
+        return {"tweet_id": row[0], "created_at_ms": row[1], "tweet_url": row[2]}
+
+    def query_tweets(
+        self,
+        columns: List[str],
+        *,
+        since_ms: Optional[int] = None,
+        until_ms: Optional[int] = None,
+        authors: Optional[List[str]] = None,
+        langs: Optional[List[str]] = None,
+    ) -> Iterator[Tuple[Any, ...]]:
+        """
+        Stream tuples of `columns` (keys of TWEET_COLUMNS) oldest first. Only the requested columns are
+        read and the filters run inside SQLite, on the created_at / author indexes.
+        """
+        unknown = [c for c in columns if c not in TWEET_COLUMNS]
+        if unknown:
+            raise ValueError(f"unknown tweet column(s): {', '.join(unknown)}")
+        where: List[str] = []
+        args: List[Any] = []
+        if since_ms is not None:
+            where.append("created_at_ms >= ?")
+            args.append(int(since_ms))
+        if until_ms is not None:
+            where.append("created_at_ms < ?")
+            args.append(int(until_ms))
+        if authors:
+            names = [_norm_user(a) for a in authors]
+            where.append(f"author IN ({', '.join('?' * len(names))})")
+            args.extend(names)
+        if langs:
+            where.append(f"lang IN ({', '.join('?' * len(langs))})")
+            args.extend(langs)
+        sql = f"SELECT {', '.join(TWEET_COLUMNS[c] for c in columns)} FROM tweets"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        yield from self.conn.execute(sql + " ORDER BY created_at_ms, tweet_id", args)
+
+    def iter_texts(self, screen_name: Optional[str] = None, timeline: Optional[str] = None) -> Iterator[Dict[str, Any]]:
+        """Yield {tweet_id, created_at_ms, tweet_url, text, lang, author} newest first, optionally for one owner (and timeline)."""
+        sql = "SELECT tweet_id, created_at_ms, tweet_url, text, lang, author FROM tweets"
+        args: tuple = ()
+        if screen_name:
+            sql += " WHERE tweet_id IN (SELECT tweet_id FROM tweet_owners WHERE owner = ?"
+            args = (_norm_user(screen_name),)
+            if timeline:
+                sql += " AND timeline = ?"
+                args += (timeline,)
+            sql += ")"
+        sql += " ORDER BY created_at_ms DESC"
+        for row in self.conn.execute(sql, args):
+            yield {
+                "tweet_id": row[0],
+                "created_at_ms": row[1],
+                "tweet_url": row[2],
+                "text": row[3],
+                "lang": row[4],
+                "author": row[5],
+            }
@@ -5,10 +5,13 @@ import re
 import tempfile
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, Optional, Union
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 
 STATE_FILENAME = ".crawl_state.json"
+MEDIA_COUNTER_FILENAME = ".media_counter.json"
+MEDIA_INVENTORY_FILENAME = ".media_inventory.jsonl"
+PAGE_JOURNAL_FILENAME = ".page_journal.jsonl"
 
 
 def build_run_key(*, time_range: str, has_retweet: bool, has_highlights: bool, has_likes: bool) -> str:
@@ -22,12 +25,17 @@ def build_run_key(*, time_range: str, has_retweet: bool, has_highlights: bool, h
     return hashlib.sha256(raw).hexdigest()[:16]
 
 
-def state_path(save_path: Union[str, os.PathLike]) -> Path:
-    return Path(save_path) / STATE_FILENAME
+def state_path(save_path: Union[str, os.PathLike], filename: str = STATE_FILENAME) -> Path:
+    return Path(save_path) / filename
 
 
-def load_state(save_path: Union[str, os.PathLike], *, run_key: str) -> Optional[Dict[str, Any]]:
-    path = state_path(save_path)
+def load_state(
+    save_path: Union[str, os.PathLike],
+    *,
+    run_key: str,
+    filename: str = STATE_FILENAME,
+) -> Optional[Dict[str, Any]]:
+    path = state_path(save_path, filename)
     if not path.exists():
         return None
     try:
@@ -39,12 +47,37 @@ def load_state(save_path: Union[str, os.PathLike], *, run_key: str) -> Optional[
     return data
 
 
+def _read_raw(path: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(path.read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_atomic(path: Path, payload: Dict[str, Any], filename: str) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_fd, tmp_name = tempfile.mkstemp(prefix=filename + ".", dir=str(path.parent))
+    try:
+        with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        os.replace(tmp_name, path)
+    finally:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+
+
 def save_state(
     save_path: Union[str, os.PathLike],
     *,
     run_key: str,
     cursor: Optional[str],
     extra: Optional[Dict[str, Any]] = None,
+    filename: str = STATE_FILENAME,
 ) -> None:
     payload: Dict[str, Any] = {
         "version": 1,
@@ -56,30 +89,52 @@ def save_state(
     if extra:
         payload.update(extra)  # type: ignore[arg-type]
 
-    path = state_path(save_path)
-    path.parent.mkdir(parents=True, exist_ok=True)
-
-    tmp_fd, tmp_name = tempfile.mkstemp(prefix=STATE_FILENAME + ".", dir=str(path.parent))
-    try:
-        with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
-            json.dump(payload, f, ensure_ascii=False, indent=2)
-            f.write("\n")
-        os.replace(tmp_name, path)
-    finally:
-        try:
-            os.unlink(tmp_name)
-        except OSError:
-            pass
+    path = state_path(save_path, filename)
+    watermarks = _read_raw(path).get("watermarks")
+    if watermarks:
+        payload["watermarks"] = watermarks
+    _write_atomic(path, payload, filename)
 
 
-def clear_state(save_path: Union[str, os.PathLike]) -> None:
-    path = state_path(save_path)
+def clear_state(save_path: Union[str, os.PathLike], filename: str = STATE_FILENAME) -> None:
+    path = state_path(save_path, filename)
+    # watermarks of completed syncs outlive the run; only the unfinished cursor progress is dropped
+    watermarks = _read_raw(path).get("watermarks")
+    if watermarks:
+        _write_atomic(path, {"version": 1, "watermarks": watermarks}, filename)
+        return
     try:
         path.unlink()
     except FileNotFoundError:
         return
 
 
+def load_watermark(save_path: Union[str, os.PathLike], mode: str, filename: str = STATE_FILENAME) -> Optional[Dict[str, Any]]:
+    """
+    Newest tweet seen by the last *completed* sync of a timeline mode (media/tweets/likes/highlights):
+    {"tweet_id", "created_at_ms", "head_ids", "updated_at"}.
+    """
+    watermark = (_read_raw(state_path(save_path, filename)).get("watermarks") or {}).get(mode)
+    if not isinstance(watermark, dict) or not watermark.get("tweet_id"):
+        return None
+    return watermark
+
+
+def save_watermark(
+    save_path: Union[str, os.PathLike],
+    mode: str,
+    watermark: Dict[str, Any],
+    filename: str = STATE_FILENAME,
+) -> None:
+    path = state_path(save_path, filename)
+    data = _read_raw(path)
+    watermarks = data.get("watermarks") if isinstance(data.get("watermarks"), dict) else {}
+    watermarks[mode] = dict(watermark, updated_at=datetime.now(tz=timezone.utc).isoformat().replace("+00:00", "Z"))
+    data["watermarks"] = watermarks
+    data.setdefault("version", 1)
+    _write_atomic(path, data, filename)
+
+
 _MEDIA_INDEX_RE = re.compile(r"-(?:img|vid)_(\d+)\.(?:jpg|jpeg|png|gif|mp4|webm)$", re.IGNORECASE)
 
 
@@ -103,3 +158,158 @@ def infer_existing_media_count(save_path: Union[str, os.PathLike]) -> int:
         except Exception:
             continue
     return 0 if best < 0 else best + 1
+
+
+def load_media_counter(save_path: Union[str, os.PathLike]) -> int:
+    """
+    Next free media index for main.py file naming, read from the persisted counter.
+    When the counter is missing or unreadable it is repaired from the media inventory (plus the
+    indices still queued in the page journal); only a directory without an inventory, i.e. one
+    never downloaded into by this version, falls back to the full scan of infer_existing_media_count.
+    """
+    data = _read_raw(state_path(save_path, MEDIA_COUNTER_FILENAME))
+    try:
+        return max(0, int(data["next_index"]))
+    except Exception:
+        pass
+    next_index = MediaInventory.next_index(save_path)
+    if next_index is None:
+        next_index = infer_existing_media_count(save_path)
+    journal = PageJournal(save_path)
+    queued = [int(op["index"]) for op in journal.pending() + journal.failures() if "index" in op]
+    if queued:
+        next_index = max(next_index, max(queued) + 1)
+    reserve_media_indices(save_path, next_index)
+    return next_index
+
+
+def reserve_media_indices(save_path: Union[str, os.PathLike], next_index: int) -> None:
+    """Persist the counter *before* a page's downloads start, so a crash mid-page can never reuse its indices."""
+    path = state_path(save_path, MEDIA_COUNTER_FILENAME)
+    _write_atomic(path, {"version": 1, "next_index": int(next_index)}, MEDIA_COUNTER_FILENAME)
+
+
+class MediaInventory:
+    """Append-only log of finished downloads (one JSON object per line), written as files land."""
+
+    def __init__(self, save_path: Union[str, os.PathLike]) -> None:
+        self.path = state_path(save_path, MEDIA_INVENTORY_FILENAME)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = self.path.open("a", encoding="utf-8", newline="\n")
+
+    def add(self, index: int, file_name: str, *, url: Optional[str] = None, size: Optional[int] = None) -> None:
+        self._fp.write(json.dumps({"index": index, "file": file_name, "url": url, "size": size}, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._fp.flush()
+
+    def close(self) -> None:
+        self._fp.close()
+
+    @staticmethod
+    def next_index(save_path: Union[str, os.PathLike]) -> Optional[int]:
+        """One past the highest index recorded in the inventory; None if there is no (non-empty) inventory."""
+        best = -1
+        try:
+            with state_path(save_path, MEDIA_INVENTORY_FILENAME).open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        best = max(best, int(json.loads(line)["index"]))
+                    except Exception:
+                        continue  # torn last line after a crash
+        except FileNotFoundError:
+            return None
+        return None if best < 0 else best + 1
+
+
+class PageJournal:
+    """
+    Write-ahead journal of a page's media downloads. Every task of a page is appended as a
+    `queue` op (fsynced) before any download starts, which makes it safe to persist the page's
+    *next* cursor right away; each file that lands appends a `done` op, and one that gives up after
+    all its attempts a `failed` op (with the reason) so it is not replayed again. On resume the
+    unfinished items are replayed from the journal instead of re-fetching the timeline page.
+    """
+
+    def __init__(self, save_path: Union[str, os.PathLike]) -> None:
+        self.path = state_path(save_path, PAGE_JOURNAL_FILENAME)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fp = None
+
+    def pending(self) -> List[Dict[str, Any]]:
+        return self._read()[0]
+
+    def failures(self) -> List[Dict[str, Any]]:
+        """Items that gave up for good, as their `failed` ops (index, url, reason)."""
+        return self._read()[1]
+
+    def _read(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        queued: Dict[int, Dict[str, Any]] = {}
+        failed: Dict[int, Dict[str, Any]] = {}
+        try:
+            with self.path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        op = json.loads(line)
+                    except Exception:
+                        continue  # torn last line after a crash
+                    if not isinstance(op, dict):
+                        continue
+                    if op.get("op") == "queue":
+                        queued[int(op["index"])] = op
+                    elif op.get("op") == "done":
+                        queued.pop(int(op.get("index", -1)), None)
+                        failed.pop(int(op.get("index", -1)), None)
+                    elif op.get("op") == "failed":
+                        queued.pop(int(op.get("index", -1)), None)
+                        failed[int(op.get("index", -1))] = op
+        except FileNotFoundError:
+            return [], []
+        return [queued[i] for i in sorted(queued)], [failed[i] for i in sorted(failed)]
+
+    def _append(self, ops: List[Dict[str, Any]], *, sync: bool) -> None:
+        if self._fp is None:
+            self._fp = self.path.open("a", encoding="utf-8", newline="\n")
+        for op in ops:
+            self._fp.write(json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n")
+        self._fp.flush()
+        if sync:
+            os.fsync(self._fp.fileno())
+
+    def queue(self, items: List[Dict[str, Any]]) -> None:
+        self._append([dict(item, op="queue") for item in items], sync=True)
+
+    def done(self, index: int) -> None:
+        self._append([{"op": "done", "index": int(index)}], sync=False)
+
+    def failed(self, index: int, *, url: Optional[str] = None, reason: str = "") -> None:
+        self._append([{"op": "failed", "index": int(index), "url": url, "reason": reason}], sync=False)
+
+    def compact(self) -> int:
+        """
+        Rewrite the journal with only the unfinished items and the failure records (nothing left ->
+        removed); returns how many unfinished items remain.
+        """
+        self.close()
+        remaining, failures = self._read()
+        if not remaining and not failures:
+            try:
+                self.path.unlink()
+            except FileNotFoundError:
+                pass
+            return 0
+        tmp_fd, tmp_name = tempfile.mkstemp(prefix=PAGE_JOURNAL_FILENAME + ".", dir=str(self.path.parent))
+        try:
+            with os.fdopen(tmp_fd, "w", encoding="utf-8", newline="\n") as f:
+                for op in remaining + failures:
+                    f.write(json.dumps(op, ensure_ascii=False, separators=(",", ":")) + "\n")
+            os.replace(tmp_name, self.path)
+        finally:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+        return len(remaining)
+
+    def close(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
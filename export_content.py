@@ -1,10 +1,19 @@
 import argparse
 import csv
+import hashlib
 import json
 import os
-from dataclasses import dataclass
+import tempfile
+import time
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
-from typing import Iterable, List, Optional, Tuple
+from typing import Any, Callable, Deque, Dict, FrozenSet, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from catalog import CATALOG_FILENAME, Catalog
 
 
 @dataclass(frozen=True)
@@ -23,20 +32,31 @@ REPLY_SPECS: List[RowSpec] = [
     RowSpec(kind="reply", date_col="Reply Date", url_col="Reply URL", text_col="Reply Content"),
 ]
 
+# below this many files the process pool costs more than it saves
+PARALLEL_MIN_FILES = 8
+
+# --incremental state kept next to the output file
+MANIFEST_SUFFIX = ".manifest.json"
+SEEN_SUFFIX = ".seen"
+
+
+def _is_header(row: List[str]) -> bool:
+    cols = set(row)
+    return ("Tweet URL" in cols and "Tweet Content" in cols) or ("Reply URL" in cols and "Reply Content" in cols)
+
 
 def _find_header_row(rows: Iterable[List[str]]) -> Tuple[Optional[List[str]], List[List[str]]]:
     """
-    Returns (header, buffered_rows_after_header).
-    Skips metadata rows until a known header is found.
+    Returns (header, buffered_rows_before_header).
+    Skips metadata rows until a known header is found; `rows` is left positioned right after it.
     """
     buffered: List[List[str]] = []
     for row in rows:
         if not row:
             continue
+        if _is_header(row):
+            return row, buffered
         buffered.append(row)
-        cols = set(row)
-        if ("Tweet URL" in cols and "Tweet Content" in cols) or ("Reply URL" in cols and "Reply Content" in cols):
-            return row, []
     return None, buffered
 
 
@@ -61,87 +81,507 @@ def _iter_csv_rows(path: Path):
             yield row
 
 
-def _discover_csv_files(inputs: List[str], root: str) -> List[Path]:
+def iter_file_rows(path: Path, mode: str) -> Iterator[Tuple[str, str, str]]:
+    """Stream (date, url, text) rows of one crawler CSV, reading the file exactly once."""
+    rows = _iter_csv_rows(path)
+    header, _ = _find_header_row(rows)
+    if not header:
+        return
+    spec = _spec_from_header(header, mode=mode)
+    if not spec:
+        return
+
+    date_idx = header.index(spec.date_col)
+    url_idx = header.index(spec.url_col)
+    text_idx = header.index(spec.text_col)
+    width = max(date_idx, url_idx, text_idx)
+
+    for row in rows:
+        # Skip repeated headers (cheap, robust)
+        if row == header:
+            continue
+        if not row or len(row) <= width:
+            continue
+
+        date = str(row[date_idx]).strip()
+        url = str(row[url_idx]).strip()
+        text = str(row[text_idx]).strip()
+        if not (date or url or text):
+            continue
+        yield date, url, text
+
+
+def _parse_file(path: Path, mode: str) -> List[Tuple[str, str, str]]:
+    # process-pool worker: one file per task, best-effort like the serial path
+    try:
+        return list(iter_file_rows(path, mode))
+    except Exception:
+        return []
+
+
+def _safe_rows(path: Path, mode: str) -> Iterator[Tuple[str, str, str]]:
+    try:
+        yield from iter_file_rows(path, mode)
+    except Exception:
+        # best-effort: skip bad CSVs
+        return
+
+
+def _iter_files_serial(csv_files: List[Path], mode: str) -> Iterator[Tuple[Path, Iterable[Tuple[str, str, str]]]]:
+    for path in csv_files:
+        yield path, _safe_rows(path, mode)
+
+
+def _iter_files_parallel(csv_files: List[Path], mode: str, workers: int) -> Iterator[Tuple[Path, List[Tuple[str, str, str]]]]:
+    """Parse files in a process pool, yielding results in input order with a bounded number in flight."""
+    window = workers * 2
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending: Deque = deque()
+        files = iter(csv_files)
+        for path in files:
+            pending.append((path, pool.submit(_parse_file, path, mode)))
+            if len(pending) >= window:
+                break
+        while pending:
+            path, fut = pending.popleft()
+            rows = fut.result()
+            nxt = next(files, None)
+            if nxt is not None:
+                pending.append((nxt, pool.submit(_parse_file, nxt, mode)))
+            yield path, rows
+
+
+def _discover_files(inputs: List[str], root: str, pattern: str, accept: Callable[[Path], bool]) -> List[Path]:
     files: List[Path] = []
     if inputs:
         for p in inputs:
             path = Path(p)
             if path.is_dir():
-                files.extend(sorted(path.rglob("*.csv")))
+                files.extend(sorted(path.rglob(pattern)))
             elif any(ch in p for ch in ["*", "?", "["]):
                 files.extend(sorted(Path().glob(p)))
             else:
                 files.append(path)
-        return [p for p in files if p.is_file() and p.suffix.lower() == ".csv"]
+        return [p for p in files if p.is_file() and accept(p)]
 
     root_path = Path(root)
     ignore = {".git", ".venv", "__pycache__", "twitter"}
-    for p in root_path.rglob("*.csv"):
-        if any(part in ignore for part in p.parts):
+    for p in root_path.rglob(pattern):
+        if any(part in ignore for part in p.parts) or not accept(p):
             continue
         files.append(p)
     return sorted(files)
 
 
+def _discover_csv_files(inputs: List[str], root: str) -> List[Path]:
+    return _discover_files(inputs, root, "*.csv", lambda p: p.suffix.lower() == ".csv")
+
+
+def discover_rich_files(inputs: List[str], root: str) -> List[Path]:
+    """*-rich.jsonl (main.py) and *-Reply.jsonl (reply_down.py) streams."""
+    return _discover_files(inputs, root, "*.jsonl", lambda p: p.name.endswith(("-rich.jsonl", "-Reply.jsonl")))
+
+
+def _load_manifest(out_path: Path) -> Dict[str, Any]:
+    try:
+        data = json.loads(Path(str(out_path) + MANIFEST_SUFFIX).read_text(encoding="utf-8"))
+    except Exception:
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def _write_atomic(path: Path, data: bytes) -> None:
+    tmp_fd, tmp_name = tempfile.mkstemp(prefix=path.name + ".", dir=str(path.parent))
+    try:
+        with os.fdopen(tmp_fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_name, path)
+    finally:
+        try:
+            os.unlink(tmp_name)
+        except OSError:
+            pass
+
+
+def _save_manifest(out_path: Path, manifest: Dict[str, Any]) -> None:
+    _write_atomic(Path(str(out_path) + MANIFEST_SUFFIX), json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+def _load_seen(out_path: Path) -> Set[int]:
+    keys = array("Q")
+    try:
+        with open(str(out_path) + SEEN_SUFFIX, "rb") as f:
+            keys.frombytes(f.read())
+    except (OSError, ValueError):
+        return set()
+    return set(keys)
+
+
+def _save_seen(out_path: Path, seen: Set[int]) -> None:
+    _write_atomic(Path(str(out_path) + SEEN_SUFFIX), array("Q", seen).tobytes())
+
+
+def _plan_incremental(csv_files: List[Path], manifest: Dict[str, Any]) -> Tuple[List[Path], Dict[Path, int], Dict[str, Dict[str, int]]]:
+    """
+    Compare files against the manifest: unchanged ones are dropped, files that only grew
+    (the crawler appends) resume after the rows already seen, anything else is parsed in full.
+    """
+    known = manifest.get("files") or {}
+    todo: List[Path] = []
+    skip: Dict[Path, int] = {}
+    fingerprints: Dict[str, Dict[str, int]] = {}
+    for path in csv_files:
+        key = str(path.resolve())
+        st = path.stat()
+        fingerprints[key] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+        old = known.get(key)
+        if old and old.get("size") == st.st_size and old.get("mtime_ns") == st.st_mtime_ns:
+            continue
+        if old and st.st_size > int(old.get("size") or 0):
+            skip[path] = int(old.get("rows_seen") or 0)
+        todo.append(path)
+    return todo, skip, fingerprints
+
+
+def row_key(url: str, text: str) -> int:
+    """64-bit fingerprint of (url, text): the dedup set holds ints instead of full strings."""
+    digest = hashlib.blake2b(url.encode("utf-8") + b"\0" + text.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little")
+
+
+def iter_simple_rows(
+    csv_files: List[Path],
+    mode: str,
+    dedupe: bool,
+    *,
+    workers: int = 1,
+    seen: Optional[Set[int]] = None,
+    skip: Optional[Dict[Path, int]] = None,
+    stats: Optional[Dict[Path, Dict[str, int]]] = None,
+) -> Iterator[Tuple[str, str, str]]:
+    """
+    `skip[path]`: leading rows of that file already exported by a previous run (file only grew).
+    `stats[path]` is filled with {"rows_seen", "rows"}: rows parsed / rows emitted per file.
+    """
+    seen = set() if seen is None else seen
+    if workers > 1 and len(csv_files) >= PARALLEL_MIN_FILES:
+        chunks = _iter_files_parallel(csv_files, mode, workers)
+    else:
+        chunks = _iter_files_serial(csv_files, mode)
+
+    for path, rows in chunks:
+        n_skip = skip.get(path, 0) if skip else 0
+        parsed = emitted = 0
+        for date, url, text in rows:
+            parsed += 1
+            if parsed <= n_skip:
+                continue
+            if dedupe:
+                key = row_key(url, text)
+                if key in seen:
+                    continue
+                seen.add(key)
+            emitted += 1
+            yield date, url, text
+        if stats is not None:
+            stats[path] = {"rows_seen": parsed, "rows": emitted}
+
+
 def extract_simple_rows(
     csv_files: List[Path],
     mode: str,
     dedupe: bool,
 ) -> List[Tuple[str, str, str]]:
-    out: List[Tuple[str, str, str]] = []
-    seen = set()
+    return list(iter_simple_rows(csv_files, mode, dedupe))
+
+
+def _reopen_json_array(path: Path) -> None:
+    """Cut the closing bracket (and the newline before it) off an exported JSON array so rows can be appended."""
+    with path.open("rb+") as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(0, size - 64))
+        tail = f.read()
+        end = tail.rstrip()
+        if not end.endswith(b"]"):
+            raise SystemExit(f"{path} is not a JSON array written by this tool; rerun without --incremental")
+        end = end[:-1].rstrip(b"\n")
+        f.truncate(size - len(tail) + len(end))
+
+
+# ---- record sources (rich JSONL / catalog) ----
+
+SIMPLE_FIELDS: Tuple[str, ...] = ("date", "url", "text")
+CSV_HEADERS = {"date": "Date", "url": "URL", "text": "Text"}
+
+KIND_BY_MODE = {"tweets": ("tweet",), "replies": ("reply",), "all": ("tweet", "reply")}
+
+
+def _stamp2time(ms: Any) -> str:
+    """Same local "%Y-%m-%d %H:%M" format csv_gen writes, so --source rich/catalog matches the CSV export."""
+    if ms is None:
+        return ""
+    return time.strftime("%Y-%m-%d %H:%M", time.localtime(int(ms) / 1000))
+
+
+def _author_name(rec: Dict[str, Any]) -> Optional[str]:
+    author = rec.get("author")
+    return author.get("screen_name") if isinstance(author, dict) else author
+
+
+# output field -> getter on a rich record (catalog rows are shaped like one)
+RECORD_FIELDS: Dict[str, Callable[[Dict[str, Any]], Any]] = {
+    "date": lambda r: _stamp2time(r.get("created_at_ms")),
+    "url": lambda r: r.get("tweet_url") or "",
+    "text": lambda r: r.get("text") or "",
+    "tweet_id": lambda r: r.get("tweet_id"),
+    "kind": lambda r: r.get("kind"),
+    "author": _author_name,
+    "lang": lambda r: r.get("lang"),
+    "created_at_ms": lambda r: r.get("created_at_ms"),
+    "created_at_iso": lambda r: r.get("created_at_iso") or (
+        datetime.fromtimestamp(r["created_at_ms"] / 1000, tz=timezone.utc).isoformat().replace("+00:00", "Z")
+        if r.get("created_at_ms") is not None else None
+    ),
+    "conversation_id": lambda r: r.get("conversation_id_str"),
+    "in_reply_to": lambda r: r.get("in_reply_to_status_id_str"),
+    "parent_url": lambda r: r.get("parent_tweet_url"),
+}
+
+# output field -> catalog columns it needs (projection: nothing else is read from SQLite)
+_CATALOG_NEEDS: Dict[str, Tuple[str, ...]] = {
+    "date": ("created_at_ms",),
+    "url": ("tweet_url",),
+    "text": ("text",),
+    "tweet_id": ("tweet_id",),
+    "kind": (),
+    "author": ("author",),
+    "lang": ("lang",),
+    "created_at_ms": ("created_at_ms",),
+    "created_at_iso": ("created_at_ms",),
+    "conversation_id": ("conversation_id_str",),
+    "in_reply_to": ("in_reply_to_status_id_str",),
+    "parent_url": (),
+}
+
+
+def parse_fields(spec: Optional[str]) -> Tuple[str, ...]:
+    if not spec:
+        return SIMPLE_FIELDS
+    fields = tuple(f.strip() for f in spec.split(",") if f.strip())
+    unknown = [f for f in fields if f not in RECORD_FIELDS]
+    if unknown or not fields:
+        raise SystemExit(f"Unknown --fields {', '.join(unknown) or spec!r}; choose from: {', '.join(RECORD_FIELDS)}")
+    return fields
+
+
+def _day_start_ms(day: str) -> int:
+    try:
+        return int(datetime.strptime(day, "%Y-%m-%d").timestamp() * 1000)
+    except ValueError:
+        raise SystemExit(f"Invalid date {day!r}, expected YYYY-MM-DD")
 
-    for path in csv_files:
-        try:
-            rows = _iter_csv_rows(path)
-            header, _ = _find_header_row(rows)
-            if not header:
-                continue
-            spec = _spec_from_header(header, mode=mode)
-            if not spec:
-                continue
 
-            date_idx = header.index(spec.date_col)
-            url_idx = header.index(spec.url_col)
-            text_idx = header.index(spec.text_col)
+@dataclass(frozen=True)
+class RecordFilter:
+    """Predicates for record sources. since/until are local dates; until is inclusive."""
+
+    kinds: FrozenSet[str]
+    since_ms: Optional[int] = None
+    until_ms: Optional[int] = None
+    authors: FrozenSet[str] = field(default_factory=frozenset)
+    langs: FrozenSet[str] = field(default_factory=frozenset)
+
+    @classmethod
+    def from_args(cls, mode: str, since: Optional[str], until: Optional[str], author: Optional[str], lang: Optional[str]) -> "RecordFilter":
+        def _split(value: Optional[str]) -> FrozenSet[str]:
+            return frozenset(v.strip() for v in (value or "").split(",") if v.strip())
+
+        return cls(
+            kinds=frozenset(KIND_BY_MODE[mode]),
+            since_ms=_day_start_ms(since) if since else None,
+            until_ms=_day_start_ms((datetime.strptime(until, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")) if until else None,
+            authors=frozenset(a.lstrip("@").lower() for a in _split(author)),
+            langs=_split(lang),
+        )
 
-            for row in _iter_csv_rows(path):
-                # Skip metadata until we hit header again (cheap, robust)
-                if row == header:
+    def prefilter(self, line: str) -> bool:
+        """
+        Cheap test on the raw JSONL line before json.loads. JsonlWriter writes compact separators,
+        so a wanted kind/lang must appear verbatim; a hit is re-checked by `match`.
+        """
+        if not any(f'"kind":"{k}"' in line for k in self.kinds):
+            return False
+        if self.langs and not any(f'"lang":"{l}"' in line for l in self.langs):
+            return False
+        return True
+
+    def match(self, rec: Dict[str, Any]) -> bool:
+        if rec.get("kind") not in self.kinds:
+            return False
+        if self.langs and rec.get("lang") not in self.langs:
+            return False
+        if self.authors and (_author_name(rec) or "").lower() not in self.authors:
+            return False
+        if self.since_ms is not None or self.until_ms is not None:
+            ms = rec.get("created_at_ms")
+            if ms is None:
+                return False
+            if self.since_ms is not None and ms < self.since_ms:
+                return False
+            if self.until_ms is not None and ms >= self.until_ms:
+                return False
+        return True
+
+
+def _tweet_key(tweet_id: Any) -> int:
+    tid = str(tweet_id)
+    return int(tid) if tid.isdigit() else row_key(tid, "")
+
+
+def iter_rich_rows(
+    files: List[Path],
+    fields: Sequence[str],
+    flt: RecordFilter,
+    *,
+    dedupe: bool = True,
+) -> Iterator[Tuple[Any, ...]]:
+    """Stream projected rows from rich/Reply JSONL files, one output row per tweet id."""
+    getters = [RECORD_FIELDS[f] for f in fields]
+    seen: Set[int] = set()
+    for path in files:
+        try:
+            f = path.open("r", encoding="utf-8")
+        except OSError:
+            continue
+        with f:
+            for line in f:
+                if not flt.prefilter(line):
                     continue
-                if not row or len(row) <= max(date_idx, url_idx, text_idx):
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue    # torn last line of a crawl still in progress
+                if not isinstance(rec, dict) or not flt.match(rec):
                     continue
+                if dedupe and rec.get("tweet_id"):
+                    key = _tweet_key(rec["tweet_id"])
+                    if key in seen:
+                        continue
+                    seen.add(key)
+                yield tuple(g(rec) for g in getters)
+
+
+def iter_catalog_rows(catalog: Catalog, fields: Sequence[str], flt: RecordFilter) -> Iterator[Tuple[Any, ...]]:
+    """Projected rows straight from the catalog; date/author/lang filters run as SQL on its indexes."""
+    if "tweet" not in flt.kinds:
+        return  # the catalog only indexes timeline tweets; replies live in *-Reply.jsonl
+    columns = list(dict.fromkeys(c for f in fields for c in _CATALOG_NEEDS[f]))
+    getters = [RECORD_FIELDS[f] for f in fields]
+    rows = catalog.query_tweets(
+        columns or ["tweet_id"],
+        since_ms=flt.since_ms,
+        until_ms=flt.until_ms,
+        authors=sorted(flt.authors),
+        langs=sorted(flt.langs),
+    )
+    for row in rows:
+        rec = dict(zip(columns, row))
+        rec["kind"] = "tweet"
+        yield tuple(g(rec) for g in getters)
 
-                date = str(row[date_idx]).strip()
-                url = str(row[url_idx]).strip()
-                text = str(row[text_idx]).strip()
-                if not (date or url or text):
-                    continue
 
-                key = (url, text) if dedupe else None
-                if dedupe and key in seen:
-                    continue
-                if dedupe:
-                    seen.add(key)
-                out.append((date, url, text))
-        except Exception:
-            # best-effort: skip bad CSVs
-            continue
+def _open_catalog(inputs: List[str], root: str) -> Catalog:
+    path = Path(inputs[0]) if inputs else Path(root)
+    if path.is_dir():
+        path = path / CATALOG_FILENAME
+    if not path.is_file():
+        raise SystemExit(f"Catalog not found: {path}")
+    return Catalog(path)
 
-    return out
+
+class RowWriter:
+    """
+    Streams rows straight to CSV / JSONL / JSON (JSON written incrementally as one array).
+    With `append_after` set, continues an existing export that already holds that many rows.
+    """
+
+    def __init__(
+        self,
+        path: Path,
+        out_format: str,
+        *,
+        pretty: bool = False,
+        append_after: Optional[int] = None,
+        fields: Sequence[str] = SIMPLE_FIELDS,
+    ) -> None:
+        self.format = out_format
+        self.pretty = pretty
+        self.fields = tuple(fields)
+        self.count = 0
+        self._existing = append_after or 0
+        append = append_after is not None
+        if out_format == "csv":
+            self._f = path.open("a" if append else "w", encoding="utf-8-sig", newline="")
+            self._csv = csv.writer(self._f)
+            if not append:
+                self._csv.writerow([CSV_HEADERS.get(f, f) for f in self.fields])
+        elif out_format in ("jsonl", "json"):
+            if append and out_format == "json":
+                _reopen_json_array(path)
+            self._f = path.open("a" if append else "w", encoding="utf-8", newline="\n")
+            if out_format == "json" and not append:
+                self._f.write("[")
+        else:
+            raise SystemExit(f"Unsupported --format: {out_format}")
+
+    def write(self, *values: Any) -> None:
+        if self.format == "csv":
+            self._csv.writerow(values)
+        else:
+            obj = dict(zip(self.fields, values))
+            if self.format == "jsonl":
+                self._f.write(json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n")
+            elif self.pretty:
+                # same layout json.dump(..., indent=2) produces for the whole list
+                item = json.dumps(obj, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+                self._f.write(("," if self.total else "") + "\n  " + item)
+            else:
+                self._f.write(("," if self.total else "") + json.dumps(obj, ensure_ascii=False, separators=(",", ":")))
+        self.count += 1
+
+    @property
+    def total(self) -> int:
+        return self._existing + self.count
+
+    def close(self) -> None:
+        if self.format == "json":
+            self._f.write("\n]" if self.pretty and self.total else "]")
+            self._f.write("\n")
+        self._f.close()
 
 
 def main():
     parser = argparse.ArgumentParser(
         description="Extract crawled Twitter/X content into a simple file (CSV/JSON/JSONL): Date, URL, Text."
     )
-    parser.add_argument("inputs", nargs="*", help="CSV file/dir/glob. If empty, scan --root recursively.")
+    parser.add_argument(
+        "inputs",
+        nargs="*",
+        help="CSV (or rich JSONL / catalog, see --source) file/dir/glob. If empty, scan --root recursively.",
+    )
+    parser.add_argument(
+        "--source",
+        choices=["csv", "rich", "catalog"],
+        default="csv",
+        help="Read the per-media CSVs, the *-rich.jsonl/*-Reply.jsonl streams (one row per tweet, text-only tweets included) or .catalog.sqlite3.",
+    )
     parser.add_argument("--root", default=".", help="Root directory to scan when no inputs are provided.")
     parser.add_argument(
         "--mode",
         choices=["tweets", "replies", "all"],
         default="tweets",
-        help="Which CSV rows to extract.",
+        help="Which rows to extract (rich/catalog: record kind tweet/reply).",
     )
     parser.add_argument(
         "--no-dedupe",
@@ -160,10 +600,34 @@ def main():
         help="Pretty-print JSON (only when --format json).",
     )
     parser.add_argument("-o", "--output", default=None, help="Output path. Default depends on --format.")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="Processes used to parse CSV files in parallel (1 = serial).",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Only parse new/changed CSVs (tracked in <output>.manifest.json) and append their rows to the existing output.",
+    )
+    parser.add_argument(
+        "--fields",
+        default=None,
+        help=f"Comma-separated output fields for --source rich/catalog (default: date,url,text). Available: {', '.join(RECORD_FIELDS)}.",
+    )
+    parser.add_argument("--since", default=None, help="rich/catalog: only tweets on or after this local date (YYYY-MM-DD).")
+    parser.add_argument("--until", default=None, help="rich/catalog: only tweets on or before this local date (YYYY-MM-DD).")
+    parser.add_argument("--author", default=None, help="rich/catalog: comma-separated author screen names.")
+    parser.add_argument("--lang", default=None, help="rich/catalog: comma-separated language codes (e.g. ja,en).")
     args = parser.parse_args()
 
-    csv_files = _discover_csv_files(args.inputs, root=args.root)
-    rows = extract_simple_rows(csv_files, mode=args.mode, dedupe=not args.no_dedupe)
+    if args.source == "csv":
+        if any(v is not None for v in (args.fields, args.since, args.until, args.author, args.lang)):
+            raise SystemExit("--fields/--since/--until/--author/--lang require --source rich or catalog")
+        csv_files = _discover_csv_files(args.inputs, root=args.root)
+    elif args.incremental:
+        raise SystemExit("--incremental only applies to --source csv")
 
     out_path = Path(args.output) if args.output else None
     if args.format == "auto":
@@ -189,31 +653,70 @@ def main():
     if str(out_dir) and str(out_dir) != ".":
         os.makedirs(out_dir, exist_ok=True)
 
-    if out_format == "csv":
-        with out_path.open("w", encoding="utf-8-sig", newline="") as f:
-            w = csv.writer(f)
-            w.writerow(["Date", "URL", "Text"])
-            w.writerows(rows)
-    elif out_format == "jsonl":
-        with out_path.open("w", encoding="utf-8", newline="\n") as f:
-            for date, url, text in rows:
-                f.write(
-                    json.dumps({"date": date, "url": url, "text": text}, ensure_ascii=False, separators=(",", ":"))
-                    + "\n"
-                )
-    elif out_format == "json":
-        payload = [{"date": date, "url": url, "text": text} for date, url, text in rows]
-        with out_path.open("w", encoding="utf-8", newline="\n") as f:
-            if args.pretty:
-                json.dump(payload, f, ensure_ascii=False, indent=2)
-            else:
-                json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
-            f.write("\n")
-    else:
-        raise SystemExit(f"Unsupported --format: {out_format}")
+    dedupe = not args.no_dedupe
+    if args.source != "csv":
+        fields = parse_fields(args.fields)
+        flt = RecordFilter.from_args(args.mode, args.since, args.until, args.author, args.lang)
+        catalog = None
+        if args.source == "rich":
+            rich_files = discover_rich_files(args.inputs, root=args.root)
+            rows = iter_rich_rows(rich_files, fields, flt, dedupe=dedupe)
+            print(f"Input JSONL files: {len(rich_files)}")
+        else:
+            catalog = _open_catalog(args.inputs, root=args.root)
+            rows = iter_catalog_rows(catalog, fields, flt)
+            print(f"Catalog: {catalog.path}")
+        writer = RowWriter(out_path, out_format, pretty=args.pretty, fields=fields)
+        try:
+            for values in rows:
+                writer.write(*values)
+        finally:
+            writer.close()
+            if catalog is not None:
+                catalog.close()
+        print(f"Extracted rows: {writer.count}")
+        print(f"Wrote: {out_path}")
+        return
+
+    todo, skip, seen, append_after = csv_files, {}, set(), None
+    if args.incremental:
+        options = {"mode": args.mode, "dedupe": dedupe, "format": out_format, "pretty": bool(args.pretty)}
+        manifest = _load_manifest(out_path)
+        if manifest.get("options") == options and out_path.exists():
+            todo, skip, fingerprints = _plan_incremental(csv_files, manifest)
+            seen = _load_seen(out_path) if dedupe else set()
+            append_after = int(manifest.get("rows_written") or 0)
+        else:
+            # first run, options changed or output removed: rebuild from scratch
+            manifest = {"options": options, "files": {}, "rows_written": 0}
+            _, _, fingerprints = _plan_incremental(csv_files, manifest)
+
+    stats: Dict[Path, Dict[str, int]] = {}
+    writer = RowWriter(out_path, out_format, pretty=args.pretty, append_after=append_after)
+    try:
+        for date, url, text in iter_simple_rows(todo, mode=args.mode, dedupe=dedupe, workers=max(1, args.workers), seen=seen, skip=skip, stats=stats):
+            writer.write(date, url, text)
+    finally:
+        writer.close()
+
+    if args.incremental:
+        files = manifest.setdefault("files", {})
+        for path, st in stats.items():
+            key = str(path.resolve())
+            prev = files.get(key) if path in skip else None
+            files[key] = dict(
+                fingerprints[key],
+                rows_seen=st["rows_seen"],
+                rows=st["rows"] + (int(prev.get("rows") or 0) if prev else 0),
+            )
+        manifest["rows_written"] = writer.total
+        if dedupe:
+            _save_seen(out_path, seen)
+        _save_manifest(out_path, manifest)
+        print(f"Unchanged CSV files skipped: {len(csv_files) - len(todo)}")
 
     print(f"Input CSV files: {len(csv_files)}")
-    print(f"Extracted rows: {len(rows)}")
+    print(f"Extracted rows: {writer.count}")
     print(f"Wrote: {out_path}")
 
 
@@ -0,0 +1,292 @@
+import argparse
+import json
+import re
+from collections import OrderedDict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    import pyarrow as pa  # type: ignore
+    import pyarrow.parquet as pq  # type: ignore
+
+    _ARROW_OK = True
+except Exception:
+    pa = None
+    pq = None
+    _ARROW_OK = False
+
+from export_content import discover_rich_files
+
+
+# low-cardinality strings: written with Parquet dictionary encoding
+DICTIONARY_COLUMNS = ["kind", "owner", "lang", "source", "author_id", "author_screen_name", "author_name", "in_reply_to_screen_name"]
+
+_SCREEN_NAME = re.compile(r"[^A-Za-z0-9_]")
+
+
+def tweet_schema():
+    media = pa.struct([
+        ("id_str", pa.string()),
+        ("type", pa.string()),
+        ("url", pa.string()),
+        ("video_url", pa.string()),
+    ])
+    return pa.schema([
+        ("tweet_id", pa.string()),
+        ("kind", pa.string()),
+        ("owner", pa.string()),
+        ("created_at", pa.timestamp("ms", tz="UTC")),
+        ("lang", pa.string()),
+        ("source", pa.string()),
+        ("text", pa.string()),
+        ("tweet_url", pa.string()),
+        ("author_id", pa.string()),
+        ("author_screen_name", pa.string()),
+        ("author_name", pa.string()),
+        ("author_verified", pa.bool_()),
+        ("author_followers_count", pa.int64()),
+        ("author_friends_count", pa.int64()),
+        ("author_statuses_count", pa.int64()),
+        ("favorite_count", pa.int64()),
+        ("retweet_count", pa.int64()),
+        ("reply_count", pa.int64()),
+        ("quote_count", pa.int64()),
+        ("bookmark_count", pa.int64()),
+        ("view_count", pa.int64()),
+        ("conversation_id", pa.string()),
+        ("in_reply_to_status_id", pa.string()),
+        ("in_reply_to_screen_name", pa.string()),
+        ("quoted_status_id", pa.string()),
+        ("is_quote_status", pa.bool_()),
+        ("possibly_sensitive", pa.bool_()),
+        ("hashtags", pa.list_(pa.string())),
+        ("mentions", pa.list_(pa.string())),
+        ("urls", pa.list_(pa.string())),
+        ("media", pa.list_(media)),
+        ("parent_tweet_id", pa.string()),
+        ("reply_depth", pa.int32()),
+    ])
+
+
+def _int(value: Any) -> Optional[int]:
+    if value is None or isinstance(value, bool):
+        return None
+    try:
+        return int(value)     # view_count arrives as a string
+    except (TypeError, ValueError):
+        return None
+
+
+def _best_video(m: Dict[str, Any]) -> Optional[str]:
+    variants = [v for v in (m.get("video_variants") or []) if v.get("content_type") == "video/mp4"]
+    if not variants:
+        return None
+    return max(variants, key=lambda v: v.get("bitrate") or 0).get("url")
+
+
+def flatten_record(rec: Dict[str, Any], owner: Optional[str] = None) -> Dict[str, Any]:
+    """One extract_tweet_record() dict -> one typed row of tweet_schema()."""
+    author = rec.get("author") or {}
+    counts = rec.get("counts") or {}
+    entities = rec.get("entities") or {}
+    return {
+        "tweet_id": rec.get("tweet_id"),
+        "kind": rec.get("kind"),
+        "owner": owner,
+        "created_at": _int(rec.get("created_at_ms")),
+        "lang": rec.get("lang"),
+        "source": rec.get("source"),
+        "text": rec.get("text"),
+        "tweet_url": rec.get("tweet_url"),
+        "author_id": author.get("rest_id") or author.get("id_str"),
+        "author_screen_name": author.get("screen_name"),
+        "author_name": author.get("name"),
+        "author_verified": author.get("verified"),
+        "author_followers_count": _int(author.get("followers_count")),
+        "author_friends_count": _int(author.get("friends_count")),
+        "author_statuses_count": _int(author.get("statuses_count")),
+        "favorite_count": _int(counts.get("favorite_count")),
+        "retweet_count": _int(counts.get("retweet_count")),
+        "reply_count": _int(counts.get("reply_count")),
+        "quote_count": _int(counts.get("quote_count")),
+        "bookmark_count": _int(counts.get("bookmark_count")),
+        "view_count": _int(counts.get("view_count")),
+        "conversation_id": rec.get("conversation_id_str"),
+        "in_reply_to_status_id": rec.get("in_reply_to_status_id_str"),
+        "in_reply_to_screen_name": rec.get("in_reply_to_screen_name"),
+        "quoted_status_id": rec.get("quoted_status_id_str"),
+        "is_quote_status": rec.get("is_quote_status"),
+        "possibly_sensitive": rec.get("possibly_sensitive"),
+        "hashtags": entities.get("hashtags") or [],
+        "mentions": [m.get("screen_name") for m in (entities.get("user_mentions") or []) if m.get("screen_name")],
+        "urls": [u.get("expanded_url") or u.get("url") for u in (entities.get("urls") or []) if u.get("expanded_url") or u.get("url")],
+        "media": [
+            {"id_str": m.get("id_str"), "type": m.get("type"), "url": m.get("media_url_https"), "video_url": _best_video(m)}
+            for m in (rec.get("media") or [])
+        ],
+        "parent_tweet_id": rec.get("parent_tweet_id"),
+        "reply_depth": _int(rec.get("reply_depth")),
+    }
+
+
+def partition_of(row: Dict[str, Any]) -> Tuple[str, str]:
+    """(user, month): author screen name and the UTC month of the tweet."""
+    user = _SCREEN_NAME.sub("_", row.get("author_screen_name") or "") or "_unknown"
+    ms = row.get("created_at")
+    month = "unknown"
+    if ms is not None:
+        month = datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m")
+    return user, month
+
+
+class ParquetSink:
+    """
+    Hive-partitioned Parquet writer (<out>/user=<author>/month=<YYYY-MM>/part-NNNNN.parquet).
+
+    Rows are buffered per partition and written as a row group once a partition holds
+    `row_group_size` rows; when all buffers together exceed `max_buffered_rows` the biggest one
+    is written early, so memory stays bounded however many partitions the input spans. At most
+    `max_open_files` writers stay open; a partition evicted and seen again continues in a new part file.
+    """
+
+    def __init__(
+        self,
+        out_dir: Path,
+        *,
+        row_group_size: int = 50000,
+        max_buffered_rows: int = 200000,
+        max_open_files: int = 64,
+        compression: str = "zstd",
+    ) -> None:
+        self.out_dir = Path(out_dir)
+        self.schema = tweet_schema()
+        self.row_group_size = max(1, int(row_group_size))
+        self.max_buffered_rows = max(self.row_group_size, int(max_buffered_rows))
+        self.max_open_files = max(1, int(max_open_files))
+        self.compression = compression
+        self.rows = 0
+        self.files = 0
+        self._buffers: Dict[Tuple[str, str], List[Dict[str, Any]]] = {}
+        self._buffered = 0
+        self._writers: "OrderedDict[Tuple[str, str], Any]" = OrderedDict()
+        self._parts: Dict[Tuple[str, str], int] = {}
+
+    def add(self, row: Dict[str, Any]) -> None:
+        key = partition_of(row)
+        buf = self._buffers.setdefault(key, [])
+        buf.append(row)
+        self._buffered += 1
+        self.rows += 1
+        if len(buf) >= self.row_group_size:
+            self._flush(key)
+        elif self._buffered >= self.max_buffered_rows:
+            self._flush(max(self._buffers, key=lambda k: len(self._buffers[k])))
+
+    def _writer(self, key: Tuple[str, str]):
+        writer = self._writers.get(key)
+        if writer is not None:
+            self._writers.move_to_end(key)
+            return writer
+        if len(self._writers) >= self.max_open_files:
+            _, oldest = self._writers.popitem(last=False)
+            oldest.close()
+        part = self._parts.get(key, 0)
+        self._parts[key] = part + 1
+        path = self.out_dir / f"user={key[0]}" / f"month={key[1]}" / f"part-{part:05d}.parquet"
+        path.parent.mkdir(parents=True, exist_ok=True)
+        writer = pq.ParquetWriter(
+            str(path),
+            self.schema,
+            compression=self.compression,
+            use_dictionary=DICTIONARY_COLUMNS,
+            write_statistics=True,
+        )
+        self._writers[key] = writer
+        self.files += 1
+        return writer
+
+    def _flush(self, key: Tuple[str, str]) -> None:
+        rows = self._buffers.pop(key, None)
+        if not rows:
+            return
+        self._buffered -= len(rows)
+        self._writer(key).write_table(pa.Table.from_pylist(rows, schema=self.schema), row_group_size=self.row_group_size)
+
+    def close(self) -> None:
+        for key in list(self._buffers):
+            self._flush(key)
+        while self._writers:
+            _, writer = self._writers.popitem(last=False)
+            writer.close()
+
+
+def _owner_from_filename(path: Path) -> Optional[str]:
+    # main.py names rich files "<screen_name>-<time>-rich.jsonl"; screen names never contain "-"
+    if path.name.endswith("-rich.jsonl"):
+        return path.name.split("-", 1)[0] or None
+    return None
+
+
+def export_parquet(files: List[Path], sink: ParquetSink, *, kinds: Tuple[str, ...] = ("tweet", "reply")) -> int:
+    """Stream tweet/reply records (first occurrence of each tweet id) into `sink`; returns rows written."""
+    seen: Set[str] = set()
+    markers = [f'"kind":"{k}"' for k in kinds]
+    for path in files:
+        owner = _owner_from_filename(path)
+        with path.open("r", encoding="utf-8") as f:
+            for line in f:
+                if not any(m in line for m in markers):
+                    continue
+                try:
+                    rec = json.loads(line)
+                except ValueError:
+                    continue
+                if not isinstance(rec, dict) or rec.get("kind") not in kinds:
+                    continue
+                tweet_id = rec.get("tweet_id")
+                if not tweet_id or tweet_id in seen:
+                    continue
+                seen.add(tweet_id)
+                sink.add(flatten_record(rec, owner))
+    return sink.rows
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Convert *-rich.jsonl / *-Reply.jsonl into Parquet partitioned by user and month."
+    )
+    parser.add_argument("inputs", nargs="*", help="JSONL file/dir/glob. If empty, scan --root recursively.")
+    parser.add_argument("--root", default=".", help="Root directory to scan when no inputs are provided.")
+    parser.add_argument("-o", "--output", default="exported_parquet", help="Output dataset directory (must be empty or missing).")
+    parser.add_argument("--row-group-size", type=int, default=50000, help="Rows per Parquet row group.")
+    parser.add_argument("--max-buffered-rows", type=int, default=200000, help="Upper bound on rows held in memory across all partitions.")
+    parser.add_argument("--compression", default="zstd", help="Parquet codec (zstd, snappy, gzip, none).")
+    args = parser.parse_args(argv)
+
+    if not _ARROW_OK:
+        raise SystemExit("pyarrow is required: pip install pyarrow")
+
+    out_dir = Path(args.output)
+    if out_dir.exists() and any(out_dir.iterdir()):
+        raise SystemExit(f"{out_dir} is not empty; choose another --output")
+
+    files = discover_rich_files(args.inputs, root=args.root)
+    sink = ParquetSink(
+        out_dir,
+        row_group_size=args.row_group_size,
+        max_buffered_rows=args.max_buffered_rows,
+        compression=None if args.compression == "none" else args.compression,
+    )
+    try:
+        rows = export_parquet(files, sink)
+    finally:
+        sink.close()
+
+    print(f"Input JSONL files: {len(files)}")
+    print(f"Rows: {rows}, Parquet files: {sink.files}")
+    print(f"Wrote: {out_dir}")
+
+
+if __name__ == "__main__":
+    main()
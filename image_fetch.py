@@ -0,0 +1,198 @@
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import random
+import threading
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+
+
+RETRY_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+def cache_path(cache_dir: Path, url: str) -> Path:
+    """<cache>/<ab>/<sha256(url)><ext>: the same URL always maps to the same file, so re-runs skip it."""
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    parsed = urlparse(url)
+    ext = os.path.splitext(parsed.path)[1]
+    if not ext:
+        fmt = (parse_qs(parsed.query).get("format") or [""])[0]     # pbs.twimg.com/media/x?format=jpg&name=orig
+        ext = f".{fmt}" if fmt.isalnum() else ".img"
+    return cache_dir / key[:2] / f"{key}{ext.lower()}"
+
+
+def _file_ref(path: Path) -> Dict[str, Any]:
+    h = hashlib.sha256()
+    size = 0
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+            size += len(chunk)
+    return {"path": str(path.resolve()), "sha256": h.hexdigest(), "size": size}
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    value = resp.headers.get("retry-after")
+    try:
+        return min(60.0, max(0.0, float(value))) if value else None
+    except ValueError:
+        return None
+
+
+class ImageFetcher:
+    """
+    Pooled async image downloader: one AsyncClient (keep-alive), at most `concurrency` transfers at a time,
+    retries with exponential backoff (Retry-After honoured) and an on-disk cache keyed by URL.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path,
+        *,
+        concurrency: int = 8,
+        retries: int = 3,
+        timeout: float = 20.0,
+        proxy: Optional[str] = None,
+    ) -> None:
+        self.cache_dir = Path(cache_dir)
+        self.retries = max(0, int(retries))
+        self.hits = 0
+        self.downloads = 0
+        self.failures = 0
+        self._sem = asyncio.Semaphore(max(1, int(concurrency)))
+        self._client = httpx.AsyncClient(
+            proxy=proxy,
+            timeout=timeout,
+            follow_redirects=True,
+            headers={"User-Agent": "Mozilla/5.0"},
+            limits=httpx.Limits(max_connections=max(1, int(concurrency)), max_keepalive_connections=max(1, int(concurrency))),
+        )
+        self._inflight: Dict[str, "asyncio.Future"] = {}
+
+    async def fetch(self, url: str) -> Optional[Dict[str, Any]]:
+        """image_files ref ({path, sha256, size}) for `url`, or None when it can't be fetched."""
+        if not url:
+            return None
+        dst = cache_path(self.cache_dir, url)
+        if dst.exists():
+            self.hits += 1
+            # hashing a cached file is blocking I/O; keep it off the loop so downloads in flight keep going
+            return await asyncio.to_thread(_file_ref, dst)
+        # the same image listed twice in one run is downloaded once
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._download(url, dst))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _t: self._inflight.pop(url, None))
+        return await asyncio.shield(task)
+
+    async def fetch_all(self, urls: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+        return list(await asyncio.gather(*(self.fetch(u) for u in urls)))
+
+    async def _download(self, url: str, dst: Path) -> Optional[Dict[str, Any]]:
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        tmp = dst.with_name(f"{dst.name}.{os.getpid()}.part")
+        for attempt in range(self.retries + 1):
+            delay: Optional[float] = None
+            try:
+                async with self._sem:
+                    async with self._client.stream("GET", url) as resp:
+                        if resp.status_code in RETRY_STATUS:
+                            delay = _retry_after(resp)
+                            raise httpx.HTTPStatusError(f"HTTP {resp.status_code}", request=resp.request, response=resp)
+                        resp.raise_for_status()
+                        h = hashlib.sha256()
+                        size = 0
+                        with tmp.open("wb") as f:
+                            async for chunk in resp.aiter_bytes(1 << 16):
+                                h.update(chunk)
+                                f.write(chunk)
+                                size += len(chunk)
+                os.replace(tmp, dst)
+                self.downloads += 1
+                return {"path": str(dst.resolve()), "sha256": h.hexdigest(), "size": size}
+            except (httpx.TransportError, httpx.HTTPStatusError) as e:
+                retryable = not isinstance(e, httpx.HTTPStatusError) or e.response.status_code in RETRY_STATUS
+                if not retryable or attempt >= self.retries:
+                    break
+                await asyncio.sleep(delay if delay is not None else min(30.0, 2 ** attempt) + random.random())
+            finally:
+                if tmp.exists():
+                    tmp.unlink()
+        self.failures += 1
+        return None
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
+
+
+class BackgroundFetcher:
+    """Runs one ImageFetcher on its own event-loop thread so thread-pool code (spider_pipeline) shares its pool and limits."""
+
+    def __init__(self, cache_dir: Path, **kwargs: Any) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="image-fetch", daemon=True)
+        self._thread.start()
+
+        async def _make() -> ImageFetcher:
+            return ImageFetcher(cache_dir, **kwargs)
+
+        self.fetcher = asyncio.run_coroutine_threadsafe(_make(), self._loop).result()
+
+    def fetch_all(self, urls: Iterable[str]) -> List[Optional[Dict[str, Any]]]:
+        return asyncio.run_coroutine_threadsafe(self.fetcher.fetch_all(list(urls)), self._loop).result()
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.fetcher.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+
+
+async def _attach_refs(notes: List[Any], fetcher: ImageFetcher) -> None:
+    async def _one(note: Dict[str, Any]) -> None:
+        refs = await fetcher.fetch_all(note.get("image_list") or [])
+        # failed downloads leave a gap, not a shift: each ref keeps its 1-based image_list position
+        note["image_files"] = [{"index": idx, **ref} for idx, ref in enumerate(refs, 1) if ref]
+
+    await asyncio.gather(*(_one(n) for n in notes if isinstance(n, dict)))
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Download note['image_list'] into a URL-keyed cache and add note['image_files'] refs.")
+    parser.add_argument("input", help="Spider-style notes JSON")
+    parser.add_argument("-o", "--output", required=True, help="Notes JSON with image_files added")
+    parser.add_argument("--cache-dir", default="datas/image_cache", help="Image cache directory (default: datas/image_cache)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WORKERS", "8")), help="Concurrent downloads")
+    parser.add_argument("--retries", type=int, default=3, help="Retries per image on timeouts / 429 / 5xx")
+    parser.add_argument("--proxy", default=None)
+    args = parser.parse_args(argv)
+
+    with open(args.input, encoding="utf-8") as f:
+        notes = json.load(f)
+
+    async def _run() -> ImageFetcher:
+        fetcher = ImageFetcher(Path(args.cache_dir), concurrency=args.workers, retries=args.retries, proxy=args.proxy)
+        try:
+            await _attach_refs(notes, fetcher)
+        finally:
+            await fetcher.aclose()
+        return fetcher
+
+    fetcher = asyncio.run(_run())
+    out = Path(args.output)
+    out.parent.mkdir(parents=True, exist_ok=True)
+    tmp = out.with_suffix(".tmp")
+    with tmp.open("w", encoding="utf-8") as f:
+        json.dump(notes, f, ensure_ascii=False, indent=2)
+    tmp.replace(out)
+    print(f"cached {fetcher.hits}, downloaded {fetcher.downloads}, failed {fetcher.failures} -> {out}")
+
+
+if __name__ == "__main__":
+    main()
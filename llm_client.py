@@ -0,0 +1,276 @@
+import asyncio
+import json
+import random
+import re
+import threading
+from typing import Any, Dict, List, Optional, Set
+
+import httpx
+
+from rate_limit import RateBudget
+
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+# answers to a packed request that mean "send fewer images at once"
+PACK_REFUSED_STATUS = {400, 413}
+
+# rough prompt cost of one shrunk (<=800px) image: 4 tiles * 170 + 85 under the usual tile accounting
+IMAGE_TOKEN_ESTIMATE = 765
+MAX_TOKENS_PER_IMAGE = 1024
+
+# appended to the prompt when several images share one request
+PACKED_PROMPT = (
+    "\n\nYou are given {n} separate images. Do this for each image independently and "
+    "answer with only a JSON array of {n} strings, element i holding the text of image i."
+)
+
+
+def effective_pack(images_per_request: int, token_budget: int) -> int:
+    """Images per request actually used: the requested count, capped by the prompt-token budget."""
+    return max(1, min(int(images_per_request), int(token_budget) // IMAGE_TOKEN_ESTIMATE))
+
+
+class AdaptiveLimiter:
+    """
+    Concurrency limit that halves on rate limiting and grows back by one per success (AIMD),
+    never above `maximum` nor below 1.
+    """
+
+    def __init__(self, maximum: int) -> None:
+        self.maximum = max(1, int(maximum))
+        self.limit = self.maximum
+        self._active = 0
+        self._cond = asyncio.Condition()
+
+    async def __aenter__(self) -> "AdaptiveLimiter":
+        async with self._cond:
+            await self._cond.wait_for(lambda: self._active < self.limit)
+            self._active += 1
+        return self
+
+    async def __aexit__(self, *exc: Any) -> None:
+        async with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    async def throttled(self) -> None:
+        async with self._cond:
+            self.limit = max(1, self.limit // 2)
+
+    async def succeeded(self) -> None:
+        async with self._cond:
+            if self.limit < self.maximum:
+                self.limit += 1
+                self._cond.notify_all()
+
+
+def _retry_after(resp: httpx.Response) -> Optional[float]:
+    value = resp.headers.get("retry-after")
+    try:
+        return min(120.0, max(0.0, float(value))) if value else None
+    except ValueError:
+        return None
+
+
+def _content(body: Dict[str, Any]) -> str:
+    choices = body.get("choices") or []
+    if not choices:
+        return ""
+    return ((choices[0].get("message", {}) or {}).get("content") or "").strip()
+
+
+def _parse_packed(text: str, n: int) -> Optional[List[str]]:
+    """The JSON array of n strings a packed request asks for, or None if the model answered something else."""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    try:
+        items = json.loads(text)
+    except json.JSONDecodeError:
+        return None
+    if not isinstance(items, list) or len(items) != n:
+        return None
+    return [item if isinstance(item, str) else json.dumps(item, ensure_ascii=False) for item in items]
+
+
+class LLMClient:
+    """
+    Async OpenAI-compatible chat client for image text extraction: one pooled httpx.AsyncClient
+    (keep-alive, so no handshake per image), an adaptive concurrency limit, retries with backoff
+    on 429/5xx (Retry-After honoured) and, with images_per_request > 1, concurrent requests packed
+    into one call up to `token_budget` prompt tokens. A 429 pauses every caller through a shared
+    RateBudget (optionally also capped at `requests_per_minute`) instead of each retrying on its own.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        api_key: Optional[str],
+        model: str,
+        *,
+        system_prompt: str,
+        prompt: str,
+        concurrency: int = 8,
+        retries: int = 5,
+        timeout: float = 90.0,
+        images_per_request: int = 1,
+        token_budget: int = 4000,
+        batch_wait: float = 0.05,
+        requests_per_minute: int = 0,
+    ) -> None:
+        self.url = f"{base_url.rstrip('/')}/v1/chat/completions"
+        self.model = model
+        self.system_prompt = system_prompt
+        self.prompt = prompt
+        self.retries = max(0, int(retries))
+        self.pack = effective_pack(images_per_request, token_budget)
+        self.batch_wait = batch_wait
+        self.requests = 0
+        self.retried = 0
+        self._limiter = AdaptiveLimiter(concurrency)
+        self._budget = RateBudget(requests_per_minute if requests_per_minute > 0 else 1_000_000, 60)
+        self._client = httpx.AsyncClient(
+            timeout=timeout,
+            headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"},
+            limits=httpx.Limits(max_connections=max(1, int(concurrency)), max_keepalive_connections=max(1, int(concurrency))),
+        )
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    # ---- transport ----
+
+    async def _post(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+        for attempt in range(self.retries + 1):
+            backoff = min(60.0, 2 ** attempt) + random.random()
+            await self._budget.acquire()
+            try:
+                async with self._limiter:
+                    self.requests += 1
+                    resp = await self._client.post(self.url, json=payload)
+            except httpx.TransportError:
+                if attempt >= self.retries:
+                    raise
+                self.retried += 1
+                await asyncio.sleep(backoff)
+                continue
+            if resp.status_code not in RETRY_STATUS:
+                resp.raise_for_status()
+                await self._limiter.succeeded()
+                return resp.json()
+            if attempt >= self.retries:
+                resp.raise_for_status()
+            self.retried += 1
+            retry_after = _retry_after(resp)
+            if resp.status_code == 429:
+                # rate limited: fewer requests in flight, and everyone waits out the same pause
+                await self._limiter.throttled()
+                self._budget.pause_until(retry_after=retry_after if retry_after is not None else backoff)
+            else:
+                await asyncio.sleep(retry_after if retry_after is not None else backoff)
+        raise RuntimeError("unreachable")
+
+    def _payload(self, content: List[Dict[str, Any]], n: int) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": self.system_prompt},
+                {"role": "user", "content": content},
+            ],
+            "temperature": 0.2,
+            "max_tokens": MAX_TOKENS_PER_IMAGE * n,
+        }
+
+    @staticmethod
+    def _image_part(image_b64: str, mime: str, idx: int) -> Dict[str, Any]:
+        return {"type": "image_url", "image_url": {"url": f"data:{mime};base64,{image_b64}", "description": f"Image {idx}"}}
+
+    async def _extract_one(self, image_b64: str, mime: str, idx: int) -> str:
+        content = [{"type": "text", "text": self.prompt}, self._image_part(image_b64, mime, idx)]
+        return _content(await self._post(self._payload(content, 1)))
+
+    async def _extract_packed(self, items: List[tuple]) -> List[str]:
+        n = len(items)
+        content: List[Dict[str, Any]] = [{"type": "text", "text": self.prompt + PACKED_PROMPT.format(n=n)}]
+        content += [self._image_part(b64, mime, i) for i, (b64, mime, _idx) in enumerate(items, 1)]
+        try:
+            texts = _parse_packed(_content(await self._post(self._payload(content, n))), n)
+        except httpx.HTTPStatusError as e:
+            # only 413 / 400 (too many images or too large a body) are about the packing itself; a 429 that
+            # survived the retries or an auth error would just fail N times over as single requests
+            if e.response.status_code not in PACK_REFUSED_STATUS:
+                raise
+            texts = None
+        if texts is None:
+            # request refused or model ignored the format: fall back to one request per image
+            texts = list(await asyncio.gather(*(self._extract_one(*item) for item in items)))
+        return texts
+
+    # ---- packing ----
+
+    async def _batch_loop(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_wait
+            while len(batch) < self.pack:
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), max(0.0, deadline - loop.time())))
+                except asyncio.TimeoutError:
+                    break
+            task = asyncio.ensure_future(self._run_batch(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run_batch(self, batch: List[tuple]) -> None:
+        try:
+            if len(batch) == 1:
+                texts = [await self._extract_one(*batch[0][0])]
+            else:
+                texts = await self._extract_packed([item for item, _fut in batch])
+        except Exception as exc:
+            for _item, fut in batch:
+                if not fut.done():
+                    fut.set_exception(exc)
+            return
+        for (_item, fut), text in zip(batch, texts):
+            if not fut.done():
+                fut.set_result(text)
+
+    async def extract_text(self, image_b64: str, mime: str, idx: int) -> str:
+        if self.pack <= 1:
+            return await self._extract_one(image_b64, mime, idx)
+        if self._batcher is None:
+            self._queue = asyncio.Queue()
+            self._batcher = asyncio.ensure_future(self._batch_loop())
+        fut = asyncio.get_running_loop().create_future()
+        await self._queue.put(((image_b64, mime, idx), fut))
+        return await fut
+
+    async def aclose(self) -> None:
+        if self._batcher is not None:
+            self._batcher.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self._client.aclose()
+
+
+class BackgroundLLMClient:
+    """LLMClient on its own event-loop thread, callable from the OCR thread pools (one shared connection pool)."""
+
+    def __init__(self, *args: Any, **kwargs: Any) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True)
+        self._thread.start()
+
+        async def _make() -> LLMClient:
+            return LLMClient(*args, **kwargs)
+
+        self.client = asyncio.run_coroutine_threadsafe(_make(), self._loop).result()
+
+    def extract_text(self, image_b64: str, mime: str, idx: int) -> str:
+        return asyncio.run_coroutine_threadsafe(self.client.extract_text(image_b64, mime, idx), self._loop).result()
+
+    def close(self) -> None:
+        asyncio.run_coroutine_threadsafe(self.client.aclose(), self._loop).result()
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
@@ -0,0 +1,182 @@
+import argparse
+import asyncio
+import base64
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+from llm_client import LLMClient
+
+
+class StubState:
+    """What the stand-in server refuses and what it has seen."""
+
+    def __init__(self, *, max_images: int = 0, rate_limit: int = 0, retry_after: float = 1.0) -> None:
+        self.max_images = max_images      # 413 for requests with more images than this (0: no limit)
+        self.rate_limit = rate_limit      # answer the first N requests with 429
+        self.retry_after = retry_after
+        self.lock = threading.Lock()
+        self.seen: List[int] = []         # image count of every request, in arrival order
+        self.statuses: List[int] = []
+
+
+def _images(payload: Dict[str, Any]) -> List[str]:
+    """The data: URL payloads of the user message, decoded (the check sends each image's expected text)."""
+    out = []
+    for message in payload.get("messages") or []:
+        if message.get("role") != "user" or not isinstance(message.get("content"), list):
+            continue
+        for part in message["content"]:
+            if part.get("type") == "image_url":
+                url = part["image_url"]["url"]
+                out.append(base64.b64decode(url.split(",", 1)[1]).decode("utf-8", "replace"))
+    return out
+
+
+def make_handler(state: StubState):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args: Any) -> None:
+            pass
+
+        def _reply(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self) -> None:
+            payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+            images = _images(payload)
+            with state.lock:
+                state.seen.append(len(images))
+                if state.rate_limit > 0:
+                    state.rate_limit -= 1
+                    status = 429
+                elif state.max_images and len(images) > state.max_images:
+                    status = 413
+                else:
+                    status = 200
+                state.statuses.append(status)
+            if status == 429:
+                self._reply(429, {"error": {"message": "rate limited"}}, {"Retry-After": str(state.retry_after)})
+                return
+            if status == 413:
+                self._reply(413, {"error": {"message": "too many images"}})
+                return
+            text = images[0] if len(images) == 1 else json.dumps(images, ensure_ascii=False)
+            self._reply(200, {"choices": [{"message": {"role": "assistant", "content": text}}]})
+
+    return Handler
+
+
+def serve(state: StubState, port: int = 0) -> ThreadingHTTPServer:
+    """Start the stand-in server on a daemon thread; the bound port is server.server_address[1]."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(state))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+async def _extract_all(client: LLMClient, texts: List[str]) -> List[str]:
+    try:
+        return list(await asyncio.gather(*(
+            client.extract_text(base64.b64encode(t.encode("utf-8")).decode("ascii"), "image/png", i)
+            for i, t in enumerate(texts, 1)
+        )))
+    finally:
+        await client.aclose()
+
+
+def _client(port: int, **kwargs: Any) -> LLMClient:
+    return LLMClient(f"http://127.0.0.1:{port}", "stub", "stub-model", system_prompt="stub", prompt="stub", **kwargs)
+
+
+def check() -> bool:
+    """Run LLMClient against the stand-in server: packing, 413 fallback, 429 pause and 429 on a packed request."""
+    texts = [f"image {i}" for i in range(1, 11)]
+    ok = True
+
+    def report(name: str, passed: bool, detail: str) -> None:
+        nonlocal ok
+        ok = ok and passed
+        print(f"[{'ok' if passed else 'FAIL'}] {name}: {detail}")
+
+    # 1. ten concurrent images, four per request -> 4 + 4 + 2
+    state = StubState()
+    server = serve(state)
+    got = asyncio.run(_extract_all(_client(server.server_address[1], images_per_request=4, batch_wait=0.2), texts))
+    server.shutdown()
+    report("packing", got == texts and sorted(state.seen) == [2, 4, 4], f"requests carried {state.seen} image(s)")
+
+    # 2. the server takes at most two images: packed requests get 413 and fall back to single requests
+    state = StubState(max_images=2)
+    server = serve(state)
+    got = asyncio.run(_extract_all(_client(server.server_address[1], images_per_request=4, batch_wait=0.2), texts))
+    server.shutdown()
+    report(
+        "413 fallback",
+        got == texts and 413 in state.statuses and all(n <= 2 for n, st in zip(state.seen, state.statuses) if st == 200),
+        f"statuses {state.statuses}",
+    )
+
+    # 3. the first two requests are rate limited: everyone waits out Retry-After, then all succeed
+    state = StubState(rate_limit=2, retry_after=1)
+    server = serve(state)
+    client = _client(server.server_address[1], concurrency=4, retries=3)
+    started = time.monotonic()
+    got = asyncio.run(_extract_all(client, texts[:4]))
+    elapsed = time.monotonic() - started
+    server.shutdown()
+    report(
+        "429 pause",
+        got == texts[:4] and client.retried >= 2 and elapsed >= 1.0,
+        f"{client.retried} retried, {elapsed:.1f}s",
+    )
+
+    # 4. a packed request still rate limited after its retries fails as is, without N single retries
+    state = StubState(rate_limit=100, retry_after=0)
+    server = serve(state)
+    try:
+        asyncio.run(_extract_all(_client(server.server_address[1], images_per_request=4, retries=1, batch_wait=0.2), texts[:4]))
+        raised = False
+    except httpx.HTTPStatusError as e:
+        raised = e.response.status_code == 429
+    server.shutdown()
+    report("packed 429", raised and state.seen == [4, 4], f"requests carried {state.seen} image(s)")
+    return ok
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Stand-in OpenAI-compatible server for exercising llm_client.py offline.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_serve = sub.add_parser("serve", help="Serve /v1/chat/completions, echoing each image's bytes as its text")
+    p_serve.add_argument("--port", type=int, default=8765)
+    p_serve.add_argument("--max-images", type=int, default=0, help="Answer 413 above this many images per request")
+    p_serve.add_argument("--rate-limit", type=int, default=0, help="Answer the first N requests with 429")
+    p_serve.add_argument("--retry-after", type=float, default=1.0)
+    sub.add_parser("check", help="Run LLMClient against the stand-in: packing, 413 fallback, 429 pauses")
+    args = parser.parse_args(argv)
+
+    if args.command == "check":
+        sys.exit(0 if check() else 1)
+    state = StubState(max_images=args.max_images, rate_limit=args.rate_limit, retry_after=args.retry_after)
+    server = serve(state, args.port)
+    print(f"OPENAI_BASE_URL=http://127.0.0.1:{server.server_address[1]}  (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,7 @@
 import re
 import time
+import hashlib
+import shutil
 from datetime import datetime, timezone
 import httpx
 import asyncio
@@ -16,7 +18,13 @@ from md_gen import md_gen
 from cache_gen import cache_gen
 from url_utils import quote_url, cookie_get, require_cookie_fields
 from rich_output import JsonlWriter, extract_tweet_record, unwrap_tweet_result
-from crawl_state import build_run_key, load_state, save_state, clear_state, infer_existing_media_count
+from crawl_state import build_run_key, load_state, save_state, clear_state, load_watermark, save_watermark, load_media_counter, reserve_media_indices, MediaInventory, PageJournal
+from user_cache import UserCache, apply_to_user_info, put_from_user_result
+from rate_limit import RateScheduler
+from catalog import Catalog
+from transcode import Transcoder, transcode_available
+from near_dup import run_catalog_stage
+from thumbnails import Thumbnailer, thumbnail_format
 
 def _strip_jsonc_comments(text: str) -> str:
     out = []
@@ -132,6 +140,7 @@ has_video = False
 download_media = True
 csv_file = None
 cache_data = None
+media_inventory = None
 down_log = False
 autoSync = False
 
@@ -187,6 +196,18 @@ else:
     proxies = None
 rich_output = bool(settings.get('rich_output', True))
 rich_include_raw_legacy = bool(settings.get('rich_include_raw_legacy', False))
+user_cache_ttl_hours = float(settings.get('user_cache_ttl_hours', 24) or 0)
+user_cache = UserCache(ttl_hours=user_cache_ttl_hours) if user_cache_ttl_hours > 0 else None
+catalog_enabled = bool(settings.get('catalog', True))
+md_thumbnails = bool(settings.get('md_thumbnails', False)) and Thumbnailer.available()
+md_thumbnail_format = thumbnail_format() if md_thumbnails else None
+md_thumbnail_videos = md_thumbnails and shutil.which('ffmpeg') is not None
+if settings.get('md_thumbnails') and not md_thumbnails:
+    print('md_thumbnails 需要安装 Pillow, Markdown 将直接引用原图')
+near_dup_mode = str(settings.get('near_dup', 'off') or 'off').lower()
+near_dup_max_distance = int(settings.get('near_dup_max_distance', 6) or 0)
+catalog_db = None       #首次用到时在 save_path 下打开 .catalog.sqlite3
+catalog_run_id = None
 
 ############
 if settings['image_format'] == 'orig':
@@ -243,6 +264,62 @@ RUN_KEY = build_run_key(
     has_likes=has_likes,
 )
 
+# autoSync 的同步位置(watermark)按时间线模式分别记录在 .crawl_state.json
+TIMELINE_MODE = 'likes' if has_likes else ('highlights' if has_highlights else ('tweets' if has_retweet else 'media'))
+SYNC_HEAD_SIZE = 20
+sync_watermark = None   #上次完整同步时看到的最新推文
+sync_head = {}          #本次运行看到的最新推文, 同步完成后写回 watermark
+
+
+api_scheduler = None    #守护模式下按接口限速(RateScheduler), 单次运行时为 None
+sync_new_count = 0      #本次同步处理的新推文数, 守护模式据此估计发推频率
+
+
+def _acquire(endpoint: str) -> None:
+    if api_scheduler is not None:
+        api_scheduler.budget(endpoint).acquire_blocking()
+
+
+def _note_rate_headers(endpoint: str, resp: httpx.Response) -> None:
+    if api_scheduler is None:
+        return
+    budget = api_scheduler.budget(endpoint)
+    budget.update_from_headers(resp.headers)
+    if resp.status_code == 429:
+        budget.pause_from_headers(resp.headers)
+
+
+def _sync_reached(tweet_id, tweet_msecs) -> bool:
+    '''记录本次看到的最新推文; 返回 True 表示已到达上次同步过的位置'''
+    if not tweet_id:
+        return False
+    tweet_id = str(tweet_id)
+    if sync_watermark:
+        if TIMELINE_MODE in ('likes', 'highlights'):    #按点赞/收录时间排序, ID 不单调, 只能按上次开头的若干条判断
+            if tweet_id in sync_watermark.get('head_ids', ()):
+                return True
+        else:
+            last_id = _try_int(sync_watermark.get('tweet_id'))
+            cur_id = _try_int(tweet_id)
+            if last_id is not None and cur_id is not None and cur_id <= last_id:
+                return True
+    if tweet_msecs <= end_time_stamp:   #超出右侧时间范围的推文未被处理, 不能计入同步位置
+        global sync_new_count
+        sync_new_count += 1
+        if 'tweet_id' not in sync_head:
+            sync_head['tweet_id'] = tweet_id
+            sync_head['created_at_ms'] = tweet_msecs
+        head_ids = sync_head.setdefault('head_ids', [])
+        if len(head_ids) < SYNC_HEAD_SIZE and tweet_id not in head_ids:
+            head_ids.append(tweet_id)
+    return False
+
+
+def _sync_extra(extra: dict) -> dict:
+    if autoSync and sync_head:
+        extra['pending_watermark'] = sync_head
+    return extra
+
 
 def _ensure_csrf_headers(headers: dict) -> bool:
     cookie = str(headers.get('cookie', '')).strip()
@@ -279,13 +356,32 @@ def _print_api_errors(raw: object) -> Optional[str]:
     return 'other'
 
 def get_other_info(_user_info):
+    if user_cache:
+        cached = user_cache.get(_user_info.screen_name)
+        if cached:
+            apply_to_user_info(_user_info, cached)
+            return True
+    try:
+        return _fetch_other_info(_user_info)
+    except RateLimitExceeded:
+        # rest_id 不会变, 限流时退回过期缓存(计数可能略旧)
+        stale = user_cache.get(_user_info.screen_name, allow_stale=True) if user_cache else None
+        if not stale:
+            raise
+        print('UserByScreenName 已限流, 使用本地缓存的用户信息')
+        apply_to_user_info(_user_info, stale)
+        return True
+
+def _fetch_other_info(_user_info):
     url = 'https://twitter.com/i/api/graphql/xc8f1g7BYqr6VTzTbvNlGw/UserByScreenName?variables={"screen_name":"' + _user_info.screen_name + '","withSafetyModeUserFields":false}&features={"hidden_profile_likes_enabled":false,"hidden_profile_subscriptions_enabled":false,"responsive_web_graphql_exclude_directive_enabled":true,"verified_phone_label_enabled":false,"subscriptions_verification_info_verified_since_enabled":true,"highlights_tweets_tab_ui_enabled":true,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"responsive_web_graphql_timeline_navigation_enabled":true}&fieldToggles={"withAuxiliaryUserLabels":false}'
     response = ''
     try:
         if 'x-csrf-token' not in _headers and not _ensure_csrf_headers(_headers):
             return False
         global request_count
+        _acquire('UserByScreenName')
         resp = httpx.get(quote_url(url), headers=_headers, proxy=proxies)
+        _note_rate_headers('UserByScreenName', resp)
         response = resp.text
         request_count += 1
         if resp.status_code == 429:
@@ -309,6 +405,9 @@ def get_other_info(_user_info):
         _user_info.name = raw_data['data']['user']['result']['legacy']['name']
         _user_info.statuses_count = raw_data['data']['user']['result']['legacy']['statuses_count']
         _user_info.media_count = raw_data['data']['user']['result']['legacy']['media_count']
+        if user_cache:
+            put_from_user_result(user_cache, _user_info.screen_name, raw_data['data']['user']['result'])
+            user_cache.save()
     except RateLimitExceeded:
         raise
     except Exception as e:
@@ -318,6 +417,33 @@ def get_other_info(_user_info):
         return False
     return True
 
+def _emit_tweet_record(tweet_node, owner, **kwargs):
+    '''推文元信息写入 rich jsonl 与 catalog (同一推文只写一次)'''
+    if not ((rich_output and rich_writer) or catalog_db):
+        return
+    rec = extract_tweet_record(tweet_node, include_raw_legacy=rich_include_raw_legacy, **kwargs)
+    if not rec or not rec.get("tweet_id") or rec["tweet_id"] in rich_seen_tweet_ids:
+        return
+    rich_seen_tweet_ids.add(rec["tweet_id"])
+    if rich_output and rich_writer:
+        rich_writer.write(rec)
+    if catalog_db:
+        catalog_db.add_tweet(rec, owner=owner, run_id=catalog_run_id)
+
+def media_downloaded(media_url, owner):
+    '''down_log 开启时判断媒体是否已下载过: 有 catalog 时按索引查询该用户目录下的记录, 旧目录的 cache_data.log 仍然有效'''
+    if not down_log:
+        return False
+    if catalog_db:
+        return catalog_db.has_media(media_url, owner=owner) or media_url in cache_data.cache_data
+    return not cache_data.is_present(media_url)
+
+def close_catalog():
+    global catalog_db
+    if catalog_db:
+        catalog_db.close()
+        catalog_db = None
+
 def print_info(_user_info):
     print(
         f'''
@@ -376,6 +502,10 @@ def get_download_url(_user_info):
                     tweet_msecs = editable_until - 3600000
                     timestr = stamp2time(tweet_msecs)
 
+                    if autoSync and _sync_reached(legacy.get('id_str') or tweet_node.get('rest_id'), tweet_msecs):   #已同步过的位置，结束
+                        start_label = False
+                        break
+
                     #我知道这边代码很烂
                     #但我实在不想重构 ( º﹃º )
 
@@ -389,17 +519,13 @@ def get_download_url(_user_info):
                                 name = a2.get('name') or name
                                 screen_name = a2.get('screen_name') or screen_name
 
-                            if rich_output and rich_writer:
-                                rec = extract_tweet_record(
-                                    tweet_node,
-                                    url_fallback_screen_name=screen_name,
-                                    editable_until_msecs=editable_until,
-                                    context={"timeline": "likes" if has_likes else ("highlights" if has_highlights else ("tweets" if has_retweet else "media"))},
-                                    include_raw_legacy=rich_include_raw_legacy,
-                                )
-                                if rec and rec.get("tweet_id") and rec["tweet_id"] not in rich_seen_tweet_ids:
-                                    rich_seen_tweet_ids.add(rec["tweet_id"])
-                                    rich_writer.write(rec)
+                            _emit_tweet_record(
+                                tweet_node,
+                                _user_info.screen_name,
+                                url_fallback_screen_name=screen_name,
+                                editable_until_msecs=editable_until,
+                                context={"timeline": "likes" if has_likes else ("highlights" if has_highlights else ("tweets" if has_retweet else "media"))},
+                            )
 
                             if 'extended_entities' in legacy:
                                 tweet_id = legacy.get("id_str") or tweet_node.get("rest_id")
@@ -438,17 +564,13 @@ def get_download_url(_user_info):
                             full_text = rt_legacy.get('full_text', '')
                             id_str = rt_legacy.get('id_str')
                             
-                            if rich_output and rich_writer:
-                                rec = extract_tweet_record(
-                                    rt_node,
-                                    url_fallback_screen_name=screen_name,
-                                    editable_until_msecs=editable_until,
-                                    context={"timeline": "retweets", "retweeted_by": {"screen_name": _user_info.screen_name, "name": _user_info.name}},
-                                    include_raw_legacy=rich_include_raw_legacy,
-                                )
-                                if rec and rec.get("tweet_id") and rec["tweet_id"] not in rich_seen_tweet_ids:
-                                    rich_seen_tweet_ids.add(rec["tweet_id"])
-                                    rich_writer.write(rec)
+                            _emit_tweet_record(
+                                rt_node,
+                                _user_info.screen_name,
+                                url_fallback_screen_name=screen_name,
+                                editable_until_msecs=editable_until,
+                                context={"timeline": "retweets", "retweeted_by": {"screen_name": _user_info.screen_name, "name": _user_info.name}},
+                            )
 
                             if 'extended_entities' in rt_legacy and screen_name != _user_info.screen_name:
                                 tweet_url = f"https://x.com/{screen_name}/status/{id_str}" if id_str else None
@@ -495,19 +617,19 @@ def get_download_url(_user_info):
                     tweet_msecs = editable_until - 3600000
                     timestr = stamp2time(tweet_msecs)
 
+                    if autoSync and _sync_reached(legacy.get('id_str') or tweet_node.get('rest_id'), tweet_msecs):
+                        start_label = False
+                        break
+
                     _result = time_comparison(tweet_msecs, start_time_stamp, end_time_stamp)
                     if _result[0]:  #符合时间限制
-                        if rich_output and rich_writer:
-                            rec = extract_tweet_record(
-                                tweet_node,
-                                url_fallback_screen_name=_user_info.screen_name,
-                                editable_until_msecs=editable_until,
-                                context={"timeline": "conversation"},
-                                include_raw_legacy=rich_include_raw_legacy,
-                            )
-                            if rec and rec.get("tweet_id") and rec["tweet_id"] not in rich_seen_tweet_ids:
-                                rich_seen_tweet_ids.add(rec["tweet_id"])
-                                rich_writer.write(rec)
+                        _emit_tweet_record(
+                            tweet_node,
+                            _user_info.screen_name,
+                            url_fallback_screen_name=_user_info.screen_name,
+                            editable_until_msecs=editable_until,
+                            context={"timeline": "conversation"},
+                        )
 
                         if 'extended_entities' in legacy:
                             tweet_id = legacy.get("id_str") or tweet_node.get("rest_id")
@@ -567,7 +689,9 @@ def get_download_url(_user_info):
         url = url_top + url_bottom      #第一页,无cursor
     try:
         global request_count
+        _acquire(TIMELINE_MODE)
         resp = httpx.get(quote_url(url), headers=_headers, proxy=proxies)
+        _note_rate_headers(TIMELINE_MODE, resp)
         response = resp.text
         request_count += 1
         if resp.status_code == 429:
@@ -646,18 +770,29 @@ def download_control(_user_info):
                 if photo_lst and photo_lst[0] is True:
                     continue
                 if _user_info.save_path:
-                    save_state(_user_info.save_path, run_key=RUN_KEY, cursor=_user_info.cursor, extra={"mode": "metadata_only"})
+                    save_state(_user_info.save_path, run_key=RUN_KEY, cursor=_user_info.cursor, extra=_sync_extra({"mode": "metadata_only"}))
+
+        journal = PageJournal(_user_info.save_path)
+        thumbnailer = Thumbnailer(max_workers=min(max_concurrent_requests, os.cpu_count() or 1), max_side=int(settings.get('md_thumbnail_size', 480) or 480), fmt=md_thumbnail_format) if md_output and md_thumbnails else None
+        transcoder = Transcoder(max_workers=min(max_concurrent_requests, os.cpu_count() or 1)) if not orig_format and transcode_available() else None
 
-        async def down_save(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url, prefix, csv_info, order: int, media_meta=None):
+        async def down_save(client: httpx.AsyncClient, semaphore: asyncio.Semaphore, url, prefix, csv_info, index: int, media_meta=None):
+            # index 为绝对编号(页起始计数 + 页内序号), 断点补下载时沿用日志中记录的编号
+            src_ext = None      #需要本地转码时为原图格式
             if '.mp4' in url:
-                _file_name = f'{_user_info.save_path + os.sep}{prefix}_{_user_info.count + order}.mp4'
+                _file_name = f'{_user_info.save_path + os.sep}{prefix}_{index}.mp4'
             else:
                 try:
                     if orig_format:
                         url += f'?name=orig'
-                        _file_name = f'{_user_info.save_path + os.sep}{prefix}_{_user_info.count + order}.{csv_info[5][-3:]}' # 根据图片 url 获取原始格式
-                    else: # 指定格式时，先使用 name=orig，404 则切回 name=4096x4096，以保证最大尺寸
-                        _file_name = f'{_user_info.save_path + os.sep}{prefix}_{_user_info.count + order}.{img_format}'
+                        _file_name = f'{_user_info.save_path + os.sep}{prefix}_{index}.{csv_info[5][-3:]}' # 根据图片 url 获取原始格式
+                    elif transcoder is not None: # 指定格式时只下载一次原图(name=orig, 404 则切回 name=4096x4096)，格式不同再在本地进程池中转码
+                        url += f'?name=orig'
+                        _file_name = f'{_user_info.save_path + os.sep}{prefix}_{index}.{img_format}'
+                        if csv_info[5][-3:].lower() != img_format:
+                            src_ext = csv_info[5][-3:]
+                    else: # 未安装 Pillow: 由服务器转换格式，使用 name=4096x4096 以保证最大尺寸
+                        _file_name = f'{_user_info.save_path + os.sep}{prefix}_{index}.{img_format}'
                         if img_format != 'png':
                             url += f'?format=jpg&name=4096x4096'
                         else:
@@ -684,8 +819,53 @@ def download_control(_user_info):
                                 response=response,
                             )
                         down_count += 1
-                    with open(_file_name,'wb') as f:
-                        f.write(response.content)
+                    kept_original = False
+                    if src_ext:
+                        _src_name, _part_name = f'{_file_name}.src.{src_ext}', f'{_file_name}.part'
+                        try:
+                            with open(_src_name,'wb') as f:
+                                f.write(response.content)
+                            try:
+                                file_size, file_sha256 = await transcoder.transcode(_src_name, _file_name, img_format)
+                            except Exception as e:  # 原图已下载成功, 转码失败不再重新下载: 保留原格式文件
+                                _kept_name = f'{os.path.splitext(_file_name)[0]}.{src_ext}'
+                                with open(_kept_name,'wb') as f:
+                                    f.write(response.content)
+                                print(f'{_file_name}=====>转码失败({type(e).__name__}: {e}), 已保留原格式文件')
+                                if md_output:
+                                    md_file.media_renamed(csv_info[-5], os.path.split(_kept_name)[1])
+                                _file_name = _kept_name
+                                csv_info[-5] = os.path.split(_file_name)[1]
+                                file_size, file_sha256 = len(response.content), hashlib.sha256(response.content).hexdigest()
+                                kept_original = True
+                        finally:
+                            for _left in (_src_name, _part_name):
+                                if os.path.exists(_left):
+                                    os.remove(_left)
+                    else:
+                        with open(_file_name,'wb') as f:
+                            f.write(response.content)
+                        file_size, file_sha256 = len(response.content), hashlib.sha256(response.content).hexdigest()
+                    journal.done(index)
+                    if thumbnailer is not None and not kept_original:     #缩略图失败不影响下载结果, Markdown 中改为直接引用原文件
+                        if await thumbnailer.make(_file_name) is None:
+                            md_file.thumb_failed(csv_info[-5])
+                    if media_inventory is not None:
+                        media_inventory.add(index, os.path.split(_file_name)[1], url=csv_info[5], size=file_size)
+
+                    if catalog_db:
+                        media_raw = (media_meta or {}).get("media") or {}
+                        catalog_db.add_media(
+                            csv_info[5],
+                            tweet_id=(media_meta or {}).get("tweet_id"),
+                            owner=_user_info.screen_name,
+                            media_type=csv_info[4],
+                            media_id_str=media_raw.get("id_str") if isinstance(media_raw, dict) else None,
+                            local_path=_file_name,
+                            size=file_size,
+                            sha256=file_sha256,
+                            run_id=catalog_run_id,
+                        )
 
                     csv_file.data_input(csv_info)
                     if rich_output and rich_writer:
@@ -723,7 +903,7 @@ def download_control(_user_info):
 
                     break
                 except Exception as e:
-                    if not ('.mp4' in url or orig_format or str(e) != "404"):
+                    if not ('.mp4' in url or orig_format or str(e) != "404") and 'name=orig' in url:     #只切换一次, 之后的 404 照常计数
                         url = url.replace('name=orig', 'name=4096x4096')
                         continue
                     count += 1
@@ -731,6 +911,9 @@ def download_control(_user_info):
                         print(f'{_file_name}=====>第{count}次下载失败，已跳过该文件。')
                         print(url)
                         print(f'原因: {type(e).__name__}: {e}')
+                        journal.failed(index, url=url, reason=f'{type(e).__name__}: {e}')     #记为最终失败, 下次运行不再补下载
+                        if thumbnailer is not None:
+                            md_file.thumb_failed(csv_info[-5])
                         break
                     # 降低刷屏：默认仅打印异常类型；如需更多细节可打开 settings.json 的 log_output
                     if log_output:
@@ -750,6 +933,17 @@ def download_control(_user_info):
                 headers=download_headers,
                 follow_redirects=True,
             ) as client:
+                semaphore = asyncio.Semaphore(max_concurrent_requests)    #最大并发数量，默认为8，对自己网络有自信的可以调高
+                pending = journal.pending()
+                if pending:     #上次中断时未完成的媒体, 直接按日志补下载, 无需重新请求时间线
+                    print(f'检测到上次未完成的 {len(pending)} 个媒体, 正在补下载')
+                    await asyncio.gather(*[asyncio.create_task(down_save(client, semaphore, i['url'], i['prefix'], i['csv_info'], i['index'], i.get('media_meta'))) for i in pending])
+                    left = journal.compact()
+                    if left:
+                        print(f'仍有 {left} 个媒体下载失败, 下次运行时重试')
+                    failures = journal.failures()
+                    if failures:
+                        print(f'共有 {len(failures)} 个媒体多次下载失败已放弃, 详见 {journal.path}')
                 while True:
                     photo_lst = get_download_url(_user_info)
                     if photo_lst is False:
@@ -758,26 +952,26 @@ def download_control(_user_info):
                         return 'error'
                     elif photo_lst[0] == True:
                         continue
-                    semaphore = asyncio.Semaphore(max_concurrent_requests)    #最大并发数量，默认为8，对自己网络有自信的可以调高
-                    if down_log:
-                        await asyncio.gather(*[asyncio.create_task(down_save(client, semaphore, url[0], url[1], url[2], order, url[3] if len(url) > 3 else None)) for order,url in enumerate(photo_lst) if cache_data.is_present(url[0])])
-                    else:
-                        await asyncio.gather(*[asyncio.create_task(down_save(client, semaphore, url[0], url[1], url[2], order, url[3] if len(url) > 3 else None)) for order,url in enumerate(photo_lst)])
+                    page = [(_user_info.count + order, url) for order, url in enumerate(photo_lst) if not media_downloaded(url[0], _user_info.screen_name)]
+                    reserve_media_indices(_user_info.save_path, _user_info.count + len(photo_lst))     #先占用本页编号, 中途崩溃也不会复用
+                    journal.queue([{"index": index, "url": url[0], "prefix": url[1], "csv_info": url[2], "media_meta": url[3] if len(url) > 3 else None} for index, url in page])
                     _user_info.count += len(photo_lst)      #更新计数
-                    if _user_info.save_path:
-                        save_state(_user_info.save_path, run_key=RUN_KEY, cursor=_user_info.cursor, extra={"downloaded_count": _user_info.count})
+                    # 本页任务已写入日志, cursor 可以先行推进到下一页
+                    save_state(_user_info.save_path, run_key=RUN_KEY, cursor=_user_info.cursor, extra=_sync_extra({"downloaded_count": _user_info.count}))
+                    await asyncio.gather(*[asyncio.create_task(down_save(client, semaphore, url[0], url[1], url[2], index, url[3] if len(url) > 3 else None)) for index, url in page])
+                    journal.compact()
         except RateLimitExceeded as e:
             if _user_info.save_path:
                 save_state(
                     _user_info.save_path,
                     run_key=RUN_KEY,
                     cursor=_user_info.cursor,
-                    extra={
-                        "downloaded_count": infer_existing_media_count(_user_info.save_path),
+                    extra=_sync_extra({
+                        "downloaded_count": _user_info.count,
                         "last_error": str(e),
                         "rate_limit_reset_at": e.reset_at,
                         "rate_limit_retry_after": e.retry_after,
-                    },
+                    }),
                 )
             if e.reset_at:
                 try:
@@ -794,9 +988,15 @@ def download_control(_user_info):
                     _user_info.save_path,
                     run_key=RUN_KEY,
                     cursor=_user_info.cursor,
-                    extra={"downloaded_count": infer_existing_media_count(_user_info.save_path), "last_error": str(e)},
+                    extra=_sync_extra({"downloaded_count": _user_info.count, "last_error": str(e)}),
                 )
             raise
+        finally:
+            journal.close()
+            if transcoder is not None:
+                transcoder.close()
+            if thumbnailer is not None:
+                thumbnailer.close()
 
     return asyncio.run(_main())
 
@@ -824,8 +1024,8 @@ def main(_user_info: object):
     else:
         _user_info.save_path = _path
 
-    # 避免重复运行覆盖同名文件；同时为恢复下载提供正确的计数起点
-    _user_info.count = infer_existing_media_count(_user_info.save_path)
+    # 避免重复运行覆盖同名文件；同时为恢复下载提供正确的计数起点(读取持久化计数, 缺失时才扫描目录修复)
+    _user_info.count = load_media_counter(_user_info.save_path)
 
     # 自动恢复上次未完成的 cursor（仅在同一配置模式下）
     state = load_state(_user_info.save_path, run_key=RUN_KEY)
@@ -842,22 +1042,35 @@ def main(_user_info: object):
 
     if md_output and download_media:
         global md_file
-        md_file = md_gen(_user_info.save_path, _user_info.name, _user_info.screen_name, settings['time_range'], has_likes, media_count_limit)
+        md_file = md_gen(_user_info.save_path, _user_info.name, _user_info.screen_name, settings['time_range'], has_likes, media_count_limit, md_thumbnail_format, md_thumbnail_videos)
 
     if down_log and download_media:
         global cache_data
         cache_data = cache_gen(_user_info.save_path)
 
-    global rich_writer, rich_seen_tweet_ids
+    global media_inventory
+    media_inventory = MediaInventory(_user_info.save_path) if download_media else None
+
+    global rich_writer, rich_seen_tweet_ids, catalog_db, catalog_run_id
+    rich_seen_tweet_ids = set()
+    if catalog_enabled and catalog_db is None:
+        catalog_db = Catalog.open_root(settings['save_path'])
+    if catalog_db:
+        catalog_run_id = catalog_db.start_run(_user_info.screen_name, mode=TIMELINE_MODE, run_key=RUN_KEY)
     if rich_output:
-        rich_seen_tweet_ids = set()
         rich_path = Path(_user_info.save_path) / f'{_user_info.screen_name}-{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}-rich.jsonl'
         rich_writer = JsonlWriter(rich_path)
 
     if autoSync:
+        global start_time_stamp, sync_watermark, sync_head
+        sync_watermark = load_watermark(_user_info.save_path, TIMELINE_MODE)
+        sync_head = dict(state.get('pending_watermark') or {}) if state and state.get('cursor') else {}
+    if autoSync and sync_watermark:     #按推文ID增量同步, 遇到已同步的推文即停止
+        start_time_stamp = backup_stamp
+        print(f'增量同步: 上次同步至推文 {sync_watermark["tweet_id"]} ({stamp2time(int(sync_watermark.get("created_at_ms") or 0))})')
+    elif autoSync:      #无同步记录(旧目录), 退回按文件名日期判断
         files = sorted(os.listdir(_user_info.save_path))
         if len(files) > 0:
-            global start_time_stamp
             re_rule = r'\d{4}-\d{2}-\d{2}'
             for i in files[::-1]:
                 if "-img_" in i:
@@ -873,6 +1086,12 @@ def main(_user_info: object):
 
     status = download_control(_user_info)
 
+    if near_dup_mode in ('flag', 'hardlink') and download_media:    #下载后近似去重(感知哈希), 结果写入 catalog 与 rich jsonl
+        if catalog_db:
+            run_catalog_stage(catalog_db, _user_info.screen_name, mode=near_dup_mode, max_distance=near_dup_max_distance, rich_writer=rich_writer if rich_output else None)
+        else:
+            print('near_dup 需要开启 catalog, 已跳过近似去重')
+
     if csv_file is not None:
         csv_file.csv_close()
     
@@ -883,9 +1102,19 @@ def main(_user_info: object):
         rich_writer.close()
         rich_writer = None
 
+    if catalog_db:
+        catalog_db.finish_run(catalog_run_id, status)
+        catalog_run_id = None
+
+    if media_inventory is not None:
+        media_inventory.close()
+        media_inventory = None
+
     if down_log and cache_data is not None:
         del cache_data
     if status == 'completed':
+        if autoSync and sync_head.get('tweet_id'):
+            save_watermark(_user_info.save_path, TIMELINE_MODE, sync_head)
         clear_state(_user_info.save_path)
         print(f'{_user_info.name}下载完成\n\n')
         return True
@@ -899,6 +1128,41 @@ def main(_user_info: object):
         print(f'{_user_info.name} 下载中断：未知原因（已保存进度到 {_user_info.save_path}/.crawl_state.json）\n')
         return False
 
+def sync_account(screen_name: str):
+    '''守护模式的单次增量同步, 返回 (状态, 新推文数)'''
+    global start_label, First_Page, sync_new_count
+    start_label = True
+    First_Page = True
+    sync_new_count = 0
+    result = main(User_info(screen_name))
+    if result == 'rate_limited' and api_scheduler is not None:
+        api_scheduler.budget(TIMELINE_MODE).pause_until(retry_after=60)    #至少冷却1分钟, 不会缩短已按响应头设置的暂停
+    return result, sync_new_count
+
+
+def run_daemon(user_list):
+    global autoSync, api_scheduler
+    from sync_scheduler import SyncScheduler, SCHEDULE_FILENAME, estimate_rate_from_rich
+
+    autoSync = True     #守护模式总是按 watermark 增量同步
+    api_scheduler = RateScheduler({
+        'UserByScreenName': (95, 900),
+        TIMELINE_MODE: (int(settings.get('daemon_api_rate_limit', 150) or 150), 900),
+    })
+    scheduler = SyncScheduler(
+        user_list,
+        settings['save_path'] + SCHEDULE_FILENAME,
+        min_interval=float(settings.get('daemon_min_interval_minutes', 30) or 30) * 60,
+        max_interval=float(settings.get('daemon_max_interval_hours', 24) or 24) * 3600,
+        target_new=float(settings.get('daemon_target_new_posts', 10) or 10),
+    )
+    for name in user_list:
+        scheduler.seed_rate(name, estimate_rate_from_rich(settings['save_path'] + name))
+    scheduler.save()
+    print(f'[daemon] 已载入 {len(user_list)} 个用户, 同步队列保存在 {scheduler.path}')
+    scheduler.run(sync_account)
+
+
 if __name__=='__main__':
     _start = time.time()
     if '--search' in sys.argv:
@@ -919,7 +1183,8 @@ if __name__=='__main__':
                     users.append(part.lstrip('@'))
         return users
 
-    cli_users = _parse_users(sys.argv[1:])
+    daemon_mode = '--daemon' in sys.argv
+    cli_users = _parse_users([a for a in sys.argv[1:] if a != '--daemon'])
     if cli_users:
         user_list = cli_users
     elif str(user_list_raw).strip():
@@ -938,10 +1203,20 @@ if __name__=='__main__':
         print('方式3: 关键词搜索(不限制用户)：python3 main.py --search \"关键词 filter:media\" --count 200')
         sys.exit(1)
 
+    if daemon_mode:
+        try:
+            run_daemon(user_list)
+        except KeyboardInterrupt:
+            print(f'\n[daemon] 已停止, 共调用{request_count}次API, 共下载{down_count}份图片/视频')
+        finally:
+            close_catalog()
+        sys.exit(0)
+
     for i in user_list:
         result = main(User_info(i))
         start_label = True
         First_Page = True
         if result == 'rate_limited':
             break
+    close_catalog()
     print(f'共耗时:{time.time()-_start}秒\n共调用{request_count}次API\n共下载{down_count}份图片/视频')
@@ -1,9 +1,10 @@
 import time
 import re
 from datetime import datetime
+from thumbnails import thumb_name
 
 class md_gen():
-    def __init__(self, save_path:str, user_name, screen_name, tweet_range, has_likes, media_count_limit) -> None:
+    def __init__(self, save_path:str, user_name, screen_name, tweet_range, has_likes, media_count_limit, thumb_format=None, thumb_videos=False) -> None:
         self.f = open(f'{save_path}/{screen_name}-{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_1.md', 'w', encoding='utf-8-sig', newline='')
         self.f.write(f"{user_name} {screen_name}\n")
         self.f.write(f"Tweet Range: {tweet_range}\n")
@@ -16,13 +17,48 @@ class md_gen():
         self.has_likes = has_likes
         
         self.media_count_limit = media_count_limit # 从配置文件中读取到的 单个 Markdown 最大媒体数量。
+        self.thumb_format = thumb_format # 缩略图格式(webp/jpg)，为 None 时直接引用原图
+        self.thumb_videos = thumb_videos # 是否有视频封面帧(需要 ffmpeg)
         self.current_tweet_info = ['', '', ''] # 生成 md 时使用，用于合并多个媒体到一个推文和生成日期标题。0-当前推文的 status id, 1-当前推文互动数据(md文本), 2-当前推文年月日期(不含转推，获取likes时也不使用)
         self.file_media_count = 0 # 当前文件中的媒体数量
         self.file_count = 1 # 已输出的文件数量
+        self.md_paths = [self.f.name] # 已输出的 Markdown 文件
+        self.media_tags = {} # 媒体文件名 -> (已写入的标签, 原文件标签)；md 先于下载写入, 缩略图/转码是否成功要到下载后才知道
+        self.tag_fixes = {} # 需要在 md_close 时改写的标签: 已写入的标签 -> 新标签
 
     def md_close(self):
         self.f.write('\n' + self.current_tweet_info[1] + '\n') # 输出最后一个推文的互动数据
         self.f.close()
+        if self.tag_fixes:
+            self._apply_tag_fixes()
+
+    def thumb_failed(self, file_name:str) -> None:
+        # 把 [![](_thumbs/x)](x) 换回不经缩略图的原文件标签
+        if file_name in self.media_tags:
+            written_tag, plain_tag = self.media_tags[file_name]
+            if written_tag != plain_tag:
+                self.tag_fixes[written_tag] = plain_tag
+
+    def media_renamed(self, file_name:str, new_name:str) -> None:
+        # 转码失败时保留了原格式文件: 改为直接引用新文件名(不经缩略图)
+        if file_name in self.media_tags:
+            written_tag, plain_tag = self.media_tags[file_name]
+            self.tag_fixes[written_tag] = plain_tag.replace(file_name.replace(' ', '%20'), new_name.replace(' ', '%20'))
+
+    def _apply_tag_fixes(self) -> None:
+        # 只改写含有待修正标签的文件
+        for md_path in self.md_paths:
+            with open(md_path, 'r', encoding='utf-8-sig', newline='') as f:
+                text = f.read()
+            new_text = text
+            for written_tag, new_tag in self.tag_fixes.items():
+                new_text = new_text.replace(written_tag, new_tag)
+            if new_text != text:
+                with open(md_path, 'w', encoding='utf-8-sig', newline='') as f:
+                    f.write(new_text)
+
+    def _plain_tag(self, csv_info, fixed_filename) -> str:
+        return f'<video src="{fixed_filename}" controls></video>' if 'Video' in csv_info[4] else f'[![]({fixed_filename})]({csv_info[5]})'
 
     def stamp2time(self, msecs_stamp:int) -> str:
         timeArray = time.localtime(msecs_stamp/1000)
@@ -51,6 +87,7 @@ class md_gen():
                 else:
                     new_filename = f'{self.save_path}/{self.screen_name}-{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}_{self.file_count}_{currentDate}.md'
                 self.f = open(new_filename, 'w', encoding='utf-8-sig', newline='')
+                self.md_paths.append(new_filename)
                 self.f.write(f"{self.user_name} {self.screen_name}\n")
                 self.f.write(f"Tweet Range: {self.tweet_range}\n")
                 self.f.write(f"Save Path: {self.save_path}\n\n")
@@ -65,5 +102,11 @@ class md_gen():
             self.current_tweet_info[0] = tweet_status_id
             self.current_tweet_info[1] = f'{csv_info[8]} Likes, {csv_info[9]} Retweets, {csv_info[10]} Replies'
         
-        self.f.write(f'<video src="{fixed_filename}" controls></video>' if 'Video' in csv_info[4] else f'[![]({fixed_filename})]({csv_info[5]})') # 输出当前推文的媒体标签(其中一张)
+        if self.thumb_format and ('Video' not in csv_info[4] or self.thumb_videos): # 显示缩略图/视频封面，点击打开本地原文件
+            fixed_thumbname = thumb_name(csv_info[6], self.thumb_format).replace(' ', '%20')
+            media_tag = f'[![]({fixed_thumbname})]({fixed_filename})'
+        else:
+            media_tag = self._plain_tag(csv_info, fixed_filename)
+        self.media_tags[csv_info[6]] = (media_tag, self._plain_tag(csv_info, fixed_filename))
+        self.f.write(media_tag) # 输出当前推文的媒体标签(其中一张)
         self.file_media_count += 1
@@ -0,0 +1,225 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+try:
+    from PIL import Image  # type: ignore
+
+    _PIL_OK = True
+except Exception:
+    Image = None
+    _PIL_OK = False
+
+
+IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+_N = 32     # image is reduced to 32x32 before the DCT
+_K = 8      # the top-left 8x8 low-frequency block gives a 64-bit hash
+_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * _N)) for x in range(_N)] for u in range(_K)]
+
+
+def phash_file(path: str) -> Optional[str]:
+    """64-bit DCT perceptual hash as 16 hex chars (None if the file can't be decoded). Runs in a worker process."""
+    try:
+        with Image.open(path) as img:
+            pixels = list(img.convert("L").resize((_N, _N), Image.LANCZOS).getdata())
+    except Exception:
+        return None
+    rows = [pixels[i * _N:(i + 1) * _N] for i in range(_N)]
+    # separable DCT-II, only the _K lowest frequencies in each direction
+    row_dct = [[sum(c * p for c, p in zip(_COS[u], row)) for u in range(_K)] for row in rows]
+    coeffs = [sum(_COS[v][y] * row_dct[y][u] for y in range(_N)) for v in range(_K) for u in range(_K)]
+    median = sorted(coeffs[1:])[(len(coeffs) - 1) // 2]    # the DC term only carries brightness
+    bits = 0
+    for c in coeffs:
+        bits = (bits << 1) | (1 if c > median else 0)
+    return f"{bits:016x}"
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance: radius queries touch only a small part of the index."""
+
+    def __init__(self) -> None:
+        self._root: Optional[list] = None   # [hash, item, {distance: child}]
+        self.size = 0
+
+    def add(self, h: int, item: Any) -> None:
+        self.size += 1
+        if self._root is None:
+            self._root = [h, item, {}]
+            return
+        node = self._root
+        while True:
+            d = hamming(h, node[0])
+            child = node[2].get(d)
+            if child is None:
+                node[2][d] = [h, item, {}]
+                return
+            node = child
+
+    def search(self, h: int, radius: int) -> List[Tuple[int, Any]]:
+        if self._root is None:
+            return []
+        out = []
+        stack = [self._root]
+        while stack:
+            node = stack.pop()
+            d = hamming(h, node[0])
+            if d <= radius:
+                out.append((d, node[1]))
+            for dist, child in node[2].items():
+                if d - radius <= dist <= d + radius:
+                    stack.append(child)
+        out.sort(key=lambda x: x[0])
+        return out
+
+
+def hash_files(paths: List[str], workers: Optional[int] = None) -> Iterable[Tuple[str, Optional[str]]]:
+    if not paths:
+        return []
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as pool:
+        return list(zip(paths, pool.map(phash_file, paths, chunksize=16)))
+
+
+def _sha256_file(path: str) -> Optional[str]:
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+def _hardlink(original: str, dup: str) -> bool:
+    tmp = dup + ".link"
+    try:
+        os.link(original, tmp)
+        os.replace(tmp, dup)
+        return True
+    except OSError:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return False
+
+
+def dedupe(
+    new_paths: List[str],
+    *,
+    index: Optional[BKTree] = None,
+    max_distance: int = 6,
+    hardlink_distance: Optional[int] = None,
+    workers: Optional[int] = None,
+) -> Tuple[Dict[str, str], List[Dict[str, Any]]]:
+    """
+    Hash `new_paths` in a process pool and match each against `index` (and the new files before it).
+    Returns ({path: phash}, duplicate records). Duplicates within `hardlink_distance` whose bytes are
+    identical to the original (same sha256) are replaced by a hardlink to it; the rest are only flagged,
+    since a pHash match (even distance 0) can be a different crop, size or quality of the same picture.
+    """
+    index = index if index is not None else BKTree()
+    hashes: Dict[str, str] = {}
+    dups: List[Dict[str, Any]] = []
+    for path, ph in hash_files(new_paths, workers):
+        hashes[path] = ph or ""
+        if not ph:
+            continue
+        h = int(ph, 16)
+        match = index.search(h, max_distance)
+        if not match:
+            index.add(h, path)
+            continue
+        distance, original = match[0]
+        sha256 = None
+        if (
+            hardlink_distance is not None
+            and distance <= hardlink_distance
+            and Path(original).suffix.lower() == Path(path).suffix.lower()    # never put JPEG bytes behind a .png name
+        ):
+            sha256 = _sha256_file(path)
+            if sha256 is None or sha256 != _sha256_file(original):
+                sha256 = None
+        linked = sha256 is not None and _hardlink(original, path)
+        dup = {
+            "kind": "media_duplicate",
+            "local_path": path,
+            "duplicate_of": original,
+            "distance": distance,
+            "phash": ph,
+            "action": "hardlink" if linked else "flag",
+        }
+        if linked:
+            dup["sha256"] = sha256
+            dup["size"] = os.path.getsize(path)
+        dups.append(dup)
+    return hashes, dups
+
+
+def run_catalog_stage(catalog, owner: Optional[str], *, mode: str = "flag", max_distance: int = 6, rich_writer=None, workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Post-download stage for main.py: hash this owner's not-yet-hashed images, match them against every
+    original already indexed in the catalog (across users and timelines), record phash/duplicate_of.
+    """
+    if not _PIL_OK:
+        print('近似去重需要安装 Pillow, 已跳过')
+        return []
+    new_paths = [p for p in catalog.media_without_phash(owner) if os.path.exists(p)]
+    if not new_paths:
+        return []
+    index = BKTree()
+    for path, ph in catalog.iter_phashes():
+        index.add(int(ph, 16), path)
+    hashes, dups = dedupe(new_paths, index=index, max_distance=max_distance, hardlink_distance=0 if mode == "hardlink" else None, workers=workers)
+    dup_of = {d["local_path"]: d["duplicate_of"] for d in dups}
+    for path, ph in hashes.items():
+        catalog.set_phash(path, ph, duplicate_of=dup_of.get(path))
+    for d in dups:
+        if d["action"] == "hardlink":
+            catalog.set_file_info(d["local_path"], size=d["size"], sha256=d["sha256"])
+    catalog.flush()
+    for d in dups:
+        if rich_writer is not None:
+            rich_writer.write(d)
+    if dups:
+        print(f'近似重复图片 {len(dups)} 张 (已记录到 catalog{", 字节完全相同的已替换为硬链接" if mode == "hardlink" else ""})')
+    return dups
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Find near-duplicate images (perceptual hash + BK-tree) in downloaded folders.")
+    parser.add_argument("paths", nargs="+", help="Folders to scan (recursively)")
+    parser.add_argument("--max-distance", type=int, default=6, help="Hamming distance (of 64 bits) still counted as a duplicate")
+    parser.add_argument("--hardlink", action="store_true", help="Replace byte-identical duplicates (distance 0, same sha256) with hardlinks")
+    parser.add_argument("--workers", type=int, default=None, help="Hashing processes (default: CPU count)")
+    parser.add_argument("-o", "--output", default=None, help="JSONL report (default: near_dups-<time>.jsonl)")
+    args = parser.parse_args(argv)
+
+    if not _PIL_OK:
+        raise SystemExit("Pillow is required: pip install pillow")
+
+    files = sorted(
+        str(p) for root in args.paths for p in Path(root).rglob("*")
+        if p.is_file() and p.suffix.lower() in IMAGE_EXTS
+    )
+    _, dups = dedupe(files, max_distance=args.max_distance, hardlink_distance=0 if args.hardlink else None, workers=args.workers)
+    out = args.output or f'near_dups-{datetime.now().strftime("%Y-%m-%d_%H-%M-%S")}.jsonl'
+    with open(out, "w", encoding="utf-8") as f:
+        for d in dups:
+            f.write(json.dumps(d, ensure_ascii=False) + "\n")
+    print(f"{len(files)} images, {len(dups)} near-duplicates -> {out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, Optional, Union
+
+
+DEFAULT_OCR_CACHE = "datas/ocr_cache.sqlite3"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr (
+    image_sha256  TEXT NOT NULL,
+    model         TEXT NOT NULL,
+    prompt_sha256 TEXT NOT NULL,
+    text          TEXT NOT NULL,
+    created_at    INTEGER NOT NULL,
+    PRIMARY KEY (image_sha256, model, prompt_sha256)
+);
+"""
+
+
+def prompt_key(*parts: str) -> str:
+    """sha256 of the prompt text(s): editing the prompt invalidates old answers without touching the table."""
+    return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+
+class OcrCache:
+    """
+    Persistent OCR results keyed by (sha256 of the original image bytes, model, prompt hash).
+
+    Shared by the worker threads of one run: lookups and inserts go through one connection under a
+    lock, and concurrent requests for the same image (reposts within a run) wait for the first call
+    instead of issuing their own.
+    """
+
+    def __init__(self, path: Union[str, os.PathLike]) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._inflight: Dict[tuple, threading.Event] = {}
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        self.conn.commit()
+
+    def get(self, image_sha256: str, model: str, prompt_sha256: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT text FROM ocr WHERE image_sha256 = ? AND model = ? AND prompt_sha256 = ?",
+                (image_sha256, model, prompt_sha256),
+            ).fetchone()
+        return row[0] if row else None
+
+    def put(self, image_sha256: str, model: str, prompt_sha256: str, text: str) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO ocr (image_sha256, model, prompt_sha256, text, created_at) VALUES (?, ?, ?, ?, ?)",
+                (image_sha256, model, prompt_sha256, text, int(time.time())),
+            )
+            self.conn.commit()
+
+    def get_or_compute(self, image_sha256: str, model: str, prompt_sha256: str, compute: Callable[[], str]) -> str:
+        """Cached text, or compute() once per key (other threads asking for the same key wait for it)."""
+        key = (image_sha256, model, prompt_sha256)
+        while True:
+            text = self.get(*key)
+            if text is not None:
+                with self._lock:
+                    self.hits += 1
+                return text
+            with self._lock:
+                event = self._inflight.get(key)
+                owner = event is None
+                if owner:
+                    event = self._inflight[key] = threading.Event()
+            if owner:
+                break
+            event.wait()     # if the owner failed, the loop falls through to computing it here
+        try:
+            text = compute()
+            self.put(*key, text)
+            with self._lock:
+                self.misses += 1
+            return text
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            event.set()
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
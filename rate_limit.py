@@ -0,0 +1,91 @@
+import asyncio
+import time
+from collections import deque
+from typing import Deque, Dict, Optional, Tuple
+
+
+def _try_int(value: object) -> Optional[int]:
+    if value is None:
+        return None
+    try:
+        return int(str(value).strip())
+    except Exception:
+        return None
+
+
+class RateBudget:
+    """
+    Sliding-window request budget shared by concurrent coroutines:
+    at most `max_calls` requests are started per `period` seconds.
+    Twitter's x-rate-limit-* headers can pause the whole budget until the window resets.
+    """
+
+    def __init__(self, max_calls: int, period: float) -> None:
+        self.max_calls = max(1, int(max_calls))
+        self.period = float(period)
+        self._starts: Deque[float] = deque()
+        self._paused_until = 0.0
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _next_delay(self, now: float) -> float:
+        if now < self._paused_until:
+            return self._paused_until - now
+        while self._starts and now - self._starts[0] >= self.period:
+            self._starts.popleft()
+        if len(self._starts) < self.max_calls:
+            return 0.0
+        return self.period - (now - self._starts[0])
+
+    async def acquire(self) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                delay = self._next_delay(time.monotonic())
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self._starts.append(time.monotonic())
+
+    def acquire_blocking(self) -> None:
+        while True:
+            delay = self._next_delay(time.monotonic())
+            if delay <= 0:
+                break
+            time.sleep(delay)
+        self._starts.append(time.monotonic())
+
+    def pause_until(self, reset_at: Optional[int] = None, retry_after: Optional[int] = None) -> float:
+        """Pause the budget until an epoch `reset_at` or for `retry_after` seconds; returns the pause length."""
+        if retry_after is not None:
+            wait = max(0.0, float(retry_after))
+        elif reset_at is not None:
+            wait = max(0.0, float(reset_at) - time.time())
+        else:
+            wait = self.period
+        self._paused_until = max(self._paused_until, time.monotonic() + wait)
+        return wait
+
+    def pause_from_headers(self, headers) -> float:
+        return self.pause_until(
+            reset_at=_try_int(headers.get('x-rate-limit-reset')),
+            retry_after=_try_int(headers.get('retry-after')),
+        )
+
+    def update_from_headers(self, headers) -> None:
+        remaining = _try_int(headers.get('x-rate-limit-remaining'))
+        if remaining is not None and remaining <= 0:
+            self.pause_until(reset_at=_try_int(headers.get('x-rate-limit-reset')))
+
+
+class RateScheduler:
+    """Per-endpoint budgets (Twitter limits each GraphQL operation separately), shared across targets."""
+
+    def __init__(self, limits: Dict[str, Tuple[int, float]], *, default: Tuple[int, float] = (50, 900)) -> None:
+        self.default = default
+        self._budgets: Dict[str, RateBudget] = {name: RateBudget(n, period) for name, (n, period) in limits.items()}
+
+    def budget(self, endpoint: str) -> RateBudget:
+        if endpoint not in self._budgets:
+            self._budgets[endpoint] = RateBudget(*self.default)
+        return self._budgets[endpoint]
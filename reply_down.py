@@ -1,6 +1,8 @@
 import httpx
 
+import argparse
 import asyncio
+import hashlib
 import re
 import os
 import csv
@@ -16,6 +18,8 @@ from tag_down import stamp2time
 from transaction_generate import get_transaction_id
 from transaction_generate import get_url_path
 from rich_output import JsonlWriter, extract_tweet_record, unwrap_tweet_result
+from rate_limit import RateScheduler
+from crawl_state import load_state, save_state, clear_state
 
 ##########配置区域##########
 
@@ -34,6 +38,9 @@ target_user = [
 # csv文件命名格式: ./{Tweet_ID or User_Name}/{datetime.now}-Reply.csv
 # 媒体文件命名格式: ./{Tweet_ID or User_Name}/{reply_date}_{replier_user_name}_{md5(media_url)[:4]}_reply.{mp4/png}
 
+# 批量模式: python3 reply_down.py @user1 @user2 ... 或 python3 reply_down.py --targets-file targets.txt (每行一个目标)
+# 未传入目标时使用上面的 target_user.
+
 
 time_range = "2024-02-06:2024-08-06"
 # 限定时间范围, 指定用户时生效, 格式如2023-02-01:2024-05-06, 不填留空则默认无限制.
@@ -78,48 +85,84 @@ class csv_gen():
         main_par_info[3] = self.stamp2time(main_par_info[3])    #传进来的是 int 时间戳, 故转换一下
         self.writer.writerow(main_par_info)
 
-def download_control(media_lst, rich_writer=None):
-    async def _main():
-        async def down_save(url, _file_name, is_image, meta=None):
-            if is_image:
-                url += '?format=png&name=4096x4096'
-
-            count = 0
-            while True:  #下载失败重试次数
-                try:
-                    async with semaphore:
-                        async with httpx.AsyncClient() as client:
-                            response = await client.get(quote_url(url), timeout=(3.05, 16))        #如果出现第五次或以上的下载失败,且确认不是网络问题,可以适当降低最大并发数量
-                    with open(_file_name,'wb') as f:
-                        f.write(response.content)
-                    if rich_writer and isinstance(meta, dict):
-                        rich_writer.write(
-                            {
-                                "kind": "reply_media",
-                                "parent_tweet_id": meta.get("parent_tweet_id"),
-                                "parent_tweet_url": meta.get("parent_tweet_url"),
-                                "reply_id": meta.get("reply_id"),
-                                "reply_url": meta.get("reply_url"),
-                                "created_at_ms": meta.get("created_at_ms"),
-                                "media_url": meta.get("media_url"),
-                                "media_type": meta.get("media_type"),
-                                "local_file": os.path.split(_file_name)[1],
-                                "local_path": _file_name,
-                            }
-                        )
+REPLY_STATE_FILENAME = '.reply_state.json'
+
+
+def new_rate_scheduler():
+    return RateScheduler({'TweetDetail': (api_rate_limit, 900), 'SearchTimeline': (search_rate_limit, 900)})
+
+
+class MediaPool():
+    # 评论媒体共用一个长连接的 AsyncClient, 所有评论的下载任务进入同一个池, 运行结束时统一等待完成
+    def __init__(self, max_concurrent:int, proxy=None) -> None:
+        self.max_concurrent = max_concurrent
+        self.proxy = proxy
+        self.client = None
+        self.semaphore = None
+        self._tasks = {}
+
+    async def __aenter__(self):
+        self.semaphore = asyncio.Semaphore(self.max_concurrent)
+        self.client = httpx.AsyncClient(
+            proxy=self.proxy,
+            timeout=httpx.Timeout(connect=10.0, read=60.0, write=60.0, pool=None),
+            limits=httpx.Limits(max_connections=self.max_concurrent, max_keepalive_connections=self.max_concurrent),
+            follow_redirects=True,
+        )
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.drain()
+        await self.client.aclose()
+
+    def submit(self, media_lst, rich_writer=None, owner=None):
+        # owner: 多个目标共用同一个池时, 用于只等待某个目标自己的下载任务
+        tasks = self._tasks.setdefault(owner, [])
+        for u in media_lst:   # 0:url 1:_file_name 2:is_image 3:meta
+            tasks.append(asyncio.create_task(self.down_save(u[0], u[1], u[2], u[3] if len(u) > 3 else None, rich_writer)))
+
+    async def drain(self, owner=None):
+        owners = [owner] if owner is not None else list(self._tasks)
+        for key in owners:
+            while self._tasks.get(key):
+                tasks, self._tasks[key] = self._tasks[key], []
+                await asyncio.gather(*tasks)
+            self._tasks.pop(key, None)
+
+    async def down_save(self, url, _file_name, is_image, meta=None, rich_writer=None):
+        if is_image:
+            url += '?format=png&name=4096x4096'
+
+        count = 0
+        while True:  #下载失败重试次数
+            try:
+                async with self.semaphore:
+                    response = await self.client.get(quote_url(url))        #如果出现第五次或以上的下载失败,且确认不是网络问题,可以适当降低最大并发数量
+                with open(_file_name,'wb') as f:
+                    f.write(response.content)
+                if rich_writer and isinstance(meta, dict):
+                    rich_writer.write(
+                        {
+                            "kind": "reply_media",
+                            "parent_tweet_id": meta.get("parent_tweet_id"),
+                            "parent_tweet_url": meta.get("parent_tweet_url"),
+                            "reply_id": meta.get("reply_id"),
+                            "reply_url": meta.get("reply_url"),
+                            "created_at_ms": meta.get("created_at_ms"),
+                            "media_url": meta.get("media_url"),
+                            "media_type": meta.get("media_type"),
+                            "local_file": os.path.split(_file_name)[1],
+                            "local_path": _file_name,
+                        }
+                    )
+                break
+            except Exception as e:
+                if count >= 50:
+                    print(f'{url}=====>第{count}次下载失败,已跳过')
                     break
-                except Exception as e:
-                    if count >= 50:
-                        print(f'{url}=====>第{count}次下载失败,已跳过')
-                        break
-                    count += 1
-                    print(e)
-                    print(f'{url}=====>第{count}次下载失败,正在重试')
-
-        semaphore = asyncio.Semaphore(max_concurrent_requests)
-        await asyncio.gather(*[asyncio.create_task(down_save(u[0], u[1], u[2], u[3] if len(u) > 3 else None)) for u in media_lst])   # 0:url 1:_file_name 2:is_image 3:meta
-
-    asyncio.run(_main())
+                count += 1
+                print(e)
+                print(f'{url}=====>第{count}次下载失败,正在重试')
 
 
 ##########高级配置区域##########
@@ -137,6 +180,33 @@ min_faves = 0
 min_retweets = 0
 # 筛选最小转推数, 同上.
 
+max_concurrent_threads = 4
+# 同时抓取的评论区(推文)数量, 评论区之间共享下方的API请求预算.
+
+max_concurrent_targets = 4
+# 批量模式下同时处理的目标数量, 所有目标共享同一个API请求预算与下载连接池.
+
+api_rate_limit = 150
+# 每15分钟最多发起的 TweetDetail(评论区) 请求数, 超出时自动等待而不是报错退出.
+
+search_rate_limit = 50
+# 每15分钟最多发起的 SearchTimeline(查找目标用户推文) 请求数.
+
+rate_limit_max_wait = 900
+# API次数超限时最多等待的秒数, 超过该时间则放弃当前请求.
+
+reply_thread_max_attempts = 3
+# 同一推文评论区最多尝试的运行次数, 仍未抓取完成则从检查点中移除; 推文已删除/受保护时直接移除.
+
+reply_checkpoint_interval = 10
+# 抓取评论区途中保存检查点(已写出的评论ID)的最短间隔秒数, 中断后重跑不会重复写出这些评论.
+
+reply_tree_max_depth = 3
+# 评论树展开深度: 跟随楼层内 "显示更多回复"(ShowMore) cursor 的最大层数, 填 0 则只获取每个楼层已展示的回复(直接回复的翻页不受影响).
+
+reply_tree_max_width = 4
+# 同一评论区内同时请求的 cursor 数量(展开宽度).
+
 search_advanced = ''
 # 即tag_down中的高级搜索
 # 当填写此项时, 所有配置都将失效, 包括target_user, 下载的内容以该组合获取到的内容为准.
@@ -145,9 +215,12 @@ search_advanced = ''
 
 # ------------------------ #
 
+THREAD_GONE_CODES = {34, 63, 136, 144, 179, 421}
+# 推文已删除/不存在/作者被封禁/受保护等, 重试也不会成功的 API 错误码
+
 
 class Reply_down():
-    def __init__(self, _target):
+    def __init__(self, _target, *, client=None, ct=None, scheduler=None, media_pool=None):
         self.target = _target
         self.folder_path = os.getcwd() + os.sep
         self.rich_writer = None
@@ -161,167 +234,346 @@ class Reply_down():
         self._headers['x-csrf-token'] = cookie_get(cookie, 'ct0')
 
         self.cursor = ''
-
-        self.ct = get_transaction_id()
-
-        if self.get_querystring():  #指定用户
-            self.folder_path = os.getcwd() + os.sep + del_special_char(self.user_name) + os.sep
+        self.run_key = None     # 仅搜索模式有检查点
+        self.pending = set()
+        self.threads = {}       # 待处理推文 -> {"seen": 已写出的评论ID, "attempts": 已失败的运行次数}
+        self._last_save = 0.0
+
+        self.ct = ct if ct is not None else get_transaction_id()
+        self.client = client
+        self.scheduler = scheduler if scheduler is not None else new_rate_scheduler()
+        self.media_pool = media_pool
+        self.thread_semaphore = asyncio.Semaphore(max_concurrent_threads)
+
+    async def run(self):
+        own_client = self.client is None
+        if own_client:
+            self.client = httpx.AsyncClient(timeout=httpx.Timeout(connect=10.0, read=30.0, write=30.0, pool=None))
+        own_pool = self.media_pool is None
+        if own_pool:
+            self.media_pool = MediaPool(max_concurrent_requests)
+            await self.media_pool.__aenter__()
+
+        try:
+            if self.get_querystring():  #指定用户
+                self.folder_path = os.getcwd() + os.sep + del_special_char(self.user_name) + os.sep
+            else:   #指定推文
+                self.folder_path = os.getcwd() + os.sep + del_special_char(self.tweet_id) + os.sep
             if not os.path.exists(self.folder_path):   #创建文件夹
                 os.makedirs(self.folder_path)
             self.csv = csv_gen(self.folder_path)
             if rich_output:
                 self.rich_writer = JsonlWriter(Path(self.folder_path) / f'{datetime.now().strftime("%Y-%m-%d %H-%M-%S")}-Reply.jsonl')
-            self.get_result()
 
-        else:   #指定推文
-            self.folder_path = os.getcwd() + os.sep + del_special_char(self.tweet_id) + os.sep
-            if not os.path.exists(self.folder_path):   #创建文件夹
-                os.makedirs(self.folder_path)
-            self.csv = csv_gen(self.folder_path)
-            if rich_output:
-                self.rich_writer = JsonlWriter(Path(self.folder_path) / f'{datetime.now().strftime("%Y-%m-%d %H-%M-%S")}-Reply.jsonl')
-            self.id2reply(self.tweet_id)
-
-        self.csv.csv_close()
-        if self.rich_writer:
-            self.rich_writer.close()
-
-    def id2reply(self, tweet_id:str):
-        _cursor = ''
-        is_completed = False
-        while not is_completed:
-            url = 'https://x.com/i/api/graphql/_8aYOgEDz35BrBcBal1-_w/TweetDetail?variables={"focalTweetId":"' + tweet_id + '","cursor":"' + _cursor + '","referrer":"tweet","with_rux_injections":false,"rankingMode":"Relevance","includePromotedContent":false,"withCommunity":true,"withQuickPromoteEligibilityTweetFields":true,"withBirdwatchNotes":true,"withVoice":true}&features={"rweb_video_screen_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":false,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":false,"responsive_web_grok_analysis_button_from_backend":false,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_enhance_cards_enabled":false}&fieldToggles={"withArticleRichContentState":true,"withArticlePlainText":false,"withGrokAnalyze":false,"withDisallowedReplyControls":false}'
-            _path = get_url_path(url)
-            url = quote_url(url)
-            self._headers['x-client-transaction-id'] = self.ct.generate_transaction_id(method='GET', path=_path)
-            response = httpx.get(url, headers=self._headers).text
+            if self.querystring_mode:
+                await self.get_result()
+            else:
+                await self.id2reply(self.tweet_id)
+        finally:
+            if own_pool:
+                await self.media_pool.__aexit__(None, None, None)
+            else:
+                await self.media_pool.drain(owner=self)
+            if own_client:
+                await self.client.aclose()
+            if getattr(self, 'csv', None):
+                self.csv.csv_close()
+            if self.rich_writer:
+                self.rich_writer.close()
+
+    async def get_json(self, url:str, errors:list = None):
+        # url 为未转义的原始地址; 每次请求单独生成 transaction id, 避免并发请求之间互相覆盖请求头
+        # errors 不为 None 时, API 返回的错误码会追加到其中, 供调用方区分永久性错误
+        _path = get_url_path(url)
+        budget = self.scheduler.budget(_path.rsplit('/', 1)[-1])
+        url = quote_url(url)
+        while True:
+            await budget.acquire()
+            headers = dict(self._headers)
+            headers['x-client-transaction-id'] = self.ct.generate_transaction_id(method='GET', path=_path)
             try:
+                resp = await self.client.get(url, headers=headers)
+            except Exception as e:
+                print(f'请求失败: {e}')
+                return None
+            budget.update_from_headers(resp.headers)
+            response = resp.text
+            try:
+                if resp.status_code == 429:
+                    raise ValueError(response)
                 raw_data = json.loads(response)
-                if isinstance(raw_data, dict) and raw_data.get('errors'):
-                    first = raw_data['errors'][0] if isinstance(raw_data['errors'], list) and raw_data['errors'] else raw_data['errors']
-                    code = first.get('code') if isinstance(first, dict) else None
-                    msg = first.get('message') if isinstance(first, dict) else str(first)
-                    print(f'API错误: {code} {msg}')
-                    if code == 353 or 'csrf' in str(msg).lower():
-                        print('提示: 需要 cookie 中的 ct0 与请求头 x-csrf-token 匹配；请更新/检查 cookie。')
-                    print(response)
-                    return
             except Exception:
-                if 'Rate limit exceeded' in response:
+                if resp.status_code == 429 or 'Rate limit exceeded' in response:
+                    wait = budget.pause_from_headers(resp.headers)
+                    if wait <= rate_limit_max_wait:
+                        print(f'API次数已超限, {int(wait)}秒后重试')
+                        continue
                     print('API次数已超限')
                 else:
                     print('获取数据失败')
                 print(response)
-                return
-            
-            raw_data_backup = raw_data
-            if not _cursor: #第一页第一条默认为父推文
-                raw_data = raw_data['data']['threaded_conversation_with_injections_v2']['instructions'][1]['entries']
-                if len(raw_data) == 2:
-                    return
-                raw_data.pop(0)
-            else:
-                raw_data = raw_data['data']['threaded_conversation_with_injections_v2']['instructions'][0]['entries']
-
-            if 'direction' in raw_data_backup['data']['threaded_conversation_with_injections_v2']['instructions'][-1] and raw_data_backup['data']['threaded_conversation_with_injections_v2']['instructions'][-1]['direction'] == 'Bottom':
-                is_completed = True
-            else:
-                _cursor = raw_data[-1]['content']['value']
-
-            for _reply in raw_data:
+                return None
+            if isinstance(raw_data, dict) and raw_data.get('errors'):
+                first = raw_data['errors'][0] if isinstance(raw_data['errors'], list) and raw_data['errors'] else raw_data['errors']
+                code = first.get('code') if isinstance(first, dict) else None
+                msg = first.get('message') if isinstance(first, dict) else str(first)
+                print(f'API错误: {code} {msg}')
+                if errors is not None:
+                    errors.append(code)
+                if code == 353 or 'csrf' in str(msg).lower():
+                    print('提示: 需要 cookie 中的 ct0 与请求头 x-csrf-token 匹配；请更新/检查 cookie。')
+                print(response)
+                return None
+            return raw_data
+
+    def detail_url(self, tweet_id:str, cursor:str) -> str:
+        return 'https://x.com/i/api/graphql/_8aYOgEDz35BrBcBal1-_w/TweetDetail?variables={"focalTweetId":"' + tweet_id + '","cursor":"' + cursor + '","referrer":"tweet","with_rux_injections":false,"rankingMode":"Relevance","includePromotedContent":false,"withCommunity":true,"withQuickPromoteEligibilityTweetFields":true,"withBirdwatchNotes":true,"withVoice":true}&features={"rweb_video_screen_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":false,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":false,"responsive_web_grok_analysis_button_from_backend":false,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_enhance_cards_enabled":false}&fieldToggles={"withArticleRichContentState":true,"withArticlePlainText":false,"withGrokAnalyze":false,"withDisallowedReplyControls":false}'
+
+    def parse_detail(self, raw_data, tweet_id:str):
+        # 返回 (评论节点列表, cursor列表); cursor 为 (value, 'bottom' | 'showmore')
+        # 顶层 conversationthread 的 items[0] 为直接回复, 其后为楼中楼; 楼层内的 ShowMore cursor 指向被折叠的楼中楼,
+        # 评论区末尾的 cursor-showmorethreads 则是被折叠的更多直接回复, 与 bottom 同层
+        replies = []
+        cursors = []
+
+        def _cursor_value(node):
+            if not isinstance(node, dict):
+                return None
+            if node.get('value'):
+                return node['value']
+            item_content = node.get('itemContent') or {}
+            return item_content.get('value')
+
+        def _items(items):
+            for _item in items:
+                entry_id = _item.get('entryId', '')
+                item_content = (_item.get('item') or {}).get('itemContent') or {}
+                if 'cursor' in entry_id or item_content.get('itemType') == 'TimelineTimelineCursor':
+                    value = _cursor_value(item_content)
+                    if value:
+                        cursors.append((value, 'showmore'))
+                    continue
+                if 'tweet_results' in item_content:
+                    replies.append(item_content['tweet_results'].get('result'))
+
+        instructions = raw_data['data']['threaded_conversation_with_injections_v2']['instructions']
+        for instruction in instructions:
+            if 'moduleItems' in instruction:    # ShowMore 展开返回 TimelineAddToModule
+                _items(instruction['moduleItems'])
+            for entry in instruction.get('entries') or []:
+                entry_id = entry.get('entryId', '')
+                content = entry.get('content') or {}
+                if 'conversationthread' in entry_id:
+                    _items(content.get('items') or [])
+                elif entry_id.startswith('cursor-bottom'):
+                    value = _cursor_value(content)
+                    if value:
+                        cursors.append((value, 'bottom'))
+                elif entry_id.startswith('cursor-showmorethreads'):
+                    value = _cursor_value(content)
+                    if value:
+                        cursors.append((value, 'bottom'))
+        return replies, cursors
+
+    async def id2reply(self, tweet_id:str, seen_replies:set = None):
+        # 返回 'done' / 'failed'(可重试) / 'gone'(推文已删除或不可见)
+        # 按 cursor 展开整棵评论树: bottom cursor 为同层翻页, 楼层内的 ShowMore cursor 深度+1;
+        # reply_tree_max_width 个 worker 共用一个 cursor 队列, 新发现的 cursor 立即被空闲 worker 取走, 评论按 reply_id 去重
+        # seen_replies 由检查点恢复时, 已写出过的评论不再重复写入 csv/jsonl
+        tree_depth = {tweet_id: 0}
+        seen_replies = set() if seen_replies is None else seen_replies
+        seen_cursors = set()
+        queue = asyncio.Queue()
+        queue.put_nowait(('', 0))
+        ok = True
+        gone = False
+
+        async def _fetch(cursor, depth):
+            nonlocal gone
+            errors = []
+            raw_data = await self.get_json(self.detail_url(tweet_id, cursor), errors)
+            if raw_data is None:
+                if not cursor and any(code in THREAD_GONE_CODES for code in errors):
+                    gone = True
+                return None
+            try:
+                return self.parse_detail(raw_data, tweet_id) + (depth,)
+            except Exception as e:
+                print(f'{tweet_id} 评论区解析失败: {e}')
+                return None
+
+        async def _worker():
+            nonlocal ok
+            while True:
+                cursor, depth = await queue.get()
                 try:
-                    if 'conversationthread' in _reply['entryId']:
-                        if not _reply['content']['items']:
-                            continue
-                        _reply = _reply['content']['items'][0]
-                        if 'conversationthread' not in _reply['entryId']:
-                            continue
-                        _reply = unwrap_tweet_result(_reply['item']['itemContent']['tweet_results']['result'])
-
-                        if 'editable_until_msecs' in _reply['edit_control']:
-                            editable_until = int(_reply['edit_control']['editable_until_msecs'])
-                        elif 'edit_control_initial' in _reply['edit_control'] and 'editable_until_msecs' in _reply['edit_control']['edit_control_initial']:
-                            editable_until = int(_reply['edit_control']['edit_control_initial']['editable_until_msecs'])
-                        else:
-                            continue
-                        time_stamp = editable_until - 3600000
-
-                        parent_tweet_url = f'https://x.com/{self.user_name}/status/{tweet_id}'
-                        replier_display_name = _reply['core']['user_results']['result']['legacy']['name']
-                        reply_screen_name = _reply['core']['user_results']['result']['legacy']['screen_name']
-                        replier_user_name = '@' + reply_screen_name
-                        reply_date = time_stamp
-                        reply_content = _reply['legacy']['full_text']
-                        reply_id = _reply["legacy"]["id_str"]
-                        reply_url = f'https://x.com/{reply_screen_name}/status/{reply_id}'
-                        reply_favorite_count = _reply['legacy']['favorite_count']
-                        reply_retweet_count = _reply['legacy']['retweet_count']
-                        reply_reply_count = _reply['legacy']['reply_count']
-                    else:
+                    result = await _fetch(cursor, depth)
+                    if result is None:
+                        ok = False
                         continue
-
+                    replies, cursors, depth = result
+                    for _reply in replies:
+                        self.handle_reply(_reply, tweet_id, seen_replies, tree_depth)
+                    for cursor, kind in cursors:
+                        next_depth = depth if kind == 'bottom' else depth + 1
+                        if cursor in seen_cursors or next_depth > reply_tree_max_depth:
+                            continue
+                        seen_cursors.add(cursor)
+                        queue.put_nowait((cursor, next_depth))
+                    self.checkpoint()
                 except Exception as e:
-                    print(e)
-                    continue
-
-                if rich_output and self.rich_writer:
-                    rec = extract_tweet_record(
-                        _reply,
-                        url_fallback_screen_name=reply_screen_name,
-                        editable_until_msecs=editable_until,
-                        context={"parent_tweet_id": tweet_id, "parent_tweet_url": parent_tweet_url},
-                        include_raw_legacy=rich_include_raw_legacy,
-                    )
-                    if rec:
-                        rec["kind"] = "reply"
-                        rec["parent_tweet_id"] = tweet_id
-                        rec["parent_tweet_url"] = parent_tweet_url
-                        self.rich_writer.write(rec)
-
-                per_reply_media_lst = []
-                if media_down and 'extended_entities' in _reply['legacy']:
-                    try:
-                        raw_media_lst = _reply['legacy']['extended_entities']['media']
-                        for _media in raw_media_lst:
-                            if 'video_info' in _media:
-                                media_url = get_heighest_video_quality(_media['video_info']['variants'])
-                                is_image = False
-                                _file_name = f'{self.folder_path}{stamp2time(time_stamp)}_{replier_user_name}_{hash_save_token(media_url)}_reply.mp4'
-                                media_type = "Video"
-                            else:
-                                media_url = _media['media_url_https']
-                                is_image = True
-                                _file_name = f'{self.folder_path}{stamp2time(time_stamp)}_{replier_user_name}_{hash_save_token(media_url)}_reply.png'
-                                media_type = "Image"
-
-                            meta = {
-                                "parent_tweet_id": tweet_id,
-                                "parent_tweet_url": parent_tweet_url,
-                                "reply_id": reply_id,
-                                "reply_url": reply_url,
-                                "created_at_ms": time_stamp,
-                                "media_url": media_url,
-                                "media_type": media_type,
-                            }
-                            per_reply_media_lst.append([media_url, _file_name, is_image, meta])
-                    except Exception as e:
-                        print(e)
+                    print(f'{tweet_id} 评论区处理失败: {e}')
+                    ok = False
+                finally:
+                    queue.task_done()
+
+        workers = [asyncio.create_task(_worker()) for _ in range(max(1, reply_tree_max_width))]
+        try:
+            await queue.join()
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+        if gone:
+            return 'gone'
+        return 'done' if ok else 'failed'
+
+    def handle_reply(self, _reply, tweet_id:str, seen_replies:set, tree_depth:dict):
+        try:
+            _reply = unwrap_tweet_result(_reply)
+
+            if 'editable_until_msecs' in _reply['edit_control']:
+                editable_until = int(_reply['edit_control']['editable_until_msecs'])
+            elif 'edit_control_initial' in _reply['edit_control'] and 'editable_until_msecs' in _reply['edit_control']['edit_control_initial']:
+                editable_until = int(_reply['edit_control']['edit_control_initial']['editable_until_msecs'])
+            else:
+                return
+            time_stamp = editable_until - 3600000
 
-                _csv_info = [parent_tweet_url, replier_display_name, replier_user_name, reply_date, reply_content, reply_url, reply_favorite_count, reply_retweet_count, reply_reply_count]
-                self.csv.data_input(_csv_info)
+            reply_id = _reply["legacy"]["id_str"]
+            if reply_id == tweet_id or reply_id in seen_replies:
+                return
+            seen_replies.add(reply_id)
+
+            parent_tweet_url = f'https://x.com/{self.user_name}/status/{tweet_id}'
+            replier_display_name = _reply['core']['user_results']['result']['legacy']['name']
+            reply_screen_name = _reply['core']['user_results']['result']['legacy']['screen_name']
+            replier_user_name = '@' + reply_screen_name
+            reply_date = time_stamp
+            reply_content = _reply['legacy']['full_text']
+            reply_url = f'https://x.com/{reply_screen_name}/status/{reply_id}'
+            reply_favorite_count = _reply['legacy']['favorite_count']
+            reply_retweet_count = _reply['legacy']['retweet_count']
+            reply_reply_count = _reply['legacy']['reply_count']
+
+            # 楼中楼: 记录直接上级评论, 以及在评论树中的深度(直接回复父推文为1)
+            in_reply_to = _reply['legacy'].get('in_reply_to_status_id_str') or tweet_id
+            parent_depth = tree_depth.get(in_reply_to)
+            reply_depth = parent_depth + 1 if parent_depth is not None else None
+            if reply_depth is not None:
+                tree_depth[reply_id] = reply_depth
+        except Exception as e:
+            print(e)
+            return
+
+        if rich_output and self.rich_writer:
+            rec = extract_tweet_record(
+                _reply,
+                url_fallback_screen_name=reply_screen_name,
+                editable_until_msecs=editable_until,
+                context={"parent_tweet_id": tweet_id, "parent_tweet_url": parent_tweet_url},
+                include_raw_legacy=rich_include_raw_legacy,
+            )
+            if rec:
+                rec["kind"] = "reply"
+                rec["parent_tweet_id"] = tweet_id
+                rec["parent_tweet_url"] = parent_tweet_url
+                rec["parent_reply_id"] = in_reply_to if in_reply_to != tweet_id else None
+                rec["reply_depth"] = reply_depth
+                self.rich_writer.write(rec)
+
+        per_reply_media_lst = []
+        if media_down and 'extended_entities' in _reply['legacy']:
+            try:
+                raw_media_lst = _reply['legacy']['extended_entities']['media']
+                for _media in raw_media_lst:
+                    if 'video_info' in _media:
+                        media_url = get_heighest_video_quality(_media['video_info']['variants'])
+                        is_image = False
+                        _file_name = f'{self.folder_path}{stamp2time(time_stamp)}_{replier_user_name}_{hash_save_token(media_url)}_reply.mp4'
+                        media_type = "Video"
+                    else:
+                        media_url = _media['media_url_https']
+                        is_image = True
+                        _file_name = f'{self.folder_path}{stamp2time(time_stamp)}_{replier_user_name}_{hash_save_token(media_url)}_reply.png'
+                        media_type = "Image"
+
+                    meta = {
+                        "parent_tweet_id": tweet_id,
+                        "parent_tweet_url": parent_tweet_url,
+                        "reply_id": reply_id,
+                        "reply_url": reply_url,
+                        "created_at_ms": time_stamp,
+                        "media_url": media_url,
+                        "media_type": media_type,
+                    }
+                    per_reply_media_lst.append([media_url, _file_name, is_image, meta])
+            except Exception as e:
+                print(e)
+
+        _csv_info = [parent_tweet_url, replier_display_name, replier_user_name, reply_date, reply_content, reply_url, reply_favorite_count, reply_retweet_count, reply_reply_count]
+        self.csv.data_input(_csv_info)
+
+        if per_reply_media_lst:
+            self.media_pool.submit(per_reply_media_lst, rich_writer=self.rich_writer, owner=self)
+
+    async def thread2reply(self, tweet_id:str):
+        info = self.threads.setdefault(tweet_id, {})
+        info['seen'] = set(info.get('seen') or [])
+        async with self.thread_semaphore:
+            try:
+                status = await self.id2reply(tweet_id, info['seen'])
+            except Exception as e:
+                print(f'{tweet_id} 评论区获取失败: {e}')
+                status = 'failed'
+        if status == 'failed':
+            info['attempts'] = info.get('attempts', 0) + 1
+            if info['attempts'] < reply_thread_max_attempts:
+                self.save_progress()    #保留在检查点中, 下次运行重试
+                return
+            print(f'{tweet_id} 评论区已连续 {info["attempts"]} 次未能抓取完成, 不再重试')
+        elif status == 'gone':
+            print(f'{tweet_id} 推文已删除或不可见, 跳过其评论区')
+        self.pending.discard(tweet_id)
+        self.threads.pop(tweet_id, None)
+        self.save_progress()
+
+    def save_progress(self):
+        # 进度检查点: 搜索cursor指向下一页, pending 为已排队但评论区尚未抓取完成的推文,
+        # threads 记录其中每条推文已写出的评论ID与失败次数
+        threads = {
+            tweet_id: {"seen": sorted(info.get('seen') or []), "attempts": info.get('attempts', 0)}
+            for tweet_id, info in self.threads.items() if tweet_id in self.pending
+        }
+        save_state(self.folder_path, run_key=self.run_key, cursor=self.cursor, extra={"target": self.target, "pending": sorted(self.pending), "threads": threads}, filename=REPLY_STATE_FILENAME)
+        self._last_save = time.monotonic()
 
-                if per_reply_media_lst:
-                    download_control(per_reply_media_lst, rich_writer=self.rich_writer)
-                    
+    def checkpoint(self):
+        # 抓取评论区途中定期保存, 中途崩溃后重跑不会重复写出已保存的评论
+        if self.run_key is not None and time.monotonic() - self._last_save >= reply_checkpoint_interval:
+            self.save_progress()
 
 
     def get_querystring(self):
+        self.querystring_mode = True
         if search_advanced:
             self.querystring = search_advanced
+            self.user_name = del_special_char(search_advanced) or 'search'
         else:
             if '/status/' in self.target: #指定推文
                 self.tweet_id = self.target.split('/status/')[-1]
                 self.user_name = self.target.split('/')[3]
+                self.querystring_mode = False
                 return False
             else:   #指定用户
                 self.user_name = self.target.split('@')[-1]
@@ -330,42 +582,23 @@ class Reply_down():
                     self.querystring = f"(from:{self.user_name}) min_replies:{min_replies} min_faves:{min_faves} min_retweets:{min_retweets} until:{self.until_time} since:{self.since_time}"
                 else:
                     self.querystring = f"(from:{self.user_name}) min_replies:{min_replies} min_faves:{min_faves} min_retweets:{min_retweets}"
-            return True
+        return True
 
-    def get_result(self):
-        _headers = self._headers
-        _headers['referer'] = f'https://twitter.com/search?q={quote(self.querystring)}&src=typed_query&f=media'
+    async def get_result(self):
+        self._headers['referer'] = f'https://twitter.com/search?q={quote(self.querystring)}&src=typed_query&f=media'
 
-        def get_tweet_list(url, _headers):
+        async def get_tweet_list(url):
+            # None = 请求失败 (检查点保留, 下次从当前cursor重试); [] = 搜索结果已到底
             tweet_lst = []
 
-            _path = get_url_path(url)
-            url = quote_url(url)
-            self._headers['x-client-transaction-id'] = self.ct.generate_transaction_id(method='GET', path=_path)
-            response = httpx.get(url, headers=_headers).text
-            try:
-                raw_data = json.loads(response)
-                if isinstance(raw_data, dict) and raw_data.get('errors'):
-                    first = raw_data['errors'][0] if isinstance(raw_data['errors'], list) and raw_data['errors'] else raw_data['errors']
-                    code = first.get('code') if isinstance(first, dict) else None
-                    msg = first.get('message') if isinstance(first, dict) else str(first)
-                    print(f'API错误: {code} {msg}')
-                    if code == 353 or 'csrf' in str(msg).lower():
-                        print('提示: 需要 cookie 中的 ct0 与请求头 x-csrf-token 匹配；请更新/检查 cookie。')
-                    print(response)
-                    return
-            except Exception:
-                if 'Rate limit exceeded' in response:
-                    print('API次数已超限')
-                else:
-                    print('获取数据失败')
-                print(response)
-                return
+            raw_data = await self.get_json(url)
+            if raw_data is None:
+                return None
             
             if not self.cursor: #第一次
                 raw_data = raw_data['data']['search_by_raw_query']['search_timeline']['timeline']['instructions'][-1]['entries']
                 if len(raw_data) == 2:
-                    return
+                    return []
                 self.cursor = raw_data[-1]['content']['value']
                 raw_data_lst = raw_data[:-2]
             else:
@@ -374,24 +607,91 @@ class Reply_down():
                 if 'entries' in raw_data[0]:
                     raw_data_lst = raw_data[0]['entries']
                 else:
-                    return
+                    return []
                 
             for tweet in raw_data_lst:
                 if 'tweet-' in tweet['entryId']:
                     tweet_id = tweet['entryId'].split('tweet-')[-1]
                     tweet_lst.append(tweet_id)
             return tweet_lst
-                
+
+        self.run_key = hashlib.sha256(self.querystring.encode('utf-8')).hexdigest()[:16]
+        self.pending = set()
+        state = load_state(self.folder_path, run_key=self.run_key, filename=REPLY_STATE_FILENAME)
+        if state:
+            self.cursor = state.get('cursor') or ''
+            self.pending = set(state.get('pending') or [])
+            self.threads = {tweet_id: dict(info) for tweet_id, info in (state.get('threads') or {}).items() if tweet_id in self.pending}
+            print(f'{self.target}: 检测到未完成进度, 从检查点继续 (待处理 {len(self.pending)} 条)')
+
+        # 搜索翻页本身是串行的(依赖cursor), 但每页的评论区立即并发抓取, 不等待上一页的评论区完成
+        thread_tasks = [asyncio.create_task(self.thread2reply(tweet_id)) for tweet_id in sorted(self.pending)]
+        search_failed = False
         while True:
             url = 'https://x.com/i/api/graphql/yiE17ccAAu3qwM34bPYZkQ/SearchTimeline?variables={"rawQuery":"' + quote(self.querystring) + '","count":"20","cursor":"' + self.cursor + '","querySource":"typed_query","product":"Latest"}&features={"rweb_video_screen_enabled":false,"profile_label_improvements_pcf_label_in_post_enabled":true,"rweb_tipjar_consumption_enabled":true,"verified_phone_label_enabled":false,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_timeline_navigation_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"premium_content_api_read_enabled":false,"communities_web_enable_tweet_community_results_fetch":true,"c9s_tweet_anatomy_moderator_badge_enabled":true,"responsive_web_grok_analyze_button_fetch_trends_enabled":false,"responsive_web_grok_analyze_post_followups_enabled":true,"responsive_web_jetfuel_frame":false,"responsive_web_grok_share_attachment_enabled":true,"articles_preview_enabled":true,"responsive_web_edit_tweet_api_enabled":true,"graphql_is_translatable_rweb_tweet_is_translatable_enabled":true,"view_counts_everywhere_api_enabled":true,"longform_notetweets_consumption_enabled":true,"responsive_web_twitter_article_tweet_consumption_enabled":true,"tweet_awards_web_tipping_enabled":false,"responsive_web_grok_show_grok_translated_post":false,"responsive_web_grok_analysis_button_from_backend":false,"creator_subscriptions_quote_tweet_preview_enabled":false,"freedom_of_speech_not_reach_fetch_enabled":true,"standardized_nudges_misinfo":true,"tweet_with_visibility_results_prefer_gql_limited_actions_policy_enabled":true,"longform_notetweets_rich_text_read_enabled":true,"longform_notetweets_inline_media_enabled":true,"responsive_web_grok_image_annotation_enabled":true,"responsive_web_enhance_cards_enabled":false}'
-            url = quote_url(url)
-            tweet_lst = get_tweet_list(url, _headers)
+            tweet_lst = await get_tweet_list(url)
+            if tweet_lst is None:
+                search_failed = True
+                print(f'{self.target}: 搜索翻页失败, 保留检查点, 下次运行从此处继续')
+                break
             if not tweet_lst:
                 break
+            tweet_lst = [tweet_id for tweet_id in tweet_lst if tweet_id not in self.pending]
+            self.pending.update(tweet_lst)
+            self.save_progress()
             for tweet_id in tweet_lst:
-                self.id2reply(tweet_id)
+                thread_tasks.append(asyncio.create_task(self.thread2reply(tweet_id)))
+        await asyncio.gather(*thread_tasks)
+        if search_failed:
+            self.save_progress()
+        elif not self.pending:
+            clear_state(self.folder_path, filename=REPLY_STATE_FILENAME)
+
+async def run_batch(targets, concurrency:int = max_concurrent_targets):
+    # 所有目标共用一个 transaction 生成器、API客户端、请求预算和下载池; 每个目标仍有各自的文件夹与检查点
+    ct = get_transaction_id()
+    scheduler = new_rate_scheduler()
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async with httpx.AsyncClient(timeout=httpx.Timeout(connect=10.0, read=30.0, write=30.0, pool=None)) as client:
+        async with MediaPool(max_concurrent_requests) as media_pool:
+            async def _one(_target):
+                async with semaphore:
+                    print(f'开始处理: {_target}')
+                    try:
+                        await Reply_down(_target, client=client, ct=ct, scheduler=scheduler, media_pool=media_pool).run()
+                    except Exception as e:
+                        print(f'处理失败: {_target} {e}')
+                        return
+                    print(f'处理完成: {_target}')
+
+            await asyncio.gather(*[_one(_target) for _target in targets])
+
+
+def load_targets(args) -> list:
+    targets = [t.strip() for t in args.targets if t.strip()]
+    if args.targets_file:
+        with open(args.targets_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    targets.append(line)
+    if not targets:
+        targets = list(target_user)
+    return list(dict.fromkeys(targets))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Download reply threads for users / tweets (batch mode).')
+    parser.add_argument('targets', nargs='*', help='@user or tweet URL (default: target_user in this file)')
+    parser.add_argument('--targets-file', default=None, help='Text file with one target per line')
+    parser.add_argument('--concurrency', type=int, default=max_concurrent_targets, help='Targets processed at the same time')
+    args = parser.parse_args(argv)
+
+    targets = load_targets(args)
+    print(f'共 {len(targets)} 个目标, 并发 {args.concurrency}')
+    asyncio.run(run_batch(targets, args.concurrency))
+
 
-for _target in target_user:
-    print(f'开始处理: {_target}')
-    Reply_down(_target)
-    print(f'处理完成: {_target}')
+if __name__ == '__main__':
+    main()
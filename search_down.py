@@ -214,12 +214,13 @@ class JsonlGen:
     def close(self):
         self.f.close()
 
-    def write_row(self, row: list):
+    def write_row(self, row: list) -> Optional[Dict[str, Any]]:
         record = self._row_to_record(row)
         if record is None:
-            return
+            return None
         self.f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
         self.rows_written += 1
+        return record
 
     def _row_to_record(self, row: list) -> Optional[Dict[str, Any]]:
         ms = _try_parse_msecs(row[0] if row else None)
@@ -403,6 +404,7 @@ class SearchDown:
         no_media: bool = False,
         *,
         verbose: bool = True,
+        writer: Optional[Any] = None,
     ):
         self.cookie = cookie
         self.raw_query = raw_query
@@ -432,7 +434,9 @@ class SearchDown:
         os.makedirs(self.folder_path, exist_ok=True)
 
         mode_label = self.mode if not text_down else 'text'
-        if output_format == 'csv':
+        if writer is not None:
+            self.csv = writer   # 调用方自带记录写入器 (需实现 write_row / rows_written / close), 如 spider_pipeline
+        elif output_format == 'csv':
             self.csv = CsvGen(self.folder_path, mode_label)
         elif output_format == 'jsonl':
             self.csv = JsonlGen(self.folder_path, mode_label)
@@ -802,6 +806,19 @@ class SearchDown:
             print(f'\n完成：共写入 {self.csv.rows_written} 条记录', flush=True)
 
 
+def resolve_max_concurrent_requests(settings: dict, override: Optional[int] = None) -> int:
+    """--workers, else $WORKERS / $MAX_CONCURRENT_REQUESTS, else settings.max_concurrent_requests, else 8."""
+    if override is not None:
+        return int(override)
+    env_workers = os.getenv('WORKERS') or os.getenv('MAX_CONCURRENT_REQUESTS')
+    if env_workers:
+        try:
+            return int(env_workers)
+        except Exception:
+            pass
+    return int(settings.get('max_concurrent_requests') or 8)
+
+
 def main(argv=None):
     parser = argparse.ArgumentParser(description='Search keywords to download Twitter/X media or text (not limited to a user).')
     parser.add_argument('query', nargs='?', help='Search keyword/filter, e.g. "openai lang:zh filter:media -filter:replies"')
@@ -834,16 +851,7 @@ def main(argv=None):
 
     save_path = settings.get('save_path') or os.path.join(os.getcwd(), 'data')
     proxy = settings.get('proxy') or None
-    max_concurrent_requests = int(settings.get('max_concurrent_requests') or 8)
-    if args.workers is not None:
-        max_concurrent_requests = int(args.workers)
-    else:
-        env_workers = os.getenv('WORKERS') or os.getenv('MAX_CONCURRENT_REQUESTS')
-        if env_workers:
-            try:
-                max_concurrent_requests = int(env_workers)
-            except Exception:
-                pass
+    max_concurrent_requests = resolve_max_concurrent_requests(settings, args.workers)
     down_count = args.count if args.count is not None else int(settings.get('search_down_count') or 100)
     verbose = not bool(args.quiet or settings.get('search_quiet'))
 
@@ -0,0 +1,310 @@
+import argparse
+import os
+import queue
+import shutil
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterable, Iterator, List, Optional, Set
+
+import analyze_styles
+from catalog import Catalog
+from image_fetch import BackgroundFetcher
+from ocr_cache import DEFAULT_OCR_CACHE, OcrCache
+from search_down import JsonlGen, SearchDown, del_special_char, resolve_max_concurrent_requests
+from twitter_to_spider_json import JsonArrayWriter, _iter_records, iter_notes, load_settings, sort_notes
+
+
+_DONE = object()
+
+
+class StreamingJsonlGen(JsonlGen):
+    """
+    Record writer handed to SearchDown: keeps the usual *-<mode>.jsonl record file and also puts each
+    record on `out` the moment it is written, so note building starts while the search is still paging.
+    """
+
+    def __init__(self, save_path: str, mode: str, out: "queue.Queue") -> None:
+        super().__init__(save_path, mode)
+        self._out = out
+
+    def write_row(self, row: list) -> Optional[Dict[str, Any]]:
+        record = super().write_row(row)
+        if record is not None:
+            self._out.put(record)
+        return record
+
+
+def iter_search_records(settings: dict, args: argparse.Namespace) -> Iterator[Dict[str, Any]]:
+    """Run SearchDown in a background thread and yield its records as they arrive (bounded queue = backpressure)."""
+    cookie = str(settings.get("cookie", "")).strip()
+    if not cookie or "auth_token=" not in cookie or "ct0=" not in cookie:
+        raise SystemExit("settings.json 的 cookie 需要至少包含 auth_token 与 ct0")
+    save_path = settings.get("save_path") or os.path.join(os.getcwd(), "data")
+    folder = args.folder or args.output_name or del_special_char(args.query)[:120] or "search"
+    mode = "text" if args.text else ("media_latest" if args.latest else "media")
+
+    records: "queue.Queue" = queue.Queue(maxsize=1000)
+    error: List[BaseException] = []
+
+    def _run() -> None:
+        try:
+            SearchDown(
+                cookie=cookie,
+                raw_query=args.query,
+                save_path=save_path,
+                down_count=args.count,
+                media_latest=args.latest,
+                text_down=args.text,
+                max_concurrent_requests=args.search_workers,
+                proxy=settings.get("proxy") or None,
+                folder_name=folder,
+                output_format="jsonl",
+                json_pretty=False,
+                no_media=True,
+                verbose=not (args.quiet or settings.get("search_quiet")),
+                writer=StreamingJsonlGen(os.path.join(save_path, folder), mode, records),
+            ).run()
+        except BaseException as e:     # re-raised in the consuming thread
+            error.append(e)
+        finally:
+            records.put(_DONE)
+
+    thread = threading.Thread(target=_run, name="search", daemon=True)
+    thread.start()
+    while True:
+        rec = records.get()
+        if rec is _DONE:
+            break
+        yield rec
+    thread.join()
+    if error:
+        raise error[0]
+
+
+def bounded_map(pool: ThreadPoolExecutor, fn: Callable[[Any], Any], items: Iterable[Any], window: int) -> Iterator[Any]:
+    """pool.map that keeps at most `window` items in flight and yields results in input order."""
+    pending: Deque[Future] = deque()
+    for item in items:
+        pending.append(pool.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+class ImageStage:
+    """
+    Per-note image work: find the note's images on disk (or fetch them through the shared async
+    downloader and its URL-keyed cache), then OCR each one. Download concurrency and the OCR pool
+    are sized independently.
+    """
+
+    def __init__(
+        self,
+        *,
+        fetch_workers: int,
+        ocr_workers: int,
+        cache_dir: Path,
+        catalog: Optional[Catalog] = None,
+        proxy: Optional[str] = None,
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.catalog = catalog
+        self._fetcher = BackgroundFetcher(cache_dir, concurrency=max(1, fetch_workers), proxy=proxy)
+        # ocr_workers requests in flight; with packing, enough waiting threads to fill each batch
+        self._ocr_pool = ThreadPoolExecutor(max_workers=analyze_styles.ocr_thread_count(ocr_workers), thread_name_prefix="ocr")
+
+    def resolve(self, note: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Map image_files refs to local paths, one slot per image_list entry. Runs on the thread that
+        opened the catalog (sqlite connections are per-thread).
+        """
+        paths: List[Optional[str]] = [None] * len(note.get("image_list") or [])
+        for pos, ref in enumerate(note.pop("image_files", None) or [], 1):
+            idx = analyze_styles.image_ref_index(ref, pos)
+            if 1 <= idx <= len(paths):
+                paths[idx - 1] = analyze_styles.resolve_image_ref(ref, self.catalog)
+        note["_paths"] = paths
+        return note
+
+    def image_paths(self, note: Dict[str, Any]) -> List[Optional[str]]:
+        """Local path per image_list entry; images not on disk are fetched (slot stays None if that fails)."""
+        urls = note.get("image_list") or []
+        paths = note.pop("_paths", None) or [None] * len(urls)
+        missing = [i for i, path in enumerate(paths) if not path and urls[i]]
+        if missing:
+            refs = self._fetcher.fetch_all([urls[i] for i in missing])
+            for i, ref in zip(missing, refs):
+                paths[i] = ref["path"] if ref else None
+        return paths
+
+    def ocr(self, note_id: str, paths: List[Optional[str]]) -> List[Dict[str, Any]]:
+        futures = [(idx, self._ocr_pool.submit(analyze_styles.process_image_file_task, idx, p)) for idx, p in enumerate(paths, 1)]
+        extracted = []
+        for idx, fut in futures:
+            try:
+                text = fut.result()
+            except Exception as exc:
+                print(f"[{note_id}] image {idx} failed: {exc}")
+                text = ""
+            extracted.append({"index": idx, "text": text})
+        return extracted
+
+    def close(self) -> None:
+        self._ocr_pool.shutdown(wait=True)
+        self._fetcher.close()
+
+
+def run_pipeline(
+    records: Iterable[Dict[str, Any]],
+    *,
+    output_dir: Path,
+    output_name: str,
+    stage: Optional[ImageStage] = None,
+    note_workers: int = 8,
+    selected: Optional[Set[str]] = None,
+    quiet: bool = False,
+) -> int:
+    """
+    records -> notes (as each tweet's group closes) -> images + OCR (bounded window of notes in flight)
+    -> disk-backed sort -> <name>.json, <name>_no_images.json and <name>_extract_texts.json, each written once.
+    """
+    def _process(note: Dict[str, Any]) -> Dict[str, Any]:
+        note_id = analyze_styles._normalize_note_id(note.get("note_id"))
+        if stage is None or not note_id or (selected and note_id not in selected):
+            return note
+        paths = stage.image_paths(note)
+        extracted = stage.ocr(note_id, paths) if paths else []
+        if paths and not quiet:
+            print(f"[{note_id}] extracted text from {len(paths)} image(s)")
+        note["images"] = analyze_styles._build_images(analyze_styles._normalize_image_list(note.get("image_list")), extracted)
+        note["_extracted"] = extracted
+        return note
+
+    notes = iter_notes(records, include_image_refs=stage is not None)
+    if stage is not None:
+        notes = (stage.resolve(n) for n in notes)
+    out_path = output_dir / f"{output_name}.json"
+    extract_writer = JsonArrayWriter(output_dir / f"{output_name}_extract_texts.json") if stage is not None else None
+    writer = JsonArrayWriter(out_path)
+    with ThreadPoolExecutor(max_workers=max(1, note_workers), thread_name_prefix="note") as note_pool:
+        processed = bounded_map(note_pool, _process, notes, window=max(1, note_workers) * 2)
+        for note in sort_notes(processed, tmp_dir=str(output_dir)):
+            note.pop("_paths", None)
+            extracted = note.pop("_extracted", None)
+            if extract_writer is not None and extracted is not None:
+                extract_writer.write({"note_id": note["note_id"], "images": extracted})
+            writer.write(note)
+    writer.close()
+    if extract_writer is not None:
+        extract_writer.close()
+    shutil.copyfile(out_path, output_dir / f"{output_name}_no_images.json")
+    return writer.count
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Search -> Spider_XHS-style notes -> image OCR, streamed in one process.")
+    parser.add_argument("query", nargs="?", default=None, help="Search keyword/filter (default: settings.search_query)")
+    parser.add_argument("--count", type=int, default=None, help="Approx total results to process (default: settings.search_down_count or 100)")
+    parser.add_argument("--latest", action="store_true", help="Use [Latest] tab (default is [Media])")
+    parser.add_argument("--text", action="store_true", help="Text-only mode (consumes lots of API calls)")
+    parser.add_argument("--records", default=None, help="Skip the search and read an existing *-media.jsonl/json record file")
+    parser.add_argument("--folder", default=None, help="Search output folder name (default: --output-name)")
+    parser.add_argument("--output-dir", default="datas/json_datas", help="Output directory (default: datas/json_datas)")
+    parser.add_argument("--output-name", required=True, help="Output JSON base name (without .json)")
+    parser.add_argument("--no-extract-images", action="store_true", help="Skip image text extraction")
+    parser.add_argument("--note-ids", default=None, help="Only extract images for these tweet IDs (comma-separated)")
+    parser.add_argument("--workers", type=int, default=None, help="Default for every stage below (default: $WORKERS or 8)")
+    parser.add_argument(
+        "--search-workers",
+        type=int,
+        default=None,
+        help="Concurrent search requests (default: --workers, else $WORKERS, else settings.max_concurrent_requests or 8)",
+    )
+    parser.add_argument("--fetch-workers", type=int, default=None, help="Concurrent image downloads")
+    parser.add_argument("--ocr-workers", type=int, default=None, help="Concurrent LLM OCR calls")
+    parser.add_argument("--image-cache", default="datas/image_cache", help="Where downloaded images are kept (keyed by URL; re-runs skip them)")
+    parser.add_argument("--ocr-cache", default=DEFAULT_OCR_CACHE, help="OCR result cache (image sha256 + model + prompt); re-runs skip the LLM for known images")
+    parser.add_argument("--no-ocr-cache", action="store_true", help="Always call the LLM, even for images seen before")
+    parser.add_argument("--images-per-request", type=int, default=analyze_styles.IMAGES_PER_REQUEST, help="Pack up to this many images into one LLM request")
+    parser.add_argument("--catalog", default=None, help="Catalog used to find moved images by sha256 (default: <save_path>/.catalog.sqlite3 if present)")
+    parser.add_argument("--quiet", action="store_true", help="Disable progress output")
+    parser.add_argument("--settings", default="settings.json", help="Path to settings.json")
+    args = parser.parse_args(argv)
+
+    settings = load_settings(args.settings)
+    if args.search_workers is None:
+        args.search_workers = resolve_max_concurrent_requests(settings, args.workers)
+    if args.workers is None:
+        args.workers = int(os.environ.get("WORKERS", "8"))
+    for name in ("fetch_workers", "ocr_workers"):
+        if getattr(args, name) is None:
+            setattr(args, name, args.workers)
+    extract = not args.no_extract_images
+    if extract and analyze_styles.API_KEY is None:
+        raise SystemExit("set OPENAI_API_KEY before running")
+
+    if args.records:
+        records = _iter_records(Path(args.records))
+    else:
+        args.query = str(args.query or settings.get("search_query", "")).strip()
+        if not args.query:
+            raise SystemExit("请提供搜索关键词 (命令行参数或 settings.json 的 search_query)")
+        if args.count is None:
+            args.count = int(settings.get("search_down_count") or 100)
+        records = iter_search_records(settings, args)
+
+    catalog = None
+    catalog_path = Path(args.catalog) if args.catalog else Path(settings.get("save_path") or "data") / ".catalog.sqlite3"
+    if extract and catalog_path.is_file():
+        catalog = Catalog(catalog_path)
+
+    analyze_styles.LLM_CONCURRENCY = args.ocr_workers
+    analyze_styles.IMAGES_PER_REQUEST = args.images_per_request
+    if extract and not args.no_ocr_cache:
+        analyze_styles.OCR_CACHE = OcrCache(args.ocr_cache)
+
+    stage = None
+    if extract:
+        stage = ImageStage(
+            fetch_workers=args.fetch_workers,
+            ocr_workers=args.ocr_workers,
+            cache_dir=Path(args.image_cache),
+            catalog=catalog,
+            proxy=settings.get("proxy") or None,
+        )
+    selected = {s.strip() for s in args.note_ids.split(",") if s.strip()} if args.note_ids else None
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    try:
+        count = run_pipeline(
+            records,
+            output_dir=output_dir,
+            output_name=args.output_name,
+            stage=stage,
+            note_workers=max(args.fetch_workers, args.ocr_workers),
+            selected=selected,
+            quiet=args.quiet,
+        )
+    finally:
+        if stage is not None:
+            stage.close()
+        analyze_styles.close_llm_client()
+        if catalog is not None:
+            catalog.close()
+        if analyze_styles.OCR_CACHE is not None:
+            if not args.quiet:
+                print(f"OCR cache: {analyze_styles.OCR_CACHE.hits} hit(s), {analyze_styles.OCR_CACHE.misses} LLM call(s)")
+            analyze_styles.OCR_CACHE.close()
+            analyze_styles.OCR_CACHE = None
+
+    print(f"Wrote {count} notes to {output_dir / (args.output_name + '.json')}")
+    if extract:
+        print(f"Image texts: {output_dir / (args.output_name + '_extract_texts.json')}")
+    print(f"No-images: {output_dir / (args.output_name + '_no_images.json')}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,174 @@
+import heapq
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+
+SCHEDULE_FILENAME = ".sync_schedule.json"
+
+
+def estimate_rate_from_rich(user_dir: Union[str, os.PathLike], *, min_span_hours: float = 24.0) -> Optional[float]:
+    """
+    Bootstrap an account's posting rate (tweets/hour) from its newest *-rich.jsonl:
+    number of tweet records divided by the time span they cover.
+    """
+    root = Path(user_dir)
+    if not root.is_dir():
+        return None
+    files = sorted(root.glob("*-rich.jsonl"), key=lambda p: p.stat().st_mtime, reverse=True)
+    if not files:
+        return None
+    count = 0
+    lo = hi = None
+    with open(files[0], "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except Exception:
+                continue
+            if not isinstance(rec, dict) or rec.get("kind") != "tweet":
+                continue
+            try:
+                ms = int(rec.get("created_at_ms"))
+            except Exception:
+                continue
+            count += 1
+            lo = ms if lo is None else min(lo, ms)
+            hi = ms if hi is None else max(hi, ms)
+    if not count:
+        return None
+    span_hours = max(min_span_hours, (hi - lo) / 3600000)
+    return count / span_hours
+
+
+class SyncScheduler:
+    """
+    Keeps many accounts fresh from one long-running process.
+
+    Every account has an EWMA of its posting rate (new tweets/hour observed per sync); the next
+    sync is scheduled after roughly `target_new` new tweets are expected, clamped to
+    [min_interval, max_interval] seconds, so busy accounts are polled often and quiet ones rarely.
+    The queue is a heap ordered by due time and is persisted to `.sync_schedule.json` after every
+    sync, so a restart picks up where the previous process left off.
+    """
+
+    def __init__(
+        self,
+        accounts: Iterable[str],
+        path: Union[str, os.PathLike],
+        *,
+        min_interval: float = 1800,
+        max_interval: float = 86400,
+        target_new: float = 10,
+        alpha: float = 0.3,
+    ) -> None:
+        self.path = Path(path)
+        self.min_interval = float(min_interval)
+        self.max_interval = max(float(max_interval), self.min_interval)
+        self.target_new = max(1.0, float(target_new))
+        self.alpha = float(alpha)
+
+        saved = self._read().get("accounts") or {}
+        now = time.time()
+        self.accounts: Dict[str, Dict[str, Any]] = {}
+        for name in dict.fromkeys(accounts):
+            entry = saved.get(name)
+            # accounts removed from the list are dropped; new ones are due immediately
+            self.accounts[name] = dict(entry) if isinstance(entry, dict) else {"next_at": now, "rate_per_hour": None, "failures": 0}
+        self._heap: List[Tuple[float, str]] = [(float(e.get("next_at") or now), name) for name, e in self.accounts.items()]
+        heapq.heapify(self._heap)
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fd, tmp_name = tempfile.mkstemp(prefix=SCHEDULE_FILENAME + ".", dir=str(self.path.parent))
+        try:
+            with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
+                json.dump({"version": 1, "accounts": self.accounts}, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+            os.replace(tmp_name, self.path)
+        finally:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+
+    def seed_rate(self, name: str, rate_per_hour: Optional[float]) -> None:
+        entry = self.accounts.get(name)
+        if entry is not None and entry.get("rate_per_hour") is None and rate_per_hour is not None:
+            entry["rate_per_hour"] = float(rate_per_hour)
+
+    def interval_for(self, rate_per_hour: Optional[float]) -> float:
+        if not rate_per_hour or rate_per_hour <= 0:
+            return self.max_interval
+        return min(self.max_interval, max(self.min_interval, self.target_new / rate_per_hour * 3600))
+
+    def _schedule(self, name: str, next_at: float) -> None:
+        self.accounts[name]["next_at"] = next_at
+        heapq.heappush(self._heap, (next_at, name))
+
+    def record(self, name: str, status: Any, new_count: int = 0, now: Optional[float] = None) -> float:
+        """Update the account after a sync attempt and return its next due time."""
+        now = time.time() if now is None else now
+        entry = self.accounts[name]
+        if status == "rate_limited":
+            # the shared rate budget is already paused until the window resets; just retry first
+            next_at = now
+        elif status is True:
+            last = entry.get("last_sync_at")
+            if last and now > last:
+                observed = new_count / ((now - last) / 3600)
+                prev = entry.get("rate_per_hour")
+                entry["rate_per_hour"] = observed if prev is None else self.alpha * observed + (1 - self.alpha) * prev
+            entry["last_sync_at"] = now
+            entry["last_new"] = int(new_count)
+            entry["failures"] = 0
+            next_at = now + self.interval_for(entry.get("rate_per_hour"))
+        else:
+            entry["failures"] = int(entry.get("failures") or 0) + 1
+            next_at = now + min(self.max_interval, self.min_interval * 2 ** (entry["failures"] - 1))
+        self._schedule(name, next_at)
+        return next_at
+
+    def pop_due(self) -> Optional[Tuple[float, str]]:
+        while self._heap:
+            next_at, name = heapq.heappop(self._heap)
+            entry = self.accounts.get(name)
+            if entry is not None and float(entry.get("next_at") or 0) == next_at:
+                return next_at, name
+        return None
+
+    def run(self, sync_fn: Callable[[str], Tuple[Any, int]], *, max_syncs: Optional[int] = None) -> None:
+        """
+        Loop forever (or for `max_syncs` syncs): sleep until the most overdue account is due,
+        call sync_fn(name) -> (status, new_tweet_count), reschedule, persist.
+        """
+        done = 0
+        while max_syncs is None or done < max_syncs:
+            item = self.pop_due()
+            if item is None:
+                return
+            next_at, name = item
+            wait = next_at - time.time()
+            if wait > 0:
+                print(f'[daemon] 下一个: {name}, {int(wait)}秒后同步')
+                time.sleep(wait)
+            try:
+                status, new_count = sync_fn(name)
+            except Exception as e:
+                print(f'[daemon] {name} 同步异常: {e}')
+                status, new_count = False, 0
+            due = self.record(name, status, new_count)
+            self.save()
+            done += 1
+            rate = self.accounts[name].get("rate_per_hour")
+            print(f'[daemon] {name}: 新推文 {new_count}, 估计 {rate or 0:.2f} 条/小时, 下次 {time.strftime("%Y-%m-%d %H:%M", time.localtime(due))}')
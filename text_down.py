@@ -9,6 +9,7 @@ from datetime import datetime
 
 from user_info import User_info
 from url_utils import quote_url, cookie_get, require_cookie_fields
+from user_cache import UserCache, apply_to_user_info, put_from_user_result
 
 
 
@@ -25,6 +26,9 @@ time_range = "2024-04-21:2030-01-01"
 has_retweet = False
 # 是否包含转推
 
+user_cache_ttl_hours = 24
+# 用户信息(rest_id/昵称/推数)本地缓存有效期(小时), 与 main.py / profile_down.py 共用 .user_cache.json; 填 0 则每次都请求
+
 ##########配置区域##########
 
 
@@ -77,6 +81,11 @@ def time_comparison(now):
 
 
 def get_other_info(_user_info, _headers):
+    cache = UserCache(ttl_hours=user_cache_ttl_hours) if user_cache_ttl_hours > 0 else None
+    cached = cache.get(_user_info.screen_name) if cache else None
+    if cached:
+        apply_to_user_info(_user_info, cached)
+        return True
     url = 'https://twitter.com/i/api/graphql/xc8f1g7BYqr6VTzTbvNlGw/UserByScreenName?variables={"screen_name":"' + _user_info.screen_name + '","withSafetyModeUserFields":false}&features={"hidden_profile_likes_enabled":false,"hidden_profile_subscriptions_enabled":false,"responsive_web_graphql_exclude_directive_enabled":true,"verified_phone_label_enabled":false,"subscriptions_verification_info_verified_since_enabled":true,"highlights_tweets_tab_ui_enabled":true,"creator_subscriptions_tweet_preview_api_enabled":true,"responsive_web_graphql_skip_user_profile_image_extensions_enabled":false,"responsive_web_graphql_timeline_navigation_enabled":true}&fieldToggles={"withAuxiliaryUserLabels":false}'
     try:
         response = httpx.get(quote_url(url), headers=_headers).text
@@ -85,7 +94,15 @@ def get_other_info(_user_info, _headers):
         _user_info.name = raw_data['data']['user']['result']['legacy']['name']
         _user_info.statuses_count = raw_data['data']['user']['result']['legacy']['statuses_count']
         _user_info.media_count = raw_data['data']['user']['result']['legacy']['media_count']
+        if cache:
+            put_from_user_result(cache, _user_info.screen_name, raw_data['data']['user']['result'])
+            cache.save()
     except Exception:
+        stale = cache.get(_user_info.screen_name, allow_stale=True) if cache else None
+        if stale:
+            print('获取信息失败, 使用本地缓存的用户信息')
+            apply_to_user_info(_user_info, stale)
+            return True
         print('获取信息失败')
         print(response)
         return False
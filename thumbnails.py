@@ -0,0 +1,100 @@
+import asyncio
+import os
+import shutil
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+try:
+    from PIL import Image, features  # type: ignore
+
+    _PIL_OK = True
+except Exception:
+    Image = None
+    features = None
+    _PIL_OK = False
+
+
+THUMB_DIR = "_thumbs"
+VIDEO_EXTS = (".mp4", ".webm", ".mov")
+
+
+def thumbnail_format() -> str:
+    """webp when this Pillow build can encode it, jpg otherwise."""
+    try:
+        return "webp" if features.check("webp") else "jpg"
+    except Exception:
+        return "jpg"
+
+
+def thumb_name(file_name: str, fmt: str) -> str:
+    """Relative path (from the media folder) of a media file's preview: _thumbs/<file>.<fmt>."""
+    return f"{THUMB_DIR}/{os.path.basename(file_name)}.{fmt}"
+
+
+def make_thumbnail(src: str, fmt: str, max_side: int = 480) -> Optional[str]:
+    """
+    Write a small preview next to `src` (video: poster frame via ffmpeg) and return its path.
+    Runs inside a worker process; returns None when the preview can't be made.
+    """
+    dst = os.path.join(os.path.dirname(src), thumb_name(src, fmt))
+    os.makedirs(os.path.dirname(dst), exist_ok=True)
+    tmp = dst + ".part"
+    pil_format = "WEBP" if fmt == "webp" else "JPEG"
+    try:
+        if src.lower().endswith(VIDEO_EXTS):
+            ffmpeg = shutil.which("ffmpeg")
+            if not ffmpeg:
+                return None
+            frame = dst + ".frame.png"
+            subprocess.run(
+                [ffmpeg, "-y", "-loglevel", "error", "-ss", "0.5", "-i", src, "-frames:v", "1", frame],
+                check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=120,
+            )
+            try:
+                with Image.open(frame) as img:
+                    img = img.convert("RGB")
+                    img.thumbnail((max_side, max_side))
+                    img.save(tmp, format=pil_format, quality=75)
+            finally:
+                os.unlink(frame)
+        else:
+            with Image.open(src) as img:
+                img.draft("RGB", (max_side, max_side))     # JPEG: decode at reduced scale
+                img = img.convert("RGB")
+                img.thumbnail((max_side, max_side))
+                img.save(tmp, format=pil_format, quality=75)
+        os.replace(tmp, dst)
+        return dst
+    except Exception:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        return None
+
+
+class Thumbnailer:
+    """Process pool generating md_gen previews right after each download lands."""
+
+    def __init__(self, max_workers: Optional[int] = None, *, max_side: int = 480, fmt: Optional[str] = None) -> None:
+        self.max_side = int(max_side)
+        self.fmt = fmt or thumbnail_format()
+        self.videos = shutil.which("ffmpeg") is not None
+        self._pool = ProcessPoolExecutor(max_workers=max_workers or min(4, os.cpu_count() or 1))
+
+    @staticmethod
+    def available() -> bool:
+        return _PIL_OK
+
+    async def make(self, src: str) -> Optional[str]:
+        if src.lower().endswith(VIDEO_EXTS) and not self.videos:
+            return None
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._pool, make_thumbnail, src, self.fmt, self.max_side)
+        except Exception:
+            return None
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
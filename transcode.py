@@ -0,0 +1,62 @@
+import asyncio
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+try:
+    from PIL import Image  # type: ignore
+
+    _PIL_OK = True
+except Exception:
+    Image = None
+    _PIL_OK = False
+
+
+_PIL_FORMATS = {"jpg": "JPEG", "jpeg": "JPEG", "png": "PNG", "webp": "WEBP"}
+
+
+def transcode_available() -> bool:
+    return _PIL_OK
+
+
+def transcode_file(src: str, dst: str, fmt: str, quality: int = 95) -> Tuple[int, str]:
+    """
+    Re-encode `src` as `fmt` into `dst` (atomically), delete `src`, return (size, sha256) of `dst`.
+    Runs inside a worker process.
+    """
+    pil_format = _PIL_FORMATS[fmt.lower()]
+    tmp = dst + ".part"
+    with Image.open(src) as img:
+        if pil_format == "JPEG" and img.mode not in ("RGB", "L"):
+            # JPEG has no alpha: flatten onto white like the server-side conversion does
+            rgba = img.convert("RGBA")
+            img = Image.new("RGB", rgba.size, (255, 255, 255))
+            img.paste(rgba, mask=rgba.split()[-1])
+        if pil_format == "JPEG":
+            img.save(tmp, format=pil_format, quality=quality, subsampling=0)
+        else:
+            img.save(tmp, format=pil_format)
+    os.replace(tmp, dst)
+    os.unlink(src)
+
+    h = hashlib.sha256()
+    with open(dst, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return os.path.getsize(dst), h.hexdigest()
+
+
+class Transcoder:
+    """Process pool that keeps CPU-heavy image encoding off the download event loop."""
+
+    def __init__(self, max_workers: Optional[int] = None, *, quality: int = 95) -> None:
+        self.quality = quality
+        self._pool = ProcessPoolExecutor(max_workers=max_workers or min(4, os.cpu_count() or 1))
+
+    async def transcode(self, src: str, dst: str, fmt: str) -> Tuple[int, str]:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._pool, transcode_file, src, dst, fmt, self.quality)
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=True)
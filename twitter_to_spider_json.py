@@ -1,11 +1,15 @@
 import argparse
 import base64
+import hashlib
+import heapq
+import itertools
 import json
 import os
 import re
+import tempfile
 import time
 from pathlib import Path
-from typing import Any, Dict, Iterable, List, Optional
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Tuple
 
 
 def _strip_jsonc_comments(text: str) -> str:
@@ -123,13 +127,46 @@ def _iter_records(path: Path) -> Iterable[Dict[str, Any]]:
         return
 
     with path.open("r", encoding="utf-8") as f:
-        data = json.load(f)
-    if isinstance(data, list):
-        for item in data:
+        for item in _iter_json_array(f):
             if isinstance(item, dict):
                 yield item
 
 
+def _iter_json_array(f: IO[str], chunk_size: int = 1 << 20) -> Iterator[Any]:
+    """Yield the items of a top-level JSON array one by one instead of json.load-ing the whole file."""
+    decoder = json.JSONDecoder()
+    buf = ""
+    pos = 0
+    eof = False
+    started = False
+    while True:
+        while pos < len(buf) and buf[pos] in " \t\r\n,":
+            pos += 1
+        if pos >= len(buf):
+            if eof:
+                return
+            chunk = f.read(chunk_size)
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            continue
+        if not started:
+            if buf[pos] != "[":
+                return    # not an array: same as the old json.load path, nothing to yield
+            started = True
+            pos += 1
+            continue
+        if buf[pos] == "]":
+            return
+        try:
+            item, pos = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            chunk = f.read(chunk_size)      # item cut at the chunk boundary
+            buf, pos, eof = buf[pos:] + chunk, 0, not chunk
+            continue
+        yield item
+
+
 def _find_latest_record_file(folder_path: Path) -> Optional[Path]:
     patterns = ["*-media.json", "*-media.jsonl", "*-text.json", "*-text.jsonl"]
     candidates: List[Path] = []
@@ -149,86 +186,284 @@ def _read_file_b64(path: Path) -> Optional[str]:
     return base64.b64encode(raw).decode("utf-8")
 
 
+def _file_ref(path: Path) -> Optional[Dict[str, Any]]:
+    """Reference to a local image (absolute path + sha256) that analyze_styles reads lazily."""
+    try:
+        h = hashlib.sha256()
+        size = 0
+        with path.open("rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+                size += len(chunk)
+    except Exception:
+        return None
+    return {"path": str(path.resolve()), "sha256": h.hexdigest(), "size": size}
+
+
+def _group_key(rec: Dict[str, Any]) -> str:
+    tweet_url = _to_str(rec.get("tweet_url"))
+    return _extract_tweet_id(tweet_url) or tweet_url
+
+
+def build_note(
+    tweet_id: str,
+    recs: List[Dict[str, Any]],
+    *,
+    include_image_base64: bool = False,
+    include_image_refs: bool = False,
+    now_str: str = "",
+) -> Dict[str, Any]:
+    """One note from the records (one per media item) of a single tweet."""
+    base = recs[0]
+    user_name = _normalize_username(_to_str(base.get("user_name")))
+    tweet_url = _to_str(base.get("tweet_url"))
+    canonical_url = f"https://x.com/{user_name}/status/{tweet_id}" if user_name and tweet_id.isdigit() else tweet_url
+
+    tweet_content = _to_str(base.get("tweet_content"))
+    title = tweet_content.strip().splitlines()[0] if tweet_content.strip() else ""
+    if len(title) > 120:
+        title = title[:117] + "..."
+
+    image_list: List[str] = []
+    image_base64: List[str] = []
+    image_files: List[Dict[str, Any]] = []
+    video_addr: Optional[str] = None
+
+    for r in recs:
+        media_type = _to_str(r.get("media_type"))
+        media_url = _to_str(r.get("media_url"))
+        saved_path = _to_str(r.get("saved_path"))
+        if media_type.lower() == "image":
+            if media_url:
+                image_list.append(media_url)
+            if include_image_base64 and saved_path:
+                b64 = _read_file_b64(Path(saved_path))
+                if b64:
+                    image_base64.append(b64)
+            if include_image_refs and saved_path and media_url:
+                ref = _file_ref(Path(saved_path))
+                if ref:
+                    # 1-based position in image_list: images without a saved file leave gaps, not shifts
+                    image_files.append({"index": len(image_list), **ref})
+        elif media_type.lower() == "video":
+            if not video_addr and media_url:
+                video_addr = media_url
+
+    note_type = "视频" if video_addr else ("图集" if image_list else "文本")
+
+    note: Dict[str, Any] = {
+        "note_id": tweet_id if tweet_id else "",
+        "note_url": canonical_url,
+        "note_type": note_type,
+        "title": title,
+        "desc": tweet_content,
+        "tags": [],
+        "upload_time": _format_msecs(base.get("tweet_date_ms")) or _to_str(base.get("tweet_date")),
+        "user_id": user_name,
+        "nickname": _to_str(base.get("display_name")),
+        "avatar": "",
+        "home_url": f"https://x.com/{user_name}" if user_name else "",
+        "ip_location": "",
+        "liked_count": _to_str(base.get("favorite_count")),
+        "collected_count": "",
+        "comment_count": _to_str(base.get("reply_count")),
+        "share_count": _to_str(base.get("retweet_count")),
+        "comments": [],
+        "image_list": image_list,
+        "video_addr": video_addr,
+        "video_cover": None,
+        "style_analysis": "未生成分析",
+        "style_updated_at": now_str,
+    }
+    # Keep output schema aligned with Spider_XHS *_no_images.json by default.
+    if include_image_base64:
+        note["image_base64"] = image_base64
+    if include_image_refs:
+        note["image_files"] = image_files
+    return note
+
+
+def _shift_index(item: Any, offset: int) -> Any:
+    if isinstance(item, dict) and isinstance(item.get("index"), int):
+        return {**item, "index": item["index"] + offset}
+    return item
+
+
+def merge_notes(note: Dict[str, Any], other: Dict[str, Any]) -> None:
+    """Fold a later record group of the same tweet into `note` (same result as grouping them up front)."""
+    offset = len(note["image_list"])
+    note["image_list"].extend(other.get("image_list") or [])
+    if "image_base64" in note:
+        note["image_base64"].extend(other.get("image_base64") or [])
+    if "image_files" in note:
+        note["image_files"].extend(_shift_index(ref, offset) for ref in other.get("image_files") or [])
+    # per-image OCR results (spider_pipeline runs OCR on each record group before the merge)
+    for key in ("images", "_extracted"):
+        if key in other:
+            note.setdefault(key, []).extend(_shift_index(item, offset) for item in other[key] or [])
+    if not note.get("video_addr"):
+        note["video_addr"] = other.get("video_addr")
+    note["note_type"] = "视频" if note["video_addr"] else ("图集" if note["image_list"] else "文本")
+
+
+def iter_notes(
+    records: Iterable[Dict[str, Any]],
+    *,
+    include_image_base64: bool = False,
+    include_image_refs: bool = False,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Notes in record order. Search records arrive grouped by tweet, so each note is built (and its
+    images read) as soon as its group closes; a tweet whose records are split yields several notes,
+    merged again by `sort_notes`.
+    """
+    now_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    for tweet_id, recs in itertools.groupby(records, key=_group_key):
+        yield build_note(
+            tweet_id,
+            list(recs),
+            include_image_base64=include_image_base64,
+            include_image_refs=include_image_refs,
+            now_str=now_str,
+        )
+
+
+def _sort_key(n: Dict[str, Any]) -> Tuple[str, str]:
+    return (n.get("upload_time") or "", n.get("note_id") or "")
+
+
+def _merge_adjacent(notes: Iterable[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+    pending: Optional[Dict[str, Any]] = None
+    for note in notes:
+        if pending is not None and note.get("note_id") == pending.get("note_id"):
+            merge_notes(pending, note)
+            continue
+        if pending is not None:
+            yield pending
+        pending = note
+    if pending is not None:
+        yield pending
+
+
+def _spool_line(key: Tuple[str, str], note: Dict[str, Any]) -> str:
+    # "<sort key>\t<note>": compact JSON never contains a raw tab, so runs can be merged on the key alone
+    return json.dumps(key, ensure_ascii=False) + "\t" + json.dumps(note, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+
+def _read_spool(f: IO[str]) -> Iterator[Tuple[Tuple[str, str], str]]:
+    for line in f:
+        key, _, body = line.partition("\t")
+        yield tuple(json.loads(key)), body
+
+
+def sort_notes(
+    notes: Iterable[Dict[str, Any]],
+    *,
+    tmp_dir: Optional[str] = None,
+    buffer_bytes: int = 64 << 20,
+) -> Iterator[Dict[str, Any]]:
+    """
+    Newest first (upload_time, note_id), split groups of one tweet merged, with memory bounded by
+    `buffer_bytes`. Notes are spooled to disk as they arrive; when they already came in order and no
+    tweet was split the spool is replayed as is, otherwise it is external-merge-sorted in sorted runs.
+    """
+    with tempfile.TemporaryDirectory(prefix="spider_json_", dir=tmp_dir) as tmp:
+        spool_path = os.path.join(tmp, "spool.jsonl")
+        ordered = True
+        split = False
+        prev_key: Optional[Tuple[str, str]] = None
+        prev_id: Optional[str] = None
+        first_key: Dict[str, Tuple[str, str]] = {}     # note_id -> key of its first group
+        with open(spool_path, "w", encoding="utf-8", newline="\n") as spool:
+            for note in notes:
+                key = _sort_key(note)
+                note_id = note.get("note_id") or ""
+                if note_id != prev_id:
+                    if note_id in first_key:
+                        split = True
+                        key = first_key[note_id]    # later groups sort next to the first, which supplies the base fields
+                    else:
+                        first_key[note_id] = key
+                if prev_key is not None and key > prev_key:
+                    ordered = False
+                prev_key, prev_id = key, note_id
+                spool.write(_spool_line(key, note))
+        first_key.clear()
+
+        if ordered and not split:
+            with open(spool_path, "r", encoding="utf-8") as f:
+                for _, body in _read_spool(f):
+                    yield json.loads(body)
+            return
+
+        runs: List[str] = []
+        with open(spool_path, "r", encoding="utf-8") as f:
+            entries = _read_spool(f)
+            while True:
+                chunk: List[Tuple[Tuple[str, str], str]] = []
+                size = 0
+                for key, body in entries:
+                    chunk.append((key, body))
+                    size += len(body)
+                    if size >= buffer_bytes:
+                        break
+                if not chunk:
+                    break
+                chunk.sort(key=lambda e: e[0], reverse=True)     # stable: split groups keep record order
+                run_path = os.path.join(tmp, f"run-{len(runs):05d}.jsonl")
+                with open(run_path, "w", encoding="utf-8", newline="\n") as out:
+                    for key, body in chunk:
+                        out.write(json.dumps(key, ensure_ascii=False) + "\t" + body)
+                runs.append(run_path)
+        os.unlink(spool_path)
+
+        files = [open(p, "r", encoding="utf-8") for p in runs]
+        try:
+            merged = heapq.merge(*(_read_spool(f) for f in files), key=lambda e: e[0], reverse=True)
+            yield from _merge_adjacent(json.loads(body) for _, body in merged)
+        finally:
+            for f in files:
+                f.close()
+
+
 def build_notes(
     records: Iterable[Dict[str, Any]],
     *,
     include_image_base64: bool = False,
+    include_image_refs: bool = False,
 ) -> List[Dict[str, Any]]:
-    grouped: Dict[str, List[Dict[str, Any]]] = {}
-    for rec in records:
-        tweet_url = _to_str(rec.get("tweet_url"))
-        tweet_id = _extract_tweet_id(tweet_url) or tweet_url
-        grouped.setdefault(tweet_id, []).append(rec)
+    notes = iter_notes(records, include_image_base64=include_image_base64, include_image_refs=include_image_refs)
+    return list(sort_notes(notes))
 
-    now_str = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-    notes: List[Dict[str, Any]] = []
-
-    for tweet_id, recs in grouped.items():
-        base = recs[0]
-        user_name = _normalize_username(_to_str(base.get("user_name")))
-        tweet_url = _to_str(base.get("tweet_url"))
-        canonical_url = f"https://x.com/{user_name}/status/{tweet_id}" if user_name and tweet_id.isdigit() else tweet_url
-
-        tweet_content = _to_str(base.get("tweet_content"))
-        title = tweet_content.strip().splitlines()[0] if tweet_content.strip() else ""
-        if len(title) > 120:
-            title = title[:117] + "..."
-
-        image_list: List[str] = []
-        image_base64: List[str] = []
-        video_addr: Optional[str] = None
-
-        for r in recs:
-            media_type = _to_str(r.get("media_type"))
-            media_url = _to_str(r.get("media_url"))
-            saved_path = _to_str(r.get("saved_path"))
-            if media_type.lower() == "image":
-                if media_url:
-                    image_list.append(media_url)
-                if include_image_base64 and saved_path:
-                    b64 = _read_file_b64(Path(saved_path))
-                    if b64:
-                        image_base64.append(b64)
-            elif media_type.lower() == "video":
-                if not video_addr and media_url:
-                    video_addr = media_url
-
-        note_type = "视频" if video_addr else ("图集" if image_list else "文本")
-
-        note: Dict[str, Any] = {
-            "note_id": tweet_id if tweet_id else "",
-            "note_url": canonical_url,
-            "note_type": note_type,
-            "title": title,
-            "desc": tweet_content,
-            "tags": [],
-            "upload_time": _format_msecs(base.get("tweet_date_ms")) or _to_str(base.get("tweet_date")),
-            "user_id": user_name,
-            "nickname": _to_str(base.get("display_name")),
-            "avatar": "",
-            "home_url": f"https://x.com/{user_name}" if user_name else "",
-            "ip_location": "",
-            "liked_count": _to_str(base.get("favorite_count")),
-            "collected_count": "",
-            "comment_count": _to_str(base.get("reply_count")),
-            "share_count": _to_str(base.get("retweet_count")),
-            "comments": [],
-            "image_list": image_list,
-            "video_addr": video_addr,
-            "video_cover": None,
-            "style_analysis": "未生成分析",
-            "style_updated_at": now_str,
-        }
-        # Keep output schema aligned with Spider_XHS *_no_images.json by default.
-        if include_image_base64:
-            note["image_base64"] = image_base64
-        notes.append(note)
-
-    def _sort_key(n: Dict[str, Any]):
-        return (n.get("upload_time") or "", n.get("note_id") or "")
-
-    notes.sort(key=_sort_key, reverse=True)
-    return notes
+
+class JsonArrayWriter:
+    """Writes items one at a time, byte-for-byte like json.dump(list, indent=2); the file appears atomically on close()."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.count = 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp = path.with_suffix(".tmp")
+        self._f = self._tmp.open("w", encoding="utf-8")
+        self._f.write("[")
+
+    def write(self, item: Any) -> None:
+        self._f.write(("," if self.count else "") + "\n  " + json.dumps(item, ensure_ascii=False, indent=2).replace("\n", "\n  "))
+        self.count += 1
+
+    def close(self) -> None:
+        self._f.write("\n]" if self.count else "]")
+        self._f.close()
+        self._tmp.replace(self.path)
+
+
+def write_json_array(path: Path, items: Iterable[Any]) -> int:
+    """Stream `items` into `path`; returns the item count."""
+    writer = JsonArrayWriter(path)
+    for item in items:
+        writer.write(item)
+    writer.close()
+    return writer.count
 
 
 def write_json(path: Path, data: Any) -> None:
@@ -250,6 +485,17 @@ def main() -> None:
         action="store_true",
         help="Include note['image_base64'] (default: omitted to match *_no_images.json style)",
     )
+    parser.add_argument(
+        "--image-refs",
+        action="store_true",
+        help="Include note['image_files'] ({path, sha256, size} of the saved images) instead of inline base64",
+    )
+    parser.add_argument(
+        "--sort-buffer-mb",
+        type=int,
+        default=64,
+        help="Memory for sorting notes; larger outputs are sorted in runs on disk (default: 64)",
+    )
     args = parser.parse_args()
 
     settings = load_settings(args.settings)
@@ -262,10 +508,19 @@ def main() -> None:
     if record_file is None:
         raise SystemExit(f"No search record file found in {folder_path} (expected *-media.json/jsonl)")
 
-    notes = build_notes(_iter_records(record_file), include_image_base64=args.include_image_base64)
     out_path = Path(args.output_dir) / f"{args.output_name}.json"
-    write_json(out_path, notes)
-    print(f"Wrote {len(notes)} notes to {out_path}")
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    notes = sort_notes(
+        iter_notes(
+            _iter_records(record_file),
+            include_image_base64=args.include_image_base64,
+            include_image_refs=args.image_refs,
+        ),
+        tmp_dir=str(out_path.parent),
+        buffer_bytes=args.sort_buffer_mb << 20,
+    )
+    count = write_json_array(out_path, notes)
+    print(f"Wrote {count} notes to {out_path}")
 
 
 if __name__ == "__main__":
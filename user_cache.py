@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Union
+
+
+USER_CACHE_FILENAME = ".user_cache.json"
+DEFAULT_TTL_HOURS = 24
+
+
+class UserCache:
+    """
+    Persistent screen_name -> {rest_id, name, statuses_count, media_count, fetched_at} cache
+    shared by main.py / text_down.py / profile_down.py, so repeat runs skip UserByScreenName.
+    rest_id never changes; entries older than the TTL are refreshed (counts may have moved),
+    but a stale entry is still usable when the refresh itself fails (e.g. rate limited).
+    """
+
+    def __init__(self, path: Union[str, os.PathLike] = USER_CACHE_FILENAME, *, ttl_hours: float = DEFAULT_TTL_HOURS) -> None:
+        self.path = Path(path)
+        self.ttl_seconds = float(ttl_hours) * 3600
+        self._dirty: Dict[str, Dict[str, Any]] = {}
+        self.data = self._read()
+
+    def _read(self) -> Dict[str, Dict[str, Any]]:
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except Exception:
+            return {}
+        return data if isinstance(data, dict) else {}
+
+    @staticmethod
+    def _key(screen_name: str) -> str:
+        return str(screen_name or "").strip().lstrip("@").lower()
+
+    def get(self, screen_name: str, *, allow_stale: bool = False) -> Optional[Dict[str, Any]]:
+        entry = self.data.get(self._key(screen_name))
+        if not isinstance(entry, dict) or not entry.get("rest_id"):
+            return None
+        if allow_stale:
+            return entry
+        try:
+            age = time.time() - float(entry.get("fetched_at") or 0)
+        except Exception:
+            return None
+        return entry if age < self.ttl_seconds else None
+
+    def put(self, screen_name: str, *, rest_id: Any, name: Any = None, statuses_count: Any = None, media_count: Any = None) -> None:
+        entry = {
+            "screen_name": str(screen_name).lstrip("@"),
+            "rest_id": str(rest_id),
+            "name": name,
+            "statuses_count": statuses_count,
+            "media_count": media_count,
+            "fetched_at": int(time.time()),
+        }
+        key = self._key(screen_name)
+        self.data[key] = entry
+        self._dirty[key] = entry
+
+    def save(self) -> None:
+        if not self._dirty:
+            return
+        # re-read before writing so parallel tools sharing the file don't drop each other's entries
+        merged = self._read()
+        merged.update(self._dirty)
+        self.data = merged
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_fd, tmp_name = tempfile.mkstemp(prefix=USER_CACHE_FILENAME + ".", dir=str(self.path.parent))
+        try:
+            with os.fdopen(tmp_fd, "w", encoding="utf-8") as f:
+                json.dump(merged, f, ensure_ascii=False, indent=2)
+                f.write("\n")
+            os.replace(tmp_name, self.path)
+        finally:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+        self._dirty = {}
+
+
+def apply_to_user_info(user_info: Any, entry: Dict[str, Any]) -> None:
+    user_info.rest_id = entry.get("rest_id")
+    user_info.name = entry.get("name")
+    user_info.statuses_count = entry.get("statuses_count")
+    user_info.media_count = entry.get("media_count")
+
+
+def put_from_user_result(cache: UserCache, screen_name: str, result: Dict[str, Any]) -> None:
+    """Store the rest_id/name/counts of a UserByScreenName `data.user.result` node."""
+    legacy = result.get("legacy") or {}
+    cache.put(
+        screen_name,
+        rest_id=result.get("rest_id"),
+        name=legacy.get("name"),
+        statuses_count=legacy.get("statuses_count"),
+        media_count=legacy.get("media_count"),
+    )